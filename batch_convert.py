@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:30:41 2026
+
+@author: Liam
+"""
+# Import General
+import argparse
+import os
+
+# Import from package
+from rgbtolasinator.converter.batch import read_manifest, run_manifest, read_journal
+from rgbtolasinator.converter.cache import PointCloudCache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=str, help='path to a csv/json manifest of jobs, with tif, xml, las and output columns')
+    parser.add_argument('--journal', type=str, default=None, help='path to the job journal. Defaults to the manifest path ending in .journal')
+    parser.add_argument('--workers', type=int, default=1, help='int, the number of las files to convert at once')
+    parser.add_argument('--bottom-per', type=int, default=1, help='int, the percentile to define the bottom of the tree as, for jobs that do not set one')
+    parser.add_argument('--top-per', type=int, default=99, help='int, the percentile to define the top of the tree as, for jobs that do not set one')
+    parser.add_argument('--use-class', action='store_true', help='if passed, use class to define bounds, for jobs that do not set it')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--cache-dir', type=str, default=None, help='if passed, folder to cache decoded las files in, so later runs on the same file skip decoding')
+    parser.add_argument('--cache-size', type=float, default=20, help='float, the largest the las cache can grow to, in GB')
+    parser.add_argument('--decode-threads', type=int, default=None, help='int, the number of threads to decompress LAZ files with. Defaults to one per core, per worker, 1 decodes on a single thread')
+    parser.add_argument('--prefetch-memory', type=float, default=0.25, help='float, the most memory the data read ahead of each stage (e.g. decoded las chunks) can use, in GB, per worker')
+    parser.add_argument('--rerun', action='store_true', help='if passed, rerun jobs the journal records as done')
+
+    args = parser.parse_args()
+    journal = args.journal if args.journal else os.path.splitext(args.manifest)[0] + '.journal'
+
+    print('Reading manifest...\n')
+    jobs = read_manifest(args.manifest)
+    print(f'{len(jobs)} jobs found!\n')
+
+    print('Converting...\n')
+    las_cache = PointCloudCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    n_skipped = run_manifest(jobs, journal, workers=args.workers, bottom_percentile=args.bottom_per, top_percentile=args.top_per,
+                             use_class=args.use_class, chunk_size=args.chunk_size, cache=las_cache, rerun=args.rerun,
+                             prefetch_bytes=int(args.prefetch_memory * 1024 ** 3), decode_threads=args.decode_threads)
+    n_done = len(read_journal(journal) & {job['output'] for job in jobs})
+    print(f'{n_skipped} jobs were already done and skipped\n')
+    print(f'{n_done} of {len(jobs)} jobs done, see {journal} for failures\n')
+    print('Complete!\n')
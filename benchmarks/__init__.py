@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:02:44 2026
+
+@author: Liam
+"""
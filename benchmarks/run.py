@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:31:07 2026
+
+@author: Liam
+"""
+# Import General
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+# Import from package
+from benchmarks.synthetic import make_scene
+from rgbtolasinator.converter.convert import infer_z_bounds, infer_z_bounds_batch
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, load_las, load_pointcloud, get_boxes_extent
+
+# Number of points and boxes of each scale
+SCALES = {'tiny': (200_000, 200),
+          'small': (1_000_000, 1_000),
+          'medium': (10_000_000, 10_000),
+          'large': (100_000_000, 100_000),
+          'huge': (300_000_000, 100_000)}
+
+
+def measure(fn, repeat=3, memory=True):
+    """Times a function, and measures the peak memory it allocates
+
+    Args:
+        fn (function): the function to run, with no arguments
+        repeat (int): the number of timed runs. The fastest is kept
+        memory (bool): whether to do one more run under tracemalloc, to get the peak memory allocated
+
+    Returns:
+        result: what fn returned
+        stats (dict): 'seconds' (fastest run), 'median_seconds', and 'peak_mb' (None if memory is False)
+    """
+    times = []
+    result = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        # Run separately, so tracing does not slow down the timed runs
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = peak / 1024 ** 2
+    return result, {'seconds': min(times), 'median_seconds': float(np.median(times)), 'peak_mb': peak_mb}
+
+
+def run_benchmarks(scene, stages=None, repeat=3, memory=True, per_box_limit=1000, plot_limit=50):
+    """Times and memory profiles each stage of the conversion on a scene (see make_scene())
+
+    Args:
+        scene (dict): the scene, from make_scene()
+        stages (list): the names of the stages to run. If None, runs them all
+        repeat (int): the number of timed runs of each stage
+        memory (bool): whether to measure the peak memory of each stage
+        per_box_limit (int): the most boxes to run the one box at a time stages on
+        plot_limit (int): the most trees to plot
+
+    Returns:
+        results (dict): stats of each stage (see measure()), with 'items', the number of boxes or points it handled,
+        and 'per_item_seconds'
+    """
+    results = {}
+
+    def _run(name, fn, items, needed=False):
+        """Measures a stage, if it is selected. A stage that is not selected is still run (untimed) if later ones need it"""
+        if stages is not None and name not in stages:
+            return fn() if needed else None
+        print(f'Running {name}...')
+        result, stats = measure(fn, repeat, memory)
+        stats['items'] = items(result) if callable(items) else items
+        stats['per_item_seconds'] = stats['seconds'] / max(stats['items'], 1)
+        results[name] = stats
+        print(f"    {stats['seconds']:.4f} s" + (f", {stats['peak_mb']:.1f} MB" if stats['peak_mb'] is not None else ''))
+        return result
+
+    _, px_boxes = _run('read_pascalvoc', lambda: read_pascalvoc(scene['xml']), lambda result: len(result[1]), needed=True)
+    n_boxes = len(px_boxes)
+    geo_boxes = _run('px_to_geo', lambda: px_to_geo(px_boxes, scene['tif']), n_boxes, needed=True)
+    extent = get_boxes_extent(geo_boxes)
+    n_points = scene['settings']['n_points']
+    _run('load_las', lambda: load_las(scene['las']), n_points)
+    pointcloud = _run('load_pointcloud', lambda: load_pointcloud(scene['las'], extent), len, needed=True)
+    index = _run('grid_index', lambda: GridIndex(pointcloud), len(pointcloud), needed=True)
+
+    sample = geo_boxes[:per_box_limit]
+    _run('infer_z_bounds', lambda: [infer_z_bounds(box, pointcloud, index=index) for box in sample], len(sample))
+    _run('infer_z_bounds_batch', lambda: infer_z_bounds_batch(geo_boxes, pointcloud, index=index), n_boxes)
+    _run('infer_z_bounds_batch_use_class', lambda: infer_z_bounds_batch(geo_boxes, pointcloud, use_class=True, index=index),
+         n_boxes)
+
+    # Plotting needs matplotlib and (for the tif) the font, so is imported only if it is run
+    if stages is None or 'plot_tree_projection' in stages:
+        from rgbtolasinator.figures.pc_figures import plot_tree_projection
+        with tempfile.TemporaryDirectory() as plot_folder:
+            plot_boxes = geo_boxes[:plot_limit]
+            _run('plot_tree_projection', lambda: plot_tree_projection(plot_boxes, pointcloud, plot_folder, index=index),
+                 len(plot_boxes))
+    if stages is None or 'plot_height_tif' in stages or 'plot_height_tif_tiled' in stages:
+        if not os.path.exists(os.path.join('fonts', 'arial.ttf')):
+            print('Skipping plot_height_tif, fonts/arial.ttf was not found in the working directory')
+        else:
+            from rgbtolasinator.figures.tif_figures import plot_height_tif, plot_height_tif_tiled
+            # [.., zmin, zmax] of a 1 unit tall tree, as the plots colour boxes by zmax
+            boxes_3d = [box[:6] + [0, 1] for box in geo_boxes]
+            save_folder = os.path.dirname(scene['tif'])
+            _run('plot_height_tif', lambda: plot_height_tif(boxes_3d, scene['tif'], save_folder), n_boxes)
+            _run('plot_height_tif_tiled', lambda: plot_height_tif_tiled(boxes_3d, scene['tif'], save_folder), n_boxes)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compares results against a baseline
+
+    Args:
+        results (dict): the 'results' of a benchmark run
+        baseline (dict): the 'results' of the baseline run
+        tolerance (float): how much slower (as a fraction) a stage can be before it counts as a regression
+
+    Returns:
+        rows (list): (stage, baseline seconds, seconds, ratio, status) of each stage in both
+    """
+    rows = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats['seconds'] / max(baseline[name]['seconds'], 1e-12)
+        if ratio > 1 + tolerance:
+            status = 'SLOWER'
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append((name, baseline[name]['seconds'], stats['seconds'], ratio, status))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=str, default='small', choices=list(SCALES), help='the size of the synthetic scene')
+    parser.add_argument('--data-dir', type=str, default='bench_data', help='folder to make (and reuse) the synthetic scenes in')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='where to save the results (json)')
+    parser.add_argument('--baseline', type=str, default=None, help='if passed, results (json) of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='float, how much slower a stage can be than the baseline before it is a regression')
+    parser.add_argument('--stages', type=str, nargs='+', default=None, help='if passed, only run these stages')
+    parser.add_argument('--repeat', type=int, default=3, help='int, the number of timed runs of each stage')
+    parser.add_argument('--no-memory', action='store_true', help='if passed, do not measure the peak memory of each stage')
+    parser.add_argument('--laz', action='store_true', help='if passed, the synthetic pointcloud is written as laz')
+    parser.add_argument('--seed', type=int, default=0, help='int, random seed of the synthetic scene')
+
+    args = parser.parse_args()
+
+    # Make (or reuse) the scene
+    n_points, n_boxes = SCALES[args.scale]
+    print(f'Making the {args.scale} scene ({n_points} points, {n_boxes} boxes)...\n')
+    scene = make_scene(os.path.join(args.data_dir, f'{args.scale}_{args.seed}' + ('_laz' if args.laz else '')),
+                       n_points, n_boxes, seed=args.seed, laz=args.laz)
+
+    # Benchmark
+    results = run_benchmarks(scene, args.stages, args.repeat, not args.no_memory)
+    output = {'meta': {'scale': args.scale, 'settings': scene['settings'], 'time': time.time(),
+                       'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+                       'cpu_count': os.cpu_count()},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'\nResults saved to {args.output}!\n')
+
+    # Compare to the baseline
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta']['settings'] != scene['settings']:
+            print('WARNING: the baseline was run on a different scene!')
+        rows = compare(results, baseline['results'], args.tolerance)
+        print(f"{'stage':<32}{'baseline':>12}{'now':>12}{'ratio':>8}")
+        for name, base_seconds, seconds, ratio, status in rows:
+            print(f'{name:<32}{base_seconds:>12.4f}{seconds:>12.4f}{ratio:>8.2f}  {status}')
+        if any(status == 'SLOWER' for *_, status in rows):
+            sys.exit(1)
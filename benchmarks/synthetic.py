@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:05:18 2026
+
+@author: Liam
+"""
+
+import json
+import os
+import numpy as np
+import laspy as lp
+from osgeo import gdal, osr
+from rgbtolasinator.converter.utils import write_pascalvoc
+
+
+def ground_height(x, y, extent):
+    """A smooth, rolling ground surface over the extent
+
+    Args:
+        x (np array): geospatial x
+        y (np array): geospatial y
+        extent (tuple): (xmin, ymin, xmax, ymax) of the scene
+
+    Returns:
+        z (np array): the ground height at each (x, y)
+    """
+    rel_x = x - extent[0]
+    rel_y = y - extent[1]
+    return 200 + 5 * np.sin(2 * np.pi * rel_x / 300) + 3 * np.cos(2 * np.pi * rel_y / 450) + 0.01 * rel_x
+
+
+def make_trees(n_trees, extent, seed=0):
+    """Places trees across the scene
+
+    Args:
+        n_trees (int): the number of trees
+        extent (tuple): (xmin, ymin, xmax, ymax) of the scene
+        seed (int): random seed
+
+    Returns:
+        trees (np array): rows of [x, y, crown radius, height]
+    """
+    rng = np.random.default_rng(seed)
+    radius = rng.uniform(1.5, 5, n_trees)
+    x = rng.uniform(extent[0] + radius, extent[2] - radius)
+    y = rng.uniform(extent[1] + radius, extent[3] - radius)
+    height = rng.uniform(5, 30, n_trees)
+    return np.column_stack([x, y, radius, height])
+
+
+def _make_points(rng, n_points, extent, trees):
+    """Makes one chunk of classified points: ground (2), vegetation under the tree crowns (3, 4, 5) and unclassified (1)"""
+    kind = rng.choice(3, size=n_points, p=[0.35, 0.6, 0.05] if len(trees) > 0 else [0.9, 0, 0.1])
+    x = rng.uniform(extent[0], extent[2], n_points)
+    y = rng.uniform(extent[1], extent[3], n_points)
+    classification = np.ones(n_points, dtype=np.uint8)
+    height = np.zeros(n_points)
+
+    # Ground points sit on the surface
+    ground = kind == 0
+    classification[ground] = 2
+    height[ground] = rng.normal(0, 0.05, np.sum(ground))
+
+    # Vegetation points fill a crown, lower towards its edge
+    veg = np.flatnonzero(kind == 1)
+    if len(veg) > 0:
+        tree = trees[rng.integers(0, len(trees), len(veg))]
+        r = tree[:, 2] * np.sqrt(rng.uniform(0, 1, len(veg)))
+        angle = rng.uniform(0, 2 * np.pi, len(veg))
+        x[veg] = tree[:, 0] + r * np.cos(angle)
+        y[veg] = tree[:, 1] + r * np.sin(angle)
+        height[veg] = tree[:, 3] * (1 - 0.6 * (r / tree[:, 2]) ** 2) * rng.beta(4, 1.2, len(veg))
+        classification[veg] = np.where(height[veg] < 2, 3, np.where(height[veg] < 5, 4, 5))
+
+    # Unclassified points anywhere up to 40 m
+    other = kind == 2
+    height[other] = rng.uniform(0, 40, np.sum(other))
+    return x, y, ground_height(x, y, extent) + height, classification
+
+
+def make_las(las_path, n_points, extent, trees, seed=0, chunk_size=5_000_000):
+    """Writes a classified las (or laz, by extension) of n_points points. Written in chunks, so any size fits in memory
+
+    Args:
+        las_path (str): where to save the file
+        n_points (int): the number of points
+        extent (tuple): (xmin, ymin, xmax, ymax) of the scene
+        trees (np array): the trees, from make_trees()
+        seed (int): random seed
+        chunk_size (int): the number of points to make and write at a time
+
+    Returns:
+        las_path (str): path the file was saved
+    """
+    rng = np.random.default_rng(seed)
+    header = lp.LasHeader(point_format=6, version='1.4')
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.floor([extent[0], extent[1], 0])
+    with lp.open(las_path, mode='w', header=header) as writer:
+        for start in range(0, n_points, chunk_size):
+            n_chunk = min(chunk_size, n_points - start)
+            x, y, z, classification = _make_points(rng, n_chunk, extent, trees)
+            points = lp.ScaleAwarePointRecord.zeros(n_chunk, header=header)
+            points.x = x
+            points.y = y
+            points.z = z
+            points.classification = classification
+            writer.write_points(points)
+    return las_path
+
+
+def make_tif(tif_path, extent, pixel_size=0.25, epsg=32612, seed=0, block_size=1024):
+    """Writes an RGB geotiff covering the extent. Written one block at a time, so any size fits in memory
+
+    Args:
+        tif_path (str): where to save the file
+        extent (tuple): (xmin, ymin, xmax, ymax) of the scene
+        pixel_size (float): the width of a pixel, in geospatial units
+        epsg (int): the EPSG code of the coordinate system
+        seed (int): random seed
+        block_size (int): the width and height of a block, in pixels
+
+    Returns:
+        tif_path (str): path the file was saved
+        transform (tuple): the geotransform, (x0, px_w, 0, y0, 0, -px_h)
+    """
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil((extent[2] - extent[0]) / pixel_size))
+    rows = int(np.ceil((extent[3] - extent[1]) / pixel_size))
+    transform = (extent[0], pixel_size, 0, extent[3], 0, -pixel_size)
+    driver = gdal.GetDriverByName('GTiff')
+    options = ['TILED=YES', f'BLOCKXSIZE={block_size}', f'BLOCKYSIZE={block_size}', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+    outdata = driver.Create(tif_path, cols, rows, 3, gdal.GDT_Byte, options=options)
+    outdata.SetGeoTransform(transform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    outdata.SetProjection(srs.ExportToWkt())
+    # A green, noisy canopy texture
+    base = [60, 110, 50]
+    for y_off in range(0, rows, block_size):
+        for x_off in range(0, cols, block_size):
+            block_cols = min(block_size, cols - x_off)
+            block_rows = min(block_size, rows - y_off)
+            noise = rng.integers(-40, 40, (block_rows, block_cols), dtype=np.int16)
+            for band, value in enumerate(base):
+                outdata.GetRasterBand(band + 1).WriteArray(np.clip(noise + value, 0, 255).astype(np.uint8), x_off, y_off)
+    outdata.FlushCache()
+    outdata = None
+    return tif_path, transform
+
+
+def make_xml(xml_path, trees, transform):
+    """Writes PascalVOC annotations of the trees' crowns, in the pixel coordinates of the geotiff
+
+    Args:
+        xml_path (str): where to save the file
+        trees (np array): the trees, from make_trees()
+        transform (tuple): the geotransform of the geotiff, from make_tif()
+
+    Returns:
+        xml_path (str): path the file was saved
+    """
+    x0, px_w, _, y0, _, px_h = transform
+    xmin = np.round((trees[:, 0] - trees[:, 2] - x0) / px_w).astype(int)
+    xmax = np.round((trees[:, 0] + trees[:, 2] - x0) / px_w).astype(int)
+    # Pixel rows count down from the top of the image
+    ymin = np.round((trees[:, 1] + trees[:, 2] - y0) / px_h).astype(int)
+    ymax = np.round((trees[:, 1] - trees[:, 2] - y0) / px_h).astype(int)
+    boxes = ([box_xmin, box_ymin, box_xmax, box_ymax, 'tree', 1, 0, 0]
+             for box_xmin, box_ymin, box_xmax, box_ymax in zip(xmin.tolist(), ymin.tolist(), xmax.tolist(), ymax.tolist()))
+    return write_pascalvoc(boxes, xml_path)
+
+
+def make_scene(folder, n_points, n_boxes, density=20, pixel_size=0.25, seed=0, laz=False):
+    """Makes a matching las, geotiff and PascalVOC annotation set. The scene is sized so the points have the given
+    density. Reuses a scene already made in folder with the same settings
+
+    Args:
+        folder (str): folder to save the scene in. Made if it does not exist
+        n_points (int): the number of las points
+        n_boxes (int): the number of trees (and so annotations)
+        density (float): points per square geospatial unit
+        pixel_size (float): the width of a geotiff pixel
+        seed (int): random seed
+        laz (bool): whether to write a compressed laz instead of a las
+
+    Returns:
+        scene (dict): paths of the 'las', 'tif' and 'xml' files, and the scene 'extent'
+    """
+    os.makedirs(folder, exist_ok=True)
+    settings = {'n_points': n_points, 'n_boxes': n_boxes, 'density': density, 'pixel_size': pixel_size,
+                'seed': seed, 'laz': laz}
+    meta_path = os.path.join(folder, 'scene.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            scene = json.load(f)
+        if scene['settings'] == settings and all(os.path.exists(scene[key]) for key in ['las', 'tif', 'xml']):
+            return scene
+
+    side = np.sqrt(n_points / density)
+    extent = (500000.0, 6000000.0, 500000.0 + np.ceil(side), 6000000.0 + np.ceil(side))
+    trees = make_trees(n_boxes, extent, seed)
+    las_path = make_las(os.path.join(folder, 'scene.laz' if laz else 'scene.las'), n_points, extent, trees, seed)
+    tif_path, transform = make_tif(os.path.join(folder, 'scene.tif'), extent, pixel_size, seed=seed)
+    xml_path = make_xml(os.path.join(folder, 'scene.xml'), trees, transform)
+    scene = {'settings': settings, 'las': las_path, 'tif': tif_path, 'xml': xml_path, 'extent': list(extent)}
+    with open(meta_path, 'w') as f:
+        json.dump(scene, f)
+    return scene
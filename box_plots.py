@@ -8,21 +8,42 @@ Created on Wed Apr 12 16:25:50 2023
 # Import General
 import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Import from package
 from rgbtolasinator.figures.pc_figures import plot_tree_projection
-from rgbtolasinator.converter.utils import load_las, read_pascalvoc, project_las_geospatial
-from rgbtolasinator.figures.tif_figures import plot_height_tif
+from rgbtolasinator.converter.utils import load_pointcloud, get_boxes_extent, set_decode_threads
+from rgbtolasinator.converter.formats import read_boxes
+from rgbtolasinator.figures.tif_figures import plot_height_tif, plot_height_tif_tiled
+from rgbtolasinator.converter.cache import PointCloudCache
+from rgbtolasinator.converter.catalog import LasCatalog
+from rgbtolasinator.converter.pipeline import set_memory_budget
+from rgbtolasinator import metrics
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--las-file', type=str, help='path to the las file')
+    parser.add_argument('--las-file', type=str, help='path to the las file, or a folder/glob of las tiles')
     parser.add_argument('--tif-file', type=str, help='path to the tif file')
-    parser.add_argument('--converted-xml', type=str, help='path to the converted xml (from convert_annots)')
+    parser.add_argument('--converted-xml', type=str, help='path to the converted annots (from convert_annots), .xml, .parquet, .gpkg or .npz')
     parser.add_argument('--save-folder', type=str, default='./plots/', help='folder to save the plots')
+    parser.add_argument('--workers', type=int, default=1, help='int, the number of processes to plot with')
+    parser.add_argument('--max-points', type=int, default=None, help='int, if passed, trees with more points are thinned to this many before plotting')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--cache-dir', type=str, default=None, help='if passed, folder to cache decoded las files in, so later runs on the same file skip decoding')
+    parser.add_argument('--cache-size', type=float, default=20, help='float, the largest the las cache can grow to, in GB')
+    parser.add_argument('--max-level', type=int, default=None, help='int, if passed and the las is COPC, only read its octree down to this level, for a quicker, thinned plot. 0 is the coarsest')
+    parser.add_argument('--tiled', action='store_true', help='if passed, draw the tif one block at a time, for orthos too large to fit in memory')
+    parser.add_argument('--block-size', type=int, default=2048, help='int, the block width and height in pixels, with --tiled')
+    parser.add_argument('--cog', action='store_true', help='if passed with --tiled, write the drawn tif as a Cloud Optimized GeoTIFF')
+    parser.add_argument('--decode-threads', type=int, default=None, help='int, the number of threads to decompress LAZ files with. Defaults to one per core, 1 decodes on a single thread')
+    parser.add_argument('--prefetch-memory', type=float, default=0.25, help='float, the most memory the data read ahead of each stage (e.g. decoded las chunks) can use, in GB')
+    parser.add_argument('--metrics-json', type=str, default=None, help='if passed, path (.json) to save the time, CPU time, peak memory and point counts of each stage to')
 
     args = parser.parse_args()
+    run_metrics = metrics.enable() if args.metrics_json else None
+    set_memory_budget(int(args.prefetch_memory * 1024 ** 3))
+    set_decode_threads(args.decode_threads)
 
     # Make the output path
     try:
@@ -31,17 +52,39 @@ if __name__ == '__main__':
         print(f'{args.save_folder} already exists and will be used\n')
     # Load converted boxes
     print('Loading annotations...\n')
-    name, boxes = read_pascalvoc(args.converted_xml)
+    crs, boxes = read_boxes(args.converted_xml)
     print('Annotations loaded!\n')
 
+    # Draw the boxes on the tif on a thread while the las is loaded (and the trees plotted), as it only needs the boxes
+    tif_pool = ThreadPoolExecutor(max_workers=1)
+    if args.tiled:
+        drawn = tif_pool.submit(plot_height_tif_tiled, boxes, args.tif_file, args.save_folder, block_size=args.block_size,
+                                cog=args.cog, workers=args.workers)
+    else:
+        drawn = tif_pool.submit(plot_height_tif, boxes, args.tif_file, args.save_folder)
+
     # Load LAS
     print('Loading las...\n')
-    las, las_transform_dict = load_las(args.las_file)
-    las = project_las_geospatial(las, las_transform_dict)
+    las_cache = PointCloudCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    if os.path.isfile(args.las_file):
+        las = load_pointcloud(args.las_file, get_boxes_extent(boxes), chunk_size=args.chunk_size, cache=las_cache,
+                              max_level=args.max_level)
+    else:
+        # A folder of tiles, only load the tiles under the boxes
+        las = LasCatalog(args.las_file).load(get_boxes_extent(boxes), chunk_size=args.chunk_size, cache=las_cache,
+                                             max_level=args.max_level)
     print('Las loaded!\n')
 
     # Plot
     print('Plotting...\n')
-    plot_tree_projection(boxes, las, args.save_folder)
-    plot_height_tif(boxes, args.tif_file, args.save_folder)
+    if args.workers > 1:
+        # Finish the tif before the plotting processes are started, so none are forked while it is being drawn
+        drawn.result()
+    plot_tree_projection(boxes, las, args.save_folder, workers=args.workers, max_points=args.max_points)
+    drawn.result()
+    tif_pool.shutdown()
     print('Plotting complete!\n')
+
+    if run_metrics is not None:
+        run_metrics.save(args.metrics_json)
+        print(f'Metrics saved to {args.metrics_json}!\n')
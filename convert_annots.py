@@ -6,49 +6,122 @@ Created on Wed Apr 12 11:30:30 2023
 """
 # Import General
 import argparse
-from tqdm import tqdm
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 # Import from package
-from rgbtolasinator.converter.convert import infer_z_bounds
-from rgbtolasinator.converter.utils import read_pascalvoc, write_pascalvoc, px_to_geo, load_las, project_las_geospatial
+from rgbtolasinator.converter.convert import infer_z_bounds_batch
+from rgbtolasinator.converter.parallel import infer_z_bounds_parallel
+from rgbtolasinator.converter.sketch import sketch_z_bounds
+from rgbtolasinator.converter.dtm import GroundGrid, load_ground_grid
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, load_pointcloud, get_boxes_extent, get_tif_crs, set_decode_threads
+from rgbtolasinator.converter.formats import write_boxes
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.cache import PointCloudCache
+from rgbtolasinator.converter.catalog import LasCatalog
+from rgbtolasinator.converter.incremental import BoxResultCache, get_las_set_identity
+from rgbtolasinator.converter.pipeline import set_memory_budget
+from rgbtolasinator import metrics
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--las-file', type=str, help='path to the las file')
+    parser.add_argument('--las-file', type=str, help='path to the las file, or a folder/glob of las tiles')
     parser.add_argument('--xml-file', type=str, help='path to PascalVOC image annotations')
     parser.add_argument('--tif-file', type=str, help='path to the geospatially projected tif file the annotations are associated with')
-    parser.add_argument('--save-path', type=str, default='converted_annots.xml', help='where to save the converted annots (ends in .xml)')
+    parser.add_argument('--save-path', type=str, default='converted_annots.xml', help='where to save the converted annots. Ends in .xml (PascalVOC), or .parquet, .gpkg or .npz for a columnar file that keeps the CRS')
     parser.add_argument('--bottom-per', type=int, default=1, help='int, the percentile to define the bottom of the tree as')
     parser.add_argument('--top-per', type=int, default=99, help='int, the percentile to define the top of the tree as')
     parser.add_argument('--use-class', action='store_true', help='if passed, use class to define bounds. If passed, bottom_per considers only ground points and top_per considers only veg points')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--cache-dir', type=str, default=None, help='if passed, folder to cache decoded las files in, so later runs on the same file skip decoding')
+    parser.add_argument('--cache-size', type=float, default=20, help='float, the largest the las cache can grow to, in GB')
+    parser.add_argument('--workers', type=int, default=1, help='int, the number of processes to convert with')
+    parser.add_argument('--sketch-resolution', type=float, default=None, help='float, if passed, estimate the bounds while streaming the las, without loading it. The bounds are within this many z units of the exact ones')
+    parser.add_argument('--ground-cell-size', type=float, default=None, help='float, if passed with --use-class, the bottom of each tree is taken from a ground grid with cells this wide, instead of the ground points in each box')
+    parser.add_argument('--ground-grid', type=str, default=None, help='if passed with --ground-cell-size, path (.npz) to save the ground grid to, and reuse it from on later runs')
+    parser.add_argument('--result-cache', type=str, default=None, help='if passed, folder to cache the bounds of each box in, so later runs on an edited xml only convert the added or changed boxes')
+    parser.add_argument('--decode-threads', type=int, default=None, help='int, the number of threads to decompress LAZ files with. Defaults to one per core, 1 decodes on a single thread')
+    parser.add_argument('--prefetch-memory', type=float, default=0.25, help='float, the most memory the data read ahead of each stage (e.g. decoded las chunks) can use, in GB')
+    parser.add_argument('--metrics-json', type=str, default=None, help='if passed, path (.json) to save the time, CPU time, peak memory and point counts of each stage to')
 
     args = parser.parse_args()
-
-    print('Loading LiDAR...\n')
-    # Load PC
-    las_data, las_transform_dict = load_las(args.las_file)
-    las_data = project_las_geospatial(las_data, las_transform_dict)
-    print('LiDAR Loaded!\n')
+    run_metrics = metrics.enable() if args.metrics_json else None
+    set_memory_budget(int(args.prefetch_memory * 1024 ** 3))
+    set_decode_threads(args.decode_threads)
 
     print('Loading Annotations...\n')
-    # Load annots
-    name, px_boxes = read_pascalvoc(args.xml_file)
-    geo_boxes = px_to_geo(px_boxes, args.tif_file)
+    # Load annots, and look up the tif's CRS for writing, on threads while the las tiles are scanned
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        annots = pool.submit(lambda: px_to_geo(read_pascalvoc(args.xml_file)[1], args.tif_file))
+        crs = pool.submit(get_tif_crs, args.tif_file)
+        catalog = None if os.path.isfile(args.las_file) else LasCatalog(args.las_file)
+        geo_boxes = annots.result()
     print('Annotations Loaded!\n')
 
-    print('Converting...\n')
-    # Convert
-    boxes_3d = []
-    pbar = tqdm(total=len(geo_boxes))
-    for box in geo_boxes:
-        box_3d = infer_z_bounds(box, las_data, bottom_percentile=args.bottom_per, top_percentile=args.top_per, use_class=args.use_class)
-        boxes_3d.append(box_3d)
-        pbar.update(1)
+    result_cache = None
+    if args.sketch_resolution is not None:
+        print('Converting while streaming LiDAR...\n')
+        # Stream only the las files under the annotations into per box sketches
+        las_paths = args.las_file if catalog is None else catalog.tiles_in_extent(get_boxes_extent(geo_boxes))
+        zmin, zmax = sketch_z_bounds(geo_boxes, las_paths, bottom_percentile=args.bottom_per, top_percentile=args.top_per, use_class=args.use_class, resolution=args.sketch_resolution, chunk_size=args.chunk_size)
+    else:
+        # Reuse the bounds of the boxes that have not changed since the last run
+        zmin = np.full(len(geo_boxes), np.nan)
+        zmax = np.full(len(geo_boxes), np.nan)
+        todo = np.arange(len(geo_boxes))
+        if args.result_cache is not None:
+            result_cache = BoxResultCache(args.result_cache)
+            las_paths = args.las_file if catalog is None else catalog.paths
+            box_keys = result_cache.box_keys(geo_boxes, get_las_set_identity(las_paths), args.bottom_per, args.top_per, args.use_class, args.ground_cell_size if args.use_class else None)
+            zmin, zmax, todo = result_cache.lookup(args.xml_file, box_keys)
+            print(f'{len(geo_boxes) - len(todo)} boxes are unchanged since the last run, {len(todo)} are new or changed\n')
+        todo_boxes = [geo_boxes[i] for i in todo]
+
+        if len(todo_boxes) > 0:
+            print('Loading LiDAR...\n')
+            # Load PC, keeping only the points under the annotations
+            las_cache = PointCloudCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+            if catalog is None:
+                las_data = load_pointcloud(args.las_file, get_boxes_extent(todo_boxes), chunk_size=args.chunk_size, cache=las_cache)
+            else:
+                # A folder of tiles, only load the tiles under the annotations
+                las_data = catalog.load(get_boxes_extent(todo_boxes), chunk_size=args.chunk_size, cache=las_cache)
+            # Index the PC, so each box only looks at the points near it
+            las_index = GridIndex(las_data)
+            print('LiDAR Loaded!\n')
+
+            # Rasterize the ground once, for every box to look up
+            ground_grid = None
+            if args.use_class and args.ground_cell_size is not None:
+                if args.ground_grid is not None:
+                    grid_las_paths = args.las_file if catalog is None else catalog.tiles_in_extent(get_boxes_extent(todo_boxes))
+                    ground_grid = load_ground_grid(args.ground_grid, las_data, grid_las_paths, get_boxes_extent(todo_boxes), cell_size=args.ground_cell_size, percentile=args.bottom_per)
+                else:
+                    ground_grid = GroundGrid.from_pointcloud(las_data, cell_size=args.ground_cell_size, percentile=args.bottom_per)
+
+            print('Converting...\n')
+            # Convert
+            if args.workers > 1:
+                todo_zmin, todo_zmax = infer_z_bounds_parallel(todo_boxes, las_data, bottom_percentile=args.bottom_per, top_percentile=args.top_per, use_class=args.use_class, index=las_index, workers=args.workers, ground_grid=ground_grid)
+            else:
+                todo_zmin, todo_zmax = infer_z_bounds_batch(todo_boxes, las_data, bottom_percentile=args.bottom_per, top_percentile=args.top_per, use_class=args.use_class, index=las_index, ground_grid=ground_grid)
+            zmin[todo] = todo_zmin
+            zmax[todo] = todo_zmax
+    boxes_3d = [box[:6] + [box_zmin, box_zmax] for box, box_zmin, box_zmax in zip(geo_boxes, zmin.tolist(), zmax.tolist())]
     print('Conversion Complete!\n')
 
     print('Writing file...\n')
-    # Write
-    write_pascalvoc(boxes_3d, args.save_path)
+    # Write, while the bounds are saved to the result cache
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        written = pool.submit(write_boxes, boxes_3d, args.save_path, crs=crs.result())
+        if result_cache is not None:
+            result_cache.store(args.xml_file, box_keys, zmin, zmax, las_paths)
+        written.result()
     print(f'File saved to {args.save_path}!\n')
     print('Complete!\n')
+
+    if run_metrics is not None:
+        run_metrics.save(args.metrics_json)
+        print(f'Metrics saved to {args.metrics_json}!\n')
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:41:05 2026
+
+@author: Liam
+"""
+# Import General
+import argparse
+
+# Import from package
+from rgbtolasinator.converter.export import export_tree_las
+from rgbtolasinator.converter.pipeline import set_memory_budget
+from rgbtolasinator.converter.utils import set_decode_threads
+from rgbtolasinator.converter.formats import read_boxes
+from rgbtolasinator import metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--las-file', type=str, help='path to the las file')
+    parser.add_argument('--converted-xml', type=str, help='path to the converted annots (from convert_annots), .xml, .parquet, .gpkg or .npz')
+    parser.add_argument('--save-folder', type=str, default='./trees/', help='folder to save the tree las files to')
+    parser.add_argument('--clip-z', action='store_true', help='if passed, keep only the points between the zmin and zmax of each box')
+    parser.add_argument('--laz', action='store_true', help='if passed, write compressed laz files')
+    parser.add_argument('--workers', type=int, default=4, help='int, the number of files to write at once')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--buffer-size', type=float, default=2, help='float, the most memory the tree points can use before they are spilled to temporary files, in GB')
+    parser.add_argument('--decode-threads', type=int, default=None, help='int, the number of threads to decompress LAZ files with. Defaults to one per core, 1 decodes on a single thread')
+    parser.add_argument('--prefetch-memory', type=float, default=0.25, help='float, the most memory the las chunks read ahead can use, in GB')
+    parser.add_argument('--metrics-json', type=str, default=None, help='if passed, path (.json) to save the time, CPU time, peak memory and point counts of each stage to')
+
+    args = parser.parse_args()
+    run_metrics = metrics.enable() if args.metrics_json else None
+    set_memory_budget(int(args.prefetch_memory * 1024 ** 3))
+    set_decode_threads(args.decode_threads)
+
+    # Load converted boxes
+    print('Loading annotations...\n')
+    crs, boxes = read_boxes(args.converted_xml)
+    print('Annotations loaded!\n')
+
+    # Export
+    print('Exporting trees...\n')
+    tree_paths = export_tree_las(boxes, args.las_file, args.save_folder, clip_z=args.clip_z, laz=args.laz or None,
+                                 workers=args.workers, chunk_size=args.chunk_size,
+                                 max_buffer_bytes=int(args.buffer_size * 1024 ** 3))
+    n_written = sum(tree_path is not None for tree_path in tree_paths)
+    print(f'{n_written} of {len(tree_paths)} trees saved to {args.save_folder}!\n')
+
+    if run_metrics is not None:
+        run_metrics.save(args.metrics_json)
+        print(f'Metrics saved to {args.metrics_json}!\n')
@@ -5,5 +5,22 @@ Created on Mon Apr 17 17:14:45 2023
 @author: Liam
 """
 
-import rgbtolasinator.figures
-import rgbtolasinator.converter
\ No newline at end of file
+import importlib
+
+# Subpackages are imported on first use (e.g. rgbtolasinator.figures), so importing the package does not pull in
+# matplotlib, PIL, GDAL or laspy until they are needed
+_SUBMODULES = ['figures', 'converter', 'metrics']
+# Names importable from the package itself, and the module each lives in
+_ATTRIBUTES = {'Converter': 'rgbtolasinator.converter.api'}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    if name in _ATTRIBUTES:
+        return getattr(importlib.import_module(_ATTRIBUTES[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES + list(_ATTRIBUTES))
@@ -5,5 +5,18 @@ Created on Mon Apr 17 17:15:35 2023
 @author: Liam
 """
 
-import rgbtolasinator.converter.convert
-import rgbtolasinator.converter.utils
\ No newline at end of file
+import importlib
+
+# Modules are imported on first use (e.g. rgbtolasinator.converter.convert), so only what is used is paid for
+_SUBMODULES = ['pointcloud', 'boxes', 'convert', 'utils', 'spatial_index', 'cache', 'catalog', 'parallel', 'batch',
+               'sketch', 'dtm', 'server', 'api', 'export', 'formats', 'incremental', 'pipeline']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
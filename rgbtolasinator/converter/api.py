@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 15:38:12 2026
+
+@author: Liam
+"""
+
+import os
+from rgbtolasinator.converter.convert import infer_z_bounds_batch
+from rgbtolasinator.converter.dtm import GroundGrid
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.formats import write_boxes
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, load_pointcloud, get_boxes_extent, get_tif_crs
+
+
+class Converter:
+    """Converts 2D annotations into 3D boxes against one las file (or folder of tiles). The pointcloud, its spatial
+    index and ground grid are loaded on the first conversion and kept for later ones, so converting many annotation
+    sets over the same area loads the las only once. The area loaded grows if later boxes fall outside it.
+    The parameters are attributes, and can be changed between calls.
+
+    Example:
+        converter = Converter('points.las', use_class=True)
+        boxes_3d = converter.convert('annots.xml', 'ortho.tif', 'converted.xml')
+
+    Args:
+        las_path (str): path to the las file, or a folder/glob of las tiles
+        bottom_percentile (float): the percentile to define the bottom of the tree as
+        top_percentile (float): the percentile to define the top of the tree as
+        use_class (bool): whether to use the class to define the bounds. See infer_z_bounds()
+        ground_cell_size (float): if passed with use_class, the bottom of each tree is taken from a GroundGrid with cells this wide
+        workers (int): the number of processes to convert with
+        chunk_size (int): the number of las points to read at a time
+        cache (PointCloudCache): optional on-disk cache of decoded las files
+    """
+
+    def __init__(self, las_path, bottom_percentile=1, top_percentile=99, use_class=False, ground_cell_size=None,
+                 workers=1, chunk_size=1_000_000, cache=None):
+        self.las_path = las_path
+        self.bottom_percentile = bottom_percentile
+        self.top_percentile = top_percentile
+        self.use_class = use_class
+        self.ground_cell_size = ground_cell_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.pointcloud = None
+        self.index = None
+        self.extent = None
+        self._catalog = None
+        self._ground_grid = None
+        self._ground_settings = None
+
+    def load(self, extent=None):
+        """Loads the points within extent, and indexes them. Does nothing if they are already loaded
+
+        Args:
+            extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates. If None, loads the whole file
+
+        Returns:
+            pointcloud (PointCloud): the loaded points
+        """
+        if self.pointcloud is not None and self._covers(extent):
+            return self.pointcloud
+        if extent is not None and self.pointcloud is not None and self.extent is not None:
+            # Grow to cover both, so the points already needed are kept
+            extent = (min(extent[0], self.extent[0]), min(extent[1], self.extent[1]),
+                      max(extent[2], self.extent[2]), max(extent[3], self.extent[3]))
+        if os.path.isfile(self.las_path):
+            self.pointcloud = load_pointcloud(self.las_path, extent, chunk_size=self.chunk_size, cache=self.cache)
+        else:
+            if self._catalog is None:
+                from rgbtolasinator.converter.catalog import LasCatalog
+                self._catalog = LasCatalog(self.las_path)
+            self.pointcloud = self._catalog.load(extent, chunk_size=self.chunk_size, cache=self.cache)
+        self.index = GridIndex(self.pointcloud)
+        self.extent = extent
+        self._ground_grid = None
+        return self.pointcloud
+
+    def release(self):
+        """Drops the loaded points, index and ground grid, freeing their memory. They are loaded again when next needed"""
+        self.pointcloud = None
+        self.index = None
+        self.extent = None
+        self._ground_grid = None
+
+    def _covers(self, extent):
+        """Checks whether the loaded points cover extent"""
+        if self.extent is None:
+            return True
+        if extent is None:
+            return False
+        return (self.extent[0] <= extent[0] and self.extent[1] <= extent[1]
+                and self.extent[2] >= extent[2] and self.extent[3] >= extent[3])
+
+    def ground_grid(self):
+        """Gets the ground grid of the loaded points, built on first use and whenever its settings change
+
+        Returns:
+            ground_grid (GroundGrid): the grid, or None if use_class or ground_cell_size is not set
+        """
+        if not self.use_class or self.ground_cell_size is None or self.pointcloud is None:
+            return None
+        settings = (self.ground_cell_size, self.bottom_percentile)
+        if self._ground_grid is None or self._ground_settings != settings:
+            self._ground_grid = GroundGrid.from_pointcloud(self.pointcloud, cell_size=self.ground_cell_size,
+                                                           percentile=self.bottom_percentile)
+            self._ground_settings = settings
+        return self._ground_grid
+
+    def z_bounds(self, geo_boxes):
+        """Infers the z bounds of boxes in geospatial coordinates, loading the points under them if needed
+
+        Args:
+            geo_boxes (list or BoxArray): boxes in geospatial coordinates (see px_to_geo())
+
+        Returns:
+            zmin (np array): the bottom of each box
+            zmax (np array): the top of each box
+        """
+        self.load(get_boxes_extent(geo_boxes))
+        kwargs = {'bottom_percentile': self.bottom_percentile, 'top_percentile': self.top_percentile,
+                  'use_class': self.use_class, 'index': self.index, 'ground_grid': self.ground_grid()}
+        if self.workers > 1:
+            from rgbtolasinator.converter.parallel import infer_z_bounds_parallel
+            return infer_z_bounds_parallel(geo_boxes, self.pointcloud, workers=self.workers, **kwargs)
+        return infer_z_bounds_batch(geo_boxes, self.pointcloud, **kwargs)
+
+    def convert_boxes(self, px_boxes, tif_file):
+        """Converts boxes in the pixel coordinates of a tif into 3D boxes
+
+        Args:
+            px_boxes (list): boxes in pixel coordinates, as read_pascalvoc() gives
+            tif_file (str): path to the geospatially projected tif the boxes are in
+
+        Returns:
+            boxes_3d (list): [xmin, ymin, xmax, ymax, label, conf, zmin, zmax] of each box, in geospatial coordinates
+        """
+        geo_boxes = px_to_geo(px_boxes, tif_file)
+        if len(geo_boxes) == 0:
+            return []
+        zmin, zmax = self.z_bounds(geo_boxes)
+        return [box[:6] + [box_zmin, box_zmax] for box, box_zmin, box_zmax in zip(geo_boxes, zmin.tolist(), zmax.tolist())]
+
+    def convert(self, xml_file, tif_file, save_path=None):
+        """Converts a PascalVOC annotation file into 3D boxes, as convert_annots.py does
+
+        Args:
+            xml_file (str): path to the PascalVOC annotations
+            tif_file (str): path to the geospatially projected tif the annotations are associated with
+            save_path (str): if passed, where to save the converted annotations (.xml, .parquet, .gpkg or .npz, see write_boxes())
+
+        Returns:
+            boxes_3d (list): [xmin, ymin, xmax, ymax, label, conf, zmin, zmax] of each box, in geospatial coordinates
+        """
+        _, px_boxes = read_pascalvoc(xml_file)
+        boxes_3d = self.convert_boxes(px_boxes, tif_file)
+        if save_path is not None:
+            write_boxes(boxes_3d, save_path, crs=get_tif_crs(tif_file))
+        return boxes_3d
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:47:10 2026
+
+@author: Liam
+"""
+
+import csv
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from rgbtolasinator.converter.catalog import LasCatalog
+from rgbtolasinator.converter.convert import infer_z_bounds_batch
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.formats import write_boxes
+from rgbtolasinator.converter.pipeline import prefetch, set_memory_budget
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, get_boxes_extent, load_pointcloud, get_tif_crs, set_decode_threads
+
+
+def read_manifest(manifest_path: str):
+    """Reads a manifest of conversion jobs. Either a csv with a header row, or a json list of objects.
+    Each job needs 'tif', 'xml', 'las' and 'output' paths, and may set its own 'bottom_per', 'top_per' and 'use_class'
+
+    Args:
+        manifest_path (str): path to the .csv or .json manifest
+
+    Returns:
+        jobs (list): a dict per job. Relative paths are taken relative to the manifest
+    """
+    if manifest_path.lower().endswith('.json'):
+        with open(manifest_path) as f:
+            jobs = json.load(f)
+    else:
+        with open(manifest_path, newline='') as f:
+            jobs = [dict(row) for row in csv.DictReader(f)]
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for job in jobs:
+        for key in ['tif', 'xml', 'las', 'output']:
+            if key not in job or job[key] in (None, ''):
+                raise ValueError(f'Manifest job {job} is missing "{key}"')
+            job[key] = os.path.normpath(os.path.join(manifest_dir, job[key]))
+    return jobs
+
+
+def read_journal(journal_path: str):
+    """Reads the journal of a batch run, and gets the jobs that completed
+
+    Args:
+        journal_path (str): path to the journal (json lines)
+
+    Returns:
+        done (set): output paths of the jobs whose last recorded status is 'done'
+    """
+    status = {}
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut off by a crash
+                    continue
+                status[entry['output']] = entry['status']
+    return {output for output, job_status in status.items() if job_status == 'done'}
+
+
+def _write_journal(journal_path, job, status, error=None):
+    """Appends the status of a job to the journal. One short line per write, so concurrent workers do not interleave"""
+    entry = {'output': job['output'], 'status': status, 'time': time.time()}
+    if error is not None:
+        entry['error'] = error
+    with open(journal_path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+
+
+def _job_value(job, key, defaults):
+    """Gets a setting of a job, or the default if the job does not set it"""
+    value = job.get(key)
+    if value is None or value == '':
+        return defaults[key]
+    return value
+
+
+def _as_bool(value):
+    """Reads a use_class value from a csv string or json bool"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def _run_group(las_path, jobs, journal_path, defaults, chunk_size, cache, prefetch_bytes=None, decode_threads=None):
+    """Runs all the jobs that share a las file. The annotations are read first, then the las is loaded once, for all of them"""
+    if prefetch_bytes is not None:
+        # Set in each worker process, as the budget is per process
+        set_memory_budget(prefetch_bytes)
+    if decode_threads is not None:
+        set_decode_threads(decode_threads)
+    _convert_group(las_path, _read_group(jobs, journal_path), journal_path, defaults, chunk_size, cache)
+
+
+def _read_group(jobs, journal_path):
+    """Reads the annotations of the jobs that share a las file. Jobs without boxes need no points, and are written now
+
+    Returns:
+        loaded (list): (job, geo_boxes) of each job with boxes
+    """
+    loaded = []
+    for job in jobs:
+        try:
+            _, px_boxes = read_pascalvoc(job['xml'])
+            loaded.append((job, px_to_geo(px_boxes, job['tif'])))
+        except Exception:
+            _write_journal(journal_path, job, 'failed', traceback.format_exc())
+    for job, geo_boxes in loaded:
+        if len(geo_boxes) == 0:
+            try:
+                _finish_job(job, [], journal_path)
+            except Exception:
+                _write_journal(journal_path, job, 'failed', traceback.format_exc())
+    return [(job, geo_boxes) for job, geo_boxes in loaded if len(geo_boxes) > 0]
+
+
+def _convert_group(las_path, loaded, journal_path, defaults, chunk_size, cache):
+    """Loads the points under the annotations of a group of jobs (see _read_group()) once, then converts and writes each job"""
+    if len(loaded) == 0:
+        return
+
+    # Load only the points under all of the jobs' annotations
+    extent = get_boxes_extent([box for _, geo_boxes in loaded for box in geo_boxes])
+    try:
+        if os.path.isfile(las_path):
+            pointcloud = load_pointcloud(las_path, extent, chunk_size=chunk_size, cache=cache)
+        else:
+            pointcloud = LasCatalog(las_path).load(extent, chunk_size=chunk_size, cache=cache)
+        index = GridIndex(pointcloud)
+    except Exception:
+        for job, _ in loaded:
+            _write_journal(journal_path, job, 'failed', traceback.format_exc())
+        return
+
+    # Convert each job, writing it on a thread while the next is converted. Only one write is left pending at a time,
+    # so finished jobs do not pile up in memory
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        writing = None
+        for job, geo_boxes in loaded:
+            try:
+                bottom_per = float(_job_value(job, 'bottom_per', defaults))
+                top_per = float(_job_value(job, 'top_per', defaults))
+                use_class = _as_bool(_job_value(job, 'use_class', defaults))
+                zmin, zmax = infer_z_bounds_batch(geo_boxes, pointcloud, bottom_percentile=bottom_per, top_percentile=top_per,
+                                                  use_class=use_class, index=index)
+                boxes_3d = [box[:6] + [box_zmin, box_zmax] for box, box_zmin, box_zmax in zip(geo_boxes, zmin.tolist(), zmax.tolist())]
+            except Exception:
+                _write_journal(journal_path, job, 'failed', traceback.format_exc())
+                continue
+            if writing is not None:
+                _wait_for_write(*writing, journal_path)
+            writing = (job, writer.submit(_finish_job, job, boxes_3d, journal_path))
+        if writing is not None:
+            _wait_for_write(*writing, journal_path)
+
+
+def _wait_for_write(job, future, journal_path):
+    """Waits for a job to be written (see _finish_job()), recording it as failed if writing failed"""
+    try:
+        future.result()
+    except Exception:
+        _write_journal(journal_path, job, 'failed', traceback.format_exc())
+
+
+def _finish_job(job, boxes_3d, journal_path):
+    """Writes the converted boxes of a job, then records it as done"""
+    os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+    write_boxes(boxes_3d, job['output'], crs=get_tif_crs(job['tif']))
+    _write_journal(journal_path, job, 'done')
+
+
+def run_manifest(jobs: list, journal_path: str, workers=1, bottom_percentile=1, top_percentile=99, use_class=False,
+                 chunk_size=1_000_000, cache=None, rerun=False, prefetch_bytes=None,
+                 decode_threads=None):
+    """Runs a batch of conversion jobs (see read_manifest()). Jobs that share a las file are run together, so the
+    las is loaded once for all of them. Groups run concurrently in a pool of processes. Run one at a time, the next
+    group's annotations are read while the current group is loaded and converted.
+    The status of every job is appended to a journal, and jobs recorded as done are skipped when run again
+
+    Args:
+        jobs (list): the jobs, from read_manifest()
+        journal_path (str): path to the journal (json lines). Made if it does not exist
+        workers (int): the number of las groups to run at once
+        bottom_percentile (int): the percentile to define the bottom of the tree as, for jobs that do not set one
+        top_percentile (int): the percentile to define the top of the tree as, for jobs that do not set one
+        use_class (bool): whether to use the class, for jobs that do not set it. See infer_z_bounds()
+        chunk_size (int): the number of las points to read at a time
+        cache (PointCloudCache): optional cache of decoded las files
+        rerun (bool): if True, run every job, even those the journal records as done
+        prefetch_bytes (int): the most memory each queue of read ahead data can hold (see set_memory_budget()).
+        If None, the default
+        decode_threads (int): the number of threads each worker decompresses LAZ files with (see set_decode_threads()).
+        If None, one per core
+
+    Returns:
+        n_skipped (int): the number of jobs skipped because they were already done
+    """
+    done = set() if rerun else read_journal(journal_path)
+    todo = [job for job in jobs if not (job['output'] in done and os.path.exists(job['output']))]
+
+    # Group the jobs by las file
+    groups = {}
+    for job in todo:
+        groups.setdefault(os.path.abspath(job['las']), []).append(job)
+    defaults = {'bottom_per': bottom_percentile, 'top_per': top_percentile, 'use_class': use_class}
+    if workers > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_group, las_path, group, journal_path, defaults, chunk_size, cache, prefetch_bytes,
+                                   decode_threads)
+                       for las_path, group in groups.items()]
+            for future in futures:
+                future.result()
+    else:
+        if prefetch_bytes is not None:
+            set_memory_budget(prefetch_bytes)
+        if decode_threads is not None:
+            set_decode_threads(decode_threads)
+        # Read the next group's annotations on a thread while this group is loaded and converted
+        loaded_groups = prefetch(((las_path, _read_group(group, journal_path)) for las_path, group in groups.items()),
+                                 max_items=1)
+        for las_path, loaded in loaded_groups:
+            _convert_group(las_path, loaded, journal_path, defaults, chunk_size, cache)
+    return len(jobs) - len(todo)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:02:26 2026
+
+@author: Liam
+"""
+
+import numpy as np
+
+
+class BoxArray:
+    """A columnar set of boxes. Coordinates are float64 arrays, and label, conf and the two extra fields are object arrays.
+    Holds the same fields as the [xmin, ymin, xmax, ymax, label, conf, extra1, extra2] lists used elsewhere,
+    so transforms over many boxes are done as array operations instead of one box at a time
+
+    Args:
+        xmin, ymin, xmax, ymax (np array): box bounds
+        label (np array): label of each box
+        conf (np array): confidence of each box
+        extra1, extra2 (np array): the extra fields of each box. If None, filled with 0
+    """
+
+    def __init__(self, xmin, ymin, xmax, ymax, label, conf, extra1=None, extra2=None):
+        self.xmin = np.asarray(xmin, dtype=np.float64)
+        self.ymin = np.asarray(ymin, dtype=np.float64)
+        self.xmax = np.asarray(xmax, dtype=np.float64)
+        self.ymax = np.asarray(ymax, dtype=np.float64)
+        n_boxes = len(self.xmin)
+        self.label = _object_array(label, n_boxes)
+        self.conf = _object_array(conf, n_boxes)
+        self.extra1 = _object_array(extra1 if extra1 is not None else [0] * n_boxes, n_boxes)
+        self.extra2 = _object_array(extra2 if extra2 is not None else [0] * n_boxes, n_boxes)
+
+    @classmethod
+    def from_list(cls, boxes: list):
+        """Makes a BoxArray from a list of boxes (e.g. from read_pascalvoc() or px_to_geo())
+
+        Args:
+            boxes (list): boxes as [xmin, ymin, xmax, ymax, label, conf, extra1, extra2]
+
+        Returns:
+            BoxArray
+        """
+        fields = list(zip(*boxes)) if len(boxes) > 0 else [()] * 8
+        extra1 = fields[6] if len(fields) > 6 else None
+        extra2 = fields[7] if len(fields) > 7 else None
+        return cls(fields[0], fields[1], fields[2], fields[3], fields[4], fields[5], extra1, extra2)
+
+    def to_list(self):
+        """Gets the boxes as a list of [xmin, ymin, xmax, ymax, label, conf, extra1, extra2] lists
+
+        Returns:
+            boxes (list): the boxes
+        """
+        extra1 = self.extra1.tolist()
+        extra2 = self.extra2.tolist()
+        return [list(box) for box in zip(self.xmin.tolist(), self.ymin.tolist(), self.xmax.tolist(), self.ymax.tolist(),
+                                         self.label.tolist(), self.conf.tolist(), extra1, extra2)]
+
+    def __len__(self):
+        return len(self.xmin)
+
+    def __getitem__(self, ind):
+        return BoxArray(self.xmin[ind], self.ymin[ind], self.xmax[ind], self.ymax[ind], self.label[ind], self.conf[ind],
+                        self.extra1[ind], self.extra2[ind])
+
+    def coords(self):
+        """Gets the box bounds as rows of [xmin, ymin, xmax, ymax]
+
+        Returns:
+            coords (np array): the box bounds
+        """
+        return np.column_stack([self.xmin, self.ymin, self.xmax, self.ymax])
+
+    def extent(self):
+        """Gets the extent covered by the boxes
+
+        Returns:
+            extent (tuple): (xmin, ymin, xmax, ymax) of all the boxes
+        """
+        if len(self) == 0:
+            raise ValueError('Cannot get the extent of an empty set of boxes')
+        return float(self.xmin.min()), float(self.ymin.min()), float(self.xmax.max()), float(self.ymax.max())
+
+
+def _object_array(values, n_boxes):
+    """Makes a 1d object array, without numpy turning sequences into extra dimensions"""
+    array = np.empty(n_boxes, dtype=object)
+    array[:] = list(values) if not isinstance(values, np.ndarray) else values
+    return array
+
+
+def px_to_geo_array(boxes: BoxArray, transform):
+    """Converts boxes from pixel coordinates to geospatial coordinates, all at once. Same results as px_to_geo()
+
+    Args:
+        boxes (BoxArray): boxes in pixel coordinates
+        transform (tuple): the raster's geotransform, (x0, px_w, py_w, y0, px_h, py_h) (see get_tif_transform())
+
+    Returns:
+        geo_boxes (BoxArray): boxes in geospatial coordinates. extra1 and extra2 are the x and y of the box centre
+    """
+    x0, px_w, py_w, y0, px_h, py_h = transform
+    # Get the stem location
+    box_x = (boxes.xmax - boxes.xmin) / 2 + boxes.xmin
+    box_y = (boxes.ymax - boxes.ymin) / 2 + boxes.ymin
+    # Note y flips because the axes flip
+    return BoxArray(boxes.xmin * px_w + x0, boxes.ymax * py_h + y0, boxes.xmax * px_w + x0, boxes.ymin * py_h + y0,
+                    boxes.label, boxes.conf, box_x * px_w + x0, box_y * py_h + y0)
+
+
+def geo_to_px_array(geo_boxes: BoxArray, transform):
+    """Converts boxes from geospatial coordinates to pixel coordinates, all at once. Same results as geo_to_px()
+
+    Args:
+        geo_boxes (BoxArray): boxes in geospatial coordinates
+        transform (tuple): the raster's geotransform, (x0, px_w, py_w, y0, px_h, py_h) (see get_tif_transform())
+
+    Returns:
+        px_boxes (BoxArray): boxes in pixel coordinates
+    """
+    x0, px_w, py_w, y0, px_h, py_h = transform
+    # Note y flips because the axes flip
+    return BoxArray((geo_boxes.xmin - x0) / px_w, (geo_boxes.ymax - y0) / py_h, (geo_boxes.xmax - x0) / px_w,
+                    (geo_boxes.ymin - y0) / py_h, geo_boxes.label, geo_boxes.conf, geo_boxes.extra1, geo_boxes.extra2)
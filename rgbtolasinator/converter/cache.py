@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 13:40:05 2026
+
+@author: Liam
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import numpy as np
+from rgbtolasinator.converter.pointcloud import PointCloud
+
+
+def get_las_identity(las_path):
+    """Gets a key that identifies the contents of a las file, without reading its points.
+    Made from the path, size and modification time of the file, and a hash of its header
+
+    Args:
+        las_path (str): path to the las file
+
+    Returns:
+        identity (str): hex digest identifying the file
+    """
+    las_path = os.path.abspath(las_path)
+    stat = os.stat(las_path)
+    with open(las_path, 'rb') as f:
+        # The header size is stored 94 bytes into the public header block
+        start = f.read(96)
+        header_size = struct.unpack('<H', start[94:96])[0] if len(start) == 96 else len(start)
+        header = start + f.read(max(header_size - len(start), 0))
+    identity = hashlib.sha1()
+    identity.update(f'{las_path}|{stat.st_size}|{stat.st_mtime_ns}|'.encode())
+    identity.update(hashlib.sha1(header).digest())
+    return identity.hexdigest()
+
+
+class PointCloudCache:
+    """An on-disk cache of decoded, projected pointclouds. Each las file is stored as one .npy per PointCloud column,
+    so a cached cloud is opened with np.memmap instead of being decoded again.
+    Entries are keyed by get_las_identity(), so an edited or replaced file is decoded again.
+    When the cache is larger than max_bytes, the least recently used entries are deleted.
+
+    Args:
+        cache_dir (str): folder to keep the cache in. Made if it does not exist
+        max_bytes (int): the largest the cache can grow to, in bytes
+    """
+
+    _columns = ['x', 'y', 'z', 'classification']
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, las_path):
+        return os.path.join(self.cache_dir, get_las_identity(las_path))
+
+    def load(self, las_path):
+        """Opens the cached pointcloud of a las file
+
+        Args:
+            las_path (str): path to the las file
+
+        Returns:
+            pointcloud (PointCloud): the memory mapped pointcloud, or None if the file is not cached
+        """
+        entry_dir = self._entry_dir(las_path)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        columns = [np.load(os.path.join(entry_dir, column + '.npy'), mmap_mode='r') for column in self._columns]
+        # Mark the entry as recently used
+        os.utime(meta_path)
+        return PointCloud(*columns, origin=meta['origin'])
+
+    def store(self, las_path, pointcloud):
+        """Adds the pointcloud of a las file to the cache, then evicts old entries if the cache is too large
+
+        Args:
+            las_path (str): path to the las file
+            pointcloud (PointCloud): the decoded, projected pointcloud of the whole file
+        """
+        self.store_chunks(las_path, [pointcloud], len(pointcloud), pointcloud.origin)
+
+    def store_chunks(self, las_path, chunks, n_points, origin):
+        """Adds the pointcloud of a las file to the cache one chunk at a time, writing each chunk straight into the
+        memory mapped .npy columns, so the whole file is never held in memory. Then evicts old entries if the cache
+        is too large
+
+        Args:
+            las_path (str): path to the las file
+            chunks (iterable): the decoded, projected PointClouds of the whole file, in order
+            n_points (int): the number of points in the file, from its header
+            origin (tuple): (x, y, z) local origin shared by the chunks
+
+        Returns:
+            pointcloud (PointCloud): the memory mapped pointcloud of the whole file
+        """
+        entry_dir = self._entry_dir(las_path)
+        # Write to a temporary folder, then move it into place, so a partly written entry is never read
+        tmp_dir = entry_dir + f'.tmp{os.getpid()}'
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            columns = {column: np.lib.format.open_memmap(os.path.join(tmp_dir, column + '.npy'), mode='w+',
+                                                         dtype=np.uint8 if column == 'classification' else np.float32,
+                                                         shape=(n_points,))
+                       for column in self._columns}
+            start = 0
+            for chunk in chunks:
+                if start + len(chunk) > n_points:
+                    raise ValueError(f'{las_path} has more points than its header says ({n_points})')
+                for column in self._columns:
+                    columns[column][start:start + len(chunk)] = getattr(chunk, column)
+                start += len(chunk)
+            if start != n_points:
+                raise ValueError(f'{las_path} has {start} points, but its header says {n_points}')
+            for column in columns.values():
+                column.flush()
+            del columns
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'las_path': os.path.abspath(las_path), 'origin': np.asarray(origin).tolist(),
+                           'n_points': n_points}, f)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another process cached the same file first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Open the entry before evicting, so it can still be read if it is evicted straight away
+        pointcloud = self.load(las_path)
+        self.evict()
+        return pointcloud
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache is no larger than max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, 'meta.json')
+            if not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 15:18:52 2026
+
+@author: Liam
+"""
+
+import glob
+import json
+import os
+import numpy as np
+from rgbtolasinator.converter.pointcloud import concatenate_pointclouds
+from rgbtolasinator.converter.utils import get_las_bounds, load_pointcloud
+
+
+def find_tiles(source):
+    """Finds the las/laz tiles of a folder, glob or list, without opening them
+
+    Args:
+        source (str or list): a folder of tiles, a glob pattern (e.g. "tiles/*.laz"), or a list of tile paths
+
+    Returns:
+        paths (list): the sorted absolute paths of the tiles
+    """
+    if isinstance(source, (list, tuple)):
+        paths = list(source)
+    elif os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source) if f.lower().endswith(('.las', '.laz'))]
+    else:
+        paths = glob.glob(source)
+    paths = sorted(os.path.abspath(path) for path in paths)
+    if len(paths) == 0:
+        raise FileNotFoundError(f'No las/laz files found for {source}')
+    return paths
+
+
+class LasCatalog:
+    """An index of the bounds of many tiled las/laz files, made by reading only their headers.
+    Used to load and merge only the tiles that overlap the annotations.
+    The index is saved as json (by default in the tile folder) and reused while the tiles are unchanged.
+
+    Args:
+        source (str or list): a folder of tiles, a glob pattern (e.g. "tiles/*.laz"), or a list of tile paths
+        index_path (str): where to save the index. If None, saved in the folder of the tiles
+    """
+
+    def __init__(self, source, index_path=None):
+        self.paths = find_tiles(source)
+        if index_path is None:
+            index_path = os.path.join(os.path.commonpath([os.path.dirname(path) for path in self.paths]),
+                                      '.rgbtolasinator_catalog.json')
+        self.index_path = index_path
+        self.tiles = self._build_index()
+
+    def _build_index(self):
+        """Reads the bounds of every tile, reusing the saved index for tiles that have not changed"""
+        saved = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    saved = {tile['path']: tile for tile in json.load(f)}
+            except (OSError, ValueError):
+                saved = {}
+        tiles = []
+        changed = len(saved) != len(self.paths)
+        for path in self.paths:
+            stat = os.stat(path)
+            tile = saved.get(path)
+            if tile is None or tile['size'] != stat.st_size or tile['mtime_ns'] != stat.st_mtime_ns:
+                mins, maxs = get_las_bounds(path)
+                tile = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                        'mins': mins.tolist(), 'maxs': maxs.tolist()}
+                changed = True
+            tiles.append(tile)
+        if changed:
+            try:
+                with open(self.index_path, 'w') as f:
+                    json.dump(tiles, f)
+            except OSError:
+                # The tile folder may be read only; the index is then rebuilt next time
+                pass
+        return tiles
+
+    def tiles_in_extent(self, extent):
+        """Gets the tiles that overlap an extent
+
+        Args:
+            extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates (see get_boxes_extent())
+
+        Returns:
+            paths (list): paths of the overlapping tiles
+        """
+        return [tile['path'] for tile in self.tiles
+                if tile['mins'][0] <= extent[2] and tile['maxs'][0] >= extent[0]
+                and tile['mins'][1] <= extent[3] and tile['maxs'][1] >= extent[1]]
+
+    def load(self, extent=None, chunk_size=1_000_000, cache=None, max_level=None):
+        """Loads the points within extent from the overlapping tiles, merged into one PointCloud
+
+        Args:
+            extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates. If None, loads every tile
+            chunk_size (int): the number of points to read at a time
+            cache (PointCloudCache): optional cache of decoded files
+            max_level (int): if passed, the deepest octree level to read of COPC tiles (see iter_copc_chunks())
+
+        Returns:
+            pointcloud (PointCloud): the points, in geospatial coordinates
+        """
+        paths = self.paths if extent is None else self.tiles_in_extent(extent)
+        tiles = [tile for tile in self.tiles if tile['path'] in paths]
+        # Share one origin, the lower corner of the extent (or of the tiles)
+        zmin = min((tile['mins'][2] for tile in tiles), default=0)
+        if extent is not None:
+            origin = np.floor([extent[0], extent[1], zmin])
+        else:
+            origin = np.floor([min(tile['mins'][0] for tile in tiles), min(tile['mins'][1] for tile in tiles), zmin])
+        pointclouds = [load_pointcloud(path, extent, chunk_size=chunk_size, cache=cache, max_level=max_level) for path in paths]
+        return concatenate_pointclouds(pointclouds, origin)
@@ -7,9 +7,14 @@ Created on Wed Apr 12 11:23:05 2023
 
 import numpy as np
 import warnings
+from rgbtolasinator import metrics
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.pointcloud import get_columns, get_geo_z
+from rgbtolasinator.converter.boxes import BoxArray
 
 
-def infer_z_bounds(tree_box: list, pointcloud, bottom_percentile=1, top_percentile=99, use_class=False):
+def infer_z_bounds(tree_box: list, pointcloud, bottom_percentile=1, top_percentile=99, use_class=False, index=None,
+                   ground_grid=None):
     """Inputs the pointcloud and a tree bounding box. Infers the zmin and zmax bounds of the tree box using the pointcloud.
     The zmax is defined as the top 99 percentile of points within the 2d bounding box
     The zmin is defined as the bottom 1 percentile of points within the 2d bounding box
@@ -17,10 +22,12 @@ def infer_z_bounds(tree_box: list, pointcloud, bottom_percentile=1, top_percenti
 
     Args:
         tree_box (list): the tree bounding box, [xmin, ymin, xmax, ymax, ...]
-        pointcloud: the pointcloud to subset from
+        pointcloud (PointCloud or np array): the pointcloud to subset from
         bottom_percentile (int): the percentile to define the bottom of the tree as
         top_percentile (int): the percentile to define the top of the tree as
         use_class (bool): whether to use the class. If True, bottom_percentile is calculated using only class 2 (ASPRS Ground) and top_percentile is calcualted using only low/medium/high vegetation (ASPRS 3,4,5)
+        index (GridIndex): optional spatial index built on pointcloud, used to find the points in the box without scanning the whole cloud
+        ground_grid (GroundGrid): optional ground grid. If passed with use_class, zmin is looked up from it instead of the box's ground points
 
     Returns:
         tree_box_with_z (list): [xmin, ymin, xmax, ymax, label, conf, zmin, zmax]
@@ -34,46 +41,233 @@ def infer_z_bounds(tree_box: list, pointcloud, bottom_percentile=1, top_percenti
     conf = tree_box[5]
 
     # Calculate indices based on bounds
-    bound_x = np.logical_and(pointcloud[:, 0] > xmin, pointcloud[:, 0] < xmax)
-    bound_y = np.logical_and(pointcloud[:, 1] > ymin, pointcloud[:, 1] < ymax)
-    pc_ind = np.logical_and(bound_x, bound_y)
+    if index is not None:
+        pc_ind = index.query(tree_box)
+    else:
+        x, y, _, _, origin = get_columns(pointcloud)
+        bound_x = np.logical_and(x > xmin - origin[0], x < xmax - origin[0])
+        bound_y = np.logical_and(y > ymin - origin[1], y < ymax - origin[1])
+        pc_ind = np.logical_and(bound_x, bound_y)
+
+    # Return subset
+    tree_pc = pointcloud[pc_ind]
+    _, _, _, tree_class, _ = get_columns(tree_pc)
+    tree_z = get_geo_z(tree_pc)
 
     # Raise a warning incase no points are found
-    if len(pc_ind) == 0:
+    if len(tree_pc) == 0:
         warnings.warn('WARNING: No points found within tree bounding box! Are boxes and the pointcloud in the same coordinate system?')
         print('WARNING: No points found within tree bounding box! Are boxes and the pointcloud in the same coordinate system?')
 
-    # Return subset
-    tree_pc = pointcloud[pc_ind]
-
     # Use class if wanted
     if use_class:
-        # Get ground points
-        ground_ind = np.where(tree_pc[:, 3] == 2)
-        if len(ground_ind[0]) == 0:
-            print('WARNING: No classified ground points found! Is the pointcloud classified?')
-            zmin = 0
+        # Get ground from the grid, if there is one
+        if ground_grid is not None:
+            zmin = ground_grid.box_zmin([tree_box])[0]
+            if np.isnan(zmin):
+                print('WARNING: Tree bounding box is outside the ground grid!')
+                zmin = 0
         else:
-            ground_pc = tree_pc[ground_ind]
-            zmin = np.percentile(ground_pc[: 2], bottom_percentile)
-
-        # Get veg points
-        lowveg_ind = np.where(tree_pc[:, 3] == 3)
-        medveg_ind = np.where(tree_pc[:, 3] == 4)
-        highveg_ind = np.where(tree_pc[:, 3] == 5)
-        veg_ind = np.concatenate((lowveg_ind, medveg_ind, highveg_ind), axis=1)
-        if len(veg_ind[0]) == 0:
+            # Get ground points
+            ground_z = tree_z[tree_class == 2]
+            if len(ground_z) == 0:
+                print('WARNING: No classified ground points found! Is the pointcloud classified?')
+                zmin = 0
+            else:
+                zmin = _percentiles(ground_z, [bottom_percentile])[0]
+
+        # Get low/medium/high veg points
+        veg_z = tree_z[(tree_class >= 3) & (tree_class <= 5)]
+        if len(veg_z) == 0:
             print('WARNING: No classified vegetation points found! Is the pointcloud classified?\n Skipping tree...')
             zmax = zmin
         else:
-            veg_pc = tree_pc[veg_ind]
-            zmax = np.percentile(veg_pc[:, 2], top_percentile)
+            zmax = _percentiles(veg_z, [top_percentile])[0]
 
     # Otherwise, just use all points
     else:
-        zmin = np.percentile(tree_pc[:, 2], bottom_percentile)
-        zmax = np.percentile(tree_pc[:, 2], top_percentile)
+        zmin, zmax = _percentiles(tree_z, [bottom_percentile, top_percentile])
 
     tree_box_with_z = [xmin, ymin, xmax, ymax, label, conf, zmin, zmax]
 
     return tree_box_with_z
+
+
+def _percentiles(values, percentiles):
+    """Computes several percentiles of values with one partial sort (np.partition), instead of a full sort per percentile.
+    Matches np.percentile (linear interpolation)
+
+    Args:
+        values (np array): the values. Not modified
+        percentiles (list): the percentiles to compute
+
+    Returns:
+        results (list): a float per percentile
+    """
+    n_values = len(values)
+    if n_values == 0:
+        # Same as np.percentile of an empty array
+        return [np.percentile(values, percentile) for percentile in percentiles]
+    # Position of each percentile within the values, as np.percentile computes it
+    virtual_index = (n_values - 1) * np.true_divide(percentiles, 100)
+    previous_index = np.floor(virtual_index)
+    gamma = virtual_index - previous_index
+    previous_index = np.minimum(previous_index.astype(np.int64), n_values - 1)
+    next_index = np.minimum(previous_index + 1, n_values - 1)
+    # Only the values at these positions need to be in sorted place
+    partitioned = np.partition(values, np.unique(np.concatenate([previous_index, next_index])))
+    a = partitioned[previous_index]
+    b = partitioned[next_index]
+    # Interpolate the same way np.percentile does
+    diff_b_a = b - a
+    return list(np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma))
+
+
+def _grouped_percentiles(group_ids, values, n_groups, percentiles):
+    """Computes percentiles of values within each group, using one sort for all groups.
+    Matches np.percentile (linear interpolation) for every group
+
+    Args:
+        group_ids (np array): the group (0 to n_groups - 1) each value belongs to
+        values (np array): the values
+        n_groups (int): the number of groups
+        percentiles (list): the percentiles to compute
+
+    Returns:
+        results (np array): results[i, g] is percentiles[i] of group g. NaN for empty groups
+        counts (np array): the number of values in each group
+    """
+    # Sort by (group, value), then each group is one sorted run
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+    counts = np.bincount(group_ids, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    has_values = counts > 0
+    results = np.full((len(percentiles), n_groups), np.nan)
+    for ii, percentile in enumerate(percentiles):
+        # Position of the percentile within each group, as np.percentile computes it
+        virtual_index = (counts[has_values] - 1) * np.true_divide(percentile, 100)
+        previous_index = np.floor(virtual_index)
+        gamma = virtual_index - previous_index
+        previous_index = np.minimum(previous_index.astype(np.int64), counts[has_values] - 1)
+        next_index = np.minimum(previous_index + 1, counts[has_values] - 1)
+        a = sorted_values[starts[has_values] + previous_index]
+        b = sorted_values[starts[has_values] + next_index]
+        # Interpolate the same way np.percentile does
+        diff_b_a = b - a
+        results[ii, has_values] = np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma)
+    return results, counts
+
+
+def _box_coords(boxes):
+    """Gets the [xmin, ymin, xmax, ymax] of every box as a float array"""
+    if isinstance(boxes, BoxArray):
+        return boxes.coords()
+    if isinstance(boxes, np.ndarray):
+        return boxes[:, :4].astype(float)
+    return np.array([box[:4] for box in boxes], dtype=float).reshape(-1, 4)
+
+
+def infer_z_bounds_batch(boxes, pointcloud, bottom_percentile=1, top_percentile=99, use_class=False, index=None, batch_size=4096,
+                         ground_grid=None):
+    """Infers the zmin and zmax bounds of many tree boxes at once. Gives the same bounds as infer_z_bounds() for each box,
+    but finds the points of all boxes in bulk and takes the percentiles from one sort, rather than one box at a time.
+    !! boxes and pointcloud must be in the same coordinate system !!
+
+    Args:
+        boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+        pointcloud (PointCloud or np array): the pointcloud to subset from
+        bottom_percentile (int): the percentile to define the bottom of the tree as
+        top_percentile (int): the percentile to define the top of the tree as
+        use_class (bool): whether to use the class. If True, bottom_percentile is calculated using only class 2 (ASPRS Ground) and top_percentile is calcualted using only low/medium/high vegetation (ASPRS 3,4,5)
+        index (GridIndex): optional spatial index built on pointcloud. If None, one is built
+        batch_size (int): the number of boxes to process together. Bounds the memory used for the box/point pairs
+        ground_grid (GroundGrid): optional ground grid. If passed with use_class, zmin is looked up from it instead of the boxes' ground points
+
+    Returns:
+        zmin (np array): the bottom of each box. NaN for boxes with no points (where infer_z_bounds() would raise)
+        zmax (np array): the top of each box
+    """
+    results = sweep_z_bounds(boxes, pointcloud, [bottom_percentile], [top_percentile], [use_class], index=index,
+                             batch_size=batch_size, ground_grid=ground_grid)
+    return results[(bottom_percentile, top_percentile, bool(use_class))]
+
+
+def sweep_z_bounds(boxes, pointcloud, bottom_percentiles=(1,), top_percentiles=(99,), class_modes=(False,), index=None,
+                   batch_size=4096, ground_grid=None):
+    """Infers the zmin and zmax bounds of many tree boxes for every combination of bottom percentile, top percentile and
+    use_class. The points of each box are gathered once, and every percentile is taken from the same sort, so a sweep
+    of many combinations costs about the same as one. Each combination gives the same bounds as infer_z_bounds_batch()
+    !! boxes and pointcloud must be in the same coordinate system !!
+
+    Args:
+        boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+        pointcloud (PointCloud or np array): the pointcloud to subset from
+        bottom_percentiles (list): the percentiles to try as the bottom of the tree
+        top_percentiles (list): the percentiles to try as the top of the tree
+        class_modes (list): the use_class values to try, see infer_z_bounds()
+        index (GridIndex): optional spatial index built on pointcloud. If None, one is built
+        batch_size (int): the number of boxes to process together. Bounds the memory used for the box/point pairs
+        ground_grid (GroundGrid): optional ground grid, see infer_z_bounds_batch()
+
+    Returns:
+        results (dict): {(bottom_percentile, top_percentile, use_class): (zmin, zmax)} for every combination
+    """
+    bottom_percentiles = list(dict.fromkeys(bottom_percentiles))
+    top_percentiles = list(dict.fromkeys(top_percentiles))
+    class_modes = list(dict.fromkeys(bool(use_class) for use_class in class_modes))
+    coords = _box_coords(boxes)
+    if index is None:
+        index = GridIndex(pointcloud)
+    _, _, z_column, class_column, origin = get_columns(pointcloud)
+    results = {(bottom, top, use_class): (np.full(len(coords), np.nan), np.full(len(coords), np.nan))
+               for use_class in class_modes for bottom in bottom_percentiles for top in top_percentiles}
+    n_bottoms = len(bottom_percentiles)
+    n_pairs = 0
+    with metrics.stage('z_inference', boxes=len(coords), parameter_sets=len(results)) as record:
+        for start in range(0, len(coords), batch_size):
+            batch = coords[start:start + batch_size]
+            # Find the points of every box in the batch
+            box_ids, pc_ind = index.query_many(batch)
+            z = z_column[pc_ind].astype(np.float64) + origin[2]
+            n_pairs += len(pc_ind)
+            if metrics.enabled():
+                metrics.observe('points_per_box', np.bincount(box_ids, minlength=len(batch)))
+
+            # Use class if wanted
+            if True in class_modes:
+                point_class = class_column[pc_ind]
+                ground = point_class == 2
+                veg = (point_class == 3) | (point_class == 4) | (point_class == 5)
+                if ground_grid is not None:
+                    # Boxes outside the grid get no ground, as boxes without ground points do
+                    bottoms = np.repeat(ground_grid.box_zmin(batch)[np.newaxis], n_bottoms, axis=0)
+                    ground_counts = (~np.isnan(bottoms[0])).astype(np.int64)
+                else:
+                    bottoms, ground_counts = _grouped_percentiles(box_ids[ground], z[ground], len(batch), bottom_percentiles)
+                tops, veg_counts = _grouped_percentiles(box_ids[veg], z[veg], len(batch), top_percentiles)
+                # Same fallbacks as infer_z_bounds(): no ground gives 0, no veg gives zmax = zmin
+                for ii, bottom in enumerate(bottom_percentiles):
+                    batch_zmin = np.where(ground_counts > 0, bottoms[ii], 0)
+                    for jj, top in enumerate(top_percentiles):
+                        zmin, zmax = results[(bottom, top, True)]
+                        zmin[start:start + batch_size] = batch_zmin
+                        zmax[start:start + batch_size] = np.where(veg_counts > 0, tops[jj], batch_zmin)
+                if np.any(ground_counts == 0):
+                    print(f'WARNING: No classified ground points found in {np.sum(ground_counts == 0)} boxes! Is the pointcloud classified?')
+                if np.any(veg_counts == 0):
+                    print(f'WARNING: No classified vegetation points found in {np.sum(veg_counts == 0)} boxes! Is the pointcloud classified?')
+
+            # Otherwise, just use all points
+            if False in class_modes:
+                bounds, counts = _grouped_percentiles(box_ids, z, len(batch), bottom_percentiles + top_percentiles)
+                for ii, bottom in enumerate(bottom_percentiles):
+                    for jj, top in enumerate(top_percentiles):
+                        zmin, zmax = results[(bottom, top, False)]
+                        zmin[start:start + batch_size] = bounds[ii]
+                        zmax[start:start + batch_size] = bounds[n_bottoms + jj]
+                if np.any(counts == 0):
+                    warnings.warn(f'WARNING: No points found within {np.sum(counts == 0)} tree bounding boxes! Are boxes and the pointcloud in the same coordinate system?')
+        record['points'] = n_pairs
+
+    return results
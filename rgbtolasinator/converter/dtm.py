@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:04:52 2026
+
+@author: Liam
+"""
+
+import hashlib
+import os
+import numpy as np
+from rgbtolasinator.converter.cache import get_las_identity
+from rgbtolasinator.converter.convert import _grouped_percentiles, _box_coords
+from rgbtolasinator.converter.pointcloud import get_columns, get_geo_z
+from rgbtolasinator.converter.spatial_index import _expand_ranges
+
+
+class GroundGrid:
+    """A lightweight DTM. A grid of ground heights, each the percentile of the ground (ASPRS class 2) points in the cell.
+    Built with one pass over the pointcloud, then used to look up the ground under a box from the cells it covers,
+    instead of finding and sorting the ground points of every box. Cells without ground points are filled from their
+    neighbours, so boxes over sparse ground still get a bottom.
+
+    Args:
+        heights (np array): (ny, nx) ground height of each cell, NaN where unknown
+        x0 (float): geospatial x of the left edge of the grid
+        y0 (float): geospatial y of the bottom edge of the grid
+        cell_size (float): width of a grid cell
+        identity (str): optional identity of the source (see get_las_identity()), to check a saved grid is still valid
+    """
+
+    def __init__(self, heights, x0, y0, cell_size, identity=None):
+        self.heights = np.asarray(heights, dtype=np.float64)
+        self.ny, self.nx = self.heights.shape
+        self.x0 = float(x0)
+        self.y0 = float(y0)
+        self.cell_size = float(cell_size)
+        self.identity = identity
+
+    @classmethod
+    def from_pointcloud(cls, pointcloud, cell_size=1.0, percentile=1, fill_holes=True, identity=None):
+        """Rasterizes the ground points of a pointcloud into a GroundGrid
+
+        Args:
+            pointcloud (PointCloud or np array): the classified pointcloud
+            cell_size (float): width of a grid cell, in geospatial units
+            percentile (int): the percentile of each cell's ground points to use as its height
+            fill_holes (bool): whether to fill cells without ground points from their neighbours
+            identity (str): optional identity of the source, kept with the grid
+
+        Returns:
+            GroundGrid
+        """
+        x, y, _, point_class, origin = get_columns(pointcloud)
+        if point_class is None:
+            raise ValueError('A GroundGrid needs a classified pointcloud')
+        ground = point_class == 2
+        if not np.any(ground):
+            print('WARNING: No classified ground points found! Is the pointcloud classified?')
+            return cls(np.full((1, 1), np.nan), origin[0], origin[1], cell_size, identity)
+        ground_x = x[ground].astype(np.float64) + origin[0]
+        ground_y = y[ground].astype(np.float64) + origin[1]
+        ground_z = get_geo_z(pointcloud)[ground]
+
+        # Snap the grid to whole cells
+        x0 = np.floor(ground_x.min() / cell_size) * cell_size
+        y0 = np.floor(ground_y.min() / cell_size) * cell_size
+        nx = int((ground_x.max() - x0) // cell_size) + 1
+        ny = int((ground_y.max() - y0) // cell_size) + 1
+        cells = ((ground_y - y0) // cell_size).astype(np.int64) * nx + ((ground_x - x0) // cell_size).astype(np.int64)
+
+        # The percentile of every cell, from one sort of the ground points
+        heights, _ = _grouped_percentiles(cells, ground_z, nx * ny, [percentile])
+        heights = heights[0].reshape(ny, nx)
+        if fill_holes:
+            heights = _fill_holes(heights)
+        return cls(heights, x0, y0, cell_size, identity)
+
+    def box_zmin(self, boxes):
+        """Looks up the ground under many boxes, as the lowest cell each box covers
+
+        Args:
+            boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+
+        Returns:
+            zmin (np array): the ground height under each box. NaN for boxes outside the grid
+        """
+        coords = _box_coords(boxes)
+        zmin = np.full(len(coords), np.nan)
+        if len(coords) == 0:
+            return zmin
+        cx0 = np.floor((coords[:, 0] - self.x0) / self.cell_size)
+        cx1 = np.floor((coords[:, 2] - self.x0) / self.cell_size)
+        cy0 = np.floor((coords[:, 1] - self.y0) / self.cell_size)
+        cy1 = np.floor((coords[:, 3] - self.y0) / self.cell_size)
+        # Boxes that do not overlap the grid cover no cells
+        inside = (cx1 >= 0) & (cx0 < self.nx) & (cy1 >= 0) & (cy0 < self.ny) & (cx0 <= cx1) & (cy0 <= cy1)
+        cx0 = np.clip(cx0, 0, self.nx - 1).astype(np.int64)
+        cx1 = np.clip(cx1, 0, self.nx - 1).astype(np.int64)
+        cy0 = np.clip(cy0, 0, self.ny - 1).astype(np.int64)
+        cy1 = np.where(inside, np.clip(cy1, 0, self.ny - 1), cy0 - 1).astype(np.int64)
+
+        # Expand each box into its rows of cells, and each row into its run of cells
+        row_box = np.repeat(np.arange(len(coords)), cy1 - cy0 + 1)
+        rows = _expand_ranges(cy0, cy1 + 1) * self.nx
+        starts = rows + cx0[row_box]
+        ends = rows + cx1[row_box] + 1
+        cell_heights = self.heights.ravel()[_expand_ranges(starts, ends)]
+        n_cells = np.bincount(row_box, weights=ends - starts, minlength=len(coords)).astype(np.int64)
+
+        # The lowest known cell of each box. Cells are grouped by box, in box order
+        has_cells = n_cells > 0
+        if np.any(has_cells):
+            box_starts = (np.cumsum(n_cells) - n_cells)[has_cells]
+            zmin[has_cells] = np.fmin.reduceat(cell_heights, box_starts)
+        return zmin
+
+    def covers(self, extent):
+        """Checks whether the grid covers an extent, give or take a cell (the ground points rarely reach its edges)
+
+        Args:
+            extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates
+
+        Returns:
+            covers (bool): True if the extent is within the grid
+        """
+        return (self.x0 - self.cell_size <= extent[0] and self.y0 - self.cell_size <= extent[1]
+                and self.x0 + (self.nx + 1) * self.cell_size >= extent[2] and self.y0 + (self.ny + 1) * self.cell_size >= extent[3])
+
+    def save(self, path):
+        """Saves the grid to a .npz file
+
+        Args:
+            path (str): where to save the grid
+        """
+        np.savez_compressed(path, heights=self.heights, x0=self.x0, y0=self.y0, cell_size=self.cell_size,
+                            identity='' if self.identity is None else self.identity)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a grid saved by save()
+
+        Args:
+            path (str): path to the .npz file
+
+        Returns:
+            GroundGrid
+        """
+        with np.load(path) as saved:
+            identity = str(saved['identity']) or None
+            return cls(saved['heights'], float(saved['x0']), float(saved['y0']), float(saved['cell_size']), identity)
+
+
+def load_ground_grid(grid_path, pointcloud, las_paths, extent, cell_size=1.0, percentile=1):
+    """Loads the ground grid saved at grid_path, if it was made from the same las files with the same settings and
+    covers extent. Otherwise, builds it from pointcloud and saves it there for the next run
+
+    Args:
+        grid_path (str): where the grid is saved (.npz)
+        pointcloud (PointCloud or np array): the classified pointcloud to build the grid from, if needed
+        las_paths (str or list): the las file(s) pointcloud was loaded from
+        extent (tuple): (xmin, ymin, xmax, ymax) the grid needs to cover
+        cell_size (float): width of a grid cell
+        percentile (int): the percentile of each cell's ground points to use as its height
+
+    Returns:
+        ground_grid (GroundGrid)
+    """
+    if isinstance(las_paths, str):
+        las_paths = [las_paths]
+    identity = hashlib.sha1()
+    for las_path in sorted(las_paths):
+        identity.update(get_las_identity(las_path).encode())
+    identity.update(f'|{cell_size}|{percentile}'.encode())
+    identity = identity.hexdigest()
+    if os.path.exists(grid_path):
+        ground_grid = GroundGrid.load(grid_path)
+        if ground_grid.identity == identity and ground_grid.covers(extent):
+            return ground_grid
+    ground_grid = GroundGrid.from_pointcloud(pointcloud, cell_size, percentile, identity=identity)
+    ground_grid.save(grid_path)
+    return ground_grid
+
+
+def _fill_holes(heights, max_iterations=8):
+    """Fills NaN cells with the mean of their known neighbours, growing inwards from the known cells. Cells further
+    than max_iterations from any known cell (e.g. under a lake or building) are then filled in one pass, from the
+    smallest block around them with known cells (see _fill_from_blocks()), so large holes do not need one pass per cell
+
+    Args:
+        heights (np array): (ny, nx) grid, NaN where unknown
+        max_iterations (int): the largest number of cells to grow by. If None, grows until every cell is filled
+
+    Returns:
+        filled (np array): the filled grid
+    """
+    filled = heights.copy()
+    known = ~np.isnan(filled)
+    if not np.any(known):
+        return filled
+    iteration = 0
+    while not np.all(known) and (max_iterations is None or iteration < max_iterations):
+        # Sum and count the known cells of every 3x3 neighbourhood
+        padded = np.pad(np.where(known, filled, 0), 1)
+        padded_known = np.pad(known, 1).astype(np.int64)
+        total = np.zeros_like(filled)
+        count = np.zeros(filled.shape, dtype=np.int64)
+        for dy in range(3):
+            for dx in range(3):
+                total += padded[dy:dy + filled.shape[0], dx:dx + filled.shape[1]]
+                count += padded_known[dy:dy + filled.shape[0], dx:dx + filled.shape[1]]
+        grow = ~known & (count > 0)
+        filled[grow] = total[grow] / count[grow]
+        known |= grow
+        iteration += 1
+    if not np.all(known):
+        filled[~known] = _fill_from_blocks(filled, known)[~known]
+    return filled
+
+
+def _fill_from_blocks(heights, known):
+    """Gets, for every cell, the mean of the known cells of the smallest aligned 2^k x 2^k block around it with any.
+    Each level has a quarter of the cells of the one below, so the whole pyramid costs O(cells)
+
+    Args:
+        heights (np array): (ny, nx) grid
+        known (np array): (ny, nx) bool, where heights is known. At least one must be
+
+    Returns:
+        means (np array): (ny, nx) grid, equal to heights at the known cells
+    """
+    sums = np.where(known, heights, 0)
+    counts = known.astype(np.int64)
+    levels = [(sums, counts)]
+    while not np.all(counts > 0):
+        # Pad to even, then sum each 2x2 block
+        pad = ((0, sums.shape[0] % 2), (0, sums.shape[1] % 2))
+        sums, counts = np.pad(sums, pad), np.pad(counts, pad)
+        shape = (sums.shape[0] // 2, 2, sums.shape[1] // 2, 2)
+        sums = sums.reshape(shape).sum(axis=(1, 3))
+        counts = counts.reshape(shape).sum(axis=(1, 3))
+        levels.append((sums, counts))
+    # Walk back down, taking each empty block's mean from the block above it
+    means = sums / counts
+    for sums, counts in reversed(levels[:-1]):
+        above = np.repeat(np.repeat(means, 2, axis=0), 2, axis=1)[:sums.shape[0], :sums.shape[1]]
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), above)
+    return means
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 09:26:40 2026
+
+@author: Liam
+"""
+
+import copy
+import os
+import tempfile
+from contextlib import closing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from rgbtolasinator import metrics
+from rgbtolasinator.converter.convert import _box_coords
+from rgbtolasinator.converter.pointcloud import PointCloud
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.utils import _raw_extent_mask, _las_read_kwargs
+from rgbtolasinator.converter.pipeline import prefetch
+
+
+class _TreeBuffer:
+    """Holds the raw point records found for each box until the whole source has been read. Records are kept grouped
+    by box in a few sorted runs. When they use more than max_bytes, the run is spilled to a temporary file and read
+    back memory mapped, so any number of points can be exported
+
+    Args:
+        max_bytes (int): the most memory the buffered records can use before they are spilled to disk
+        spill_folder (str): where to make the temporary spill files. If None, the system temp folder
+    """
+
+    def __init__(self, max_bytes, spill_folder=None):
+        self.max_bytes = max_bytes
+        self.spill_folder = spill_folder
+        self._pending = []
+        self._pending_bytes = 0
+        self._runs = []
+        self._tempdir = None
+
+    def add(self, box_ids, records):
+        """Adds the records of a chunk, and the box each belongs to"""
+        if len(box_ids) == 0:
+            return
+        self._pending.append((box_ids, records))
+        self._pending_bytes += records.nbytes + box_ids.nbytes
+        if self._pending_bytes > self.max_bytes:
+            self._consolidate(spill=True)
+
+    def _consolidate(self, spill=False):
+        """Merges the pending chunks into one run sorted by box. Points of a box keep the order they were read in"""
+        if len(self._pending) == 0:
+            return
+        box_ids = np.concatenate([ids for ids, _ in self._pending])
+        records = np.concatenate([recs for _, recs in self._pending])
+        self._pending = []
+        self._pending_bytes = 0
+        order = np.argsort(box_ids, kind='stable')
+        box_ids = box_ids[order]
+        records = records[order]
+        if spill:
+            if self._tempdir is None:
+                self._tempdir = tempfile.TemporaryDirectory(prefix='rgbtolasinator_export_', dir=self.spill_folder)
+            run_path = os.path.join(self._tempdir.name, f'{len(self._runs)}.npy')
+            np.save(run_path, records)
+            del records
+            records = np.load(run_path, mmap_mode='r')
+        run_ids, run_starts = np.unique(box_ids, return_index=True)
+        run_ends = np.append(run_starts[1:], len(box_ids))
+        self._runs.append((run_ids, run_starts, run_ends, records))
+
+    def finish(self):
+        """Merges what is still pending. Call once every chunk has been added
+
+        Returns:
+            counts (dict): {box row: the number of records found for it}
+        """
+        self._consolidate()
+        counts = {}
+        for run_ids, run_starts, run_ends, _ in self._runs:
+            for box_id, n_records in zip(run_ids.tolist(), (run_ends - run_starts).tolist()):
+                counts[box_id] = counts.get(box_id, 0) + n_records
+        return counts
+
+    def get(self, box_id):
+        """Gets all the records of a box, in the order they were read"""
+        parts = []
+        for run_ids, run_starts, run_ends, records in self._runs:
+            pos = np.searchsorted(run_ids, box_id)
+            if pos < len(run_ids) and run_ids[pos] == box_id:
+                parts.append(records[run_starts[pos]:run_ends[pos]])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def close(self):
+        """Removes the spill files"""
+        self._runs = []
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+
+
+def _tree_header(header):
+    """Makes the header of a tree file from the source header. Keeps the point format (and any extra dimensions),
+    version, scales, offsets and VLRs (e.g. the CRS), but not COPC structure, which only describes the source
+    """
+    tree_header = copy.deepcopy(header)
+    for vlr in [vlr for vlr in tree_header.vlrs if getattr(vlr, 'user_id', '') == 'copc']:
+        tree_header.vlrs.remove(vlr)
+    tree_header.evlrs = []
+    return tree_header
+
+
+@metrics.timed('export_trees')
+def export_tree_las(boxes, las_path, save_folder, clip_z=False, laz=None, workers=4, chunk_size=1_000_000,
+                    max_buffer_bytes=2 * 1024 ** 3, spill_folder=None):
+    """Writes the points of each box to its own las (or laz) file, from one read of the source las. A point within
+    several (overlapping) boxes is written to each of them. The files keep the source's point format, scales,
+    offsets, VLRs and every point attribute, and are named by the box's row in boxes (e.g. 0.las).
+    Boxes without points get no file.
+    !! boxes must be in the geospatial coordinates of the las !!
+
+    Args:
+        boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, label, conf, zmin, zmax]
+        las_path (str): path to the source las/laz file
+        save_folder (str): folder to save the tree files to. Made if it does not exist
+        clip_z (bool): if True, keep only the points between each box's zmin and zmax (e.g. from convert_annots.py)
+        laz (bool): whether to write compressed laz files. If None, matches the source
+        workers (int): the number of files to write at once
+        chunk_size (int): the number of las points to read at a time
+        max_buffer_bytes (int): the most memory the found points can use before they are spilled to temporary files
+        spill_folder (str): where to make the spill files. If None, the system temp folder
+
+    Returns:
+        tree_paths (list): for each box, the path its points were written to, or None if it has no points
+    """
+    import laspy as lp
+
+    coords = _box_coords(boxes)
+    n_boxes = len(coords)
+    tree_paths = [None] * n_boxes
+    if n_boxes == 0:
+        return tree_paths
+    if clip_z:
+        z_bounds = np.array([box[6:8] for box in (boxes.to_list() if hasattr(boxes, 'to_list') else boxes)], dtype=float)
+    if laz is None:
+        laz = las_path.lower().endswith('.laz')
+    os.makedirs(save_folder, exist_ok=True)
+    valid = np.all(np.isfinite(coords), axis=1)
+    if not np.any(valid):
+        return tree_paths
+    extent = (coords[valid, 0].min(), coords[valid, 1].min(), coords[valid, 2].max(), coords[valid, 3].max())
+
+    buffer = _TreeBuffer(max_buffer_bytes, spill_folder)
+    try:
+        # Every dimension is decompressed, as the tree files keep them all
+        with lp.open(las_path, **_las_read_kwargs(xyz_class_only=False)) as reader:
+            header = reader.header
+            las_transform_dict = {'scalex': header.scale[0], 'offsetx': header.offset[0], 'scaley': header.scale[1],
+                                  'offsety': header.offset[1], 'scalez': header.scale[2], 'offsetz': header.offset[2]}
+            # The same local origin as load_pointcloud(), so points are assigned to boxes as in the conversion
+            origin = np.floor([extent[0], extent[1], header.mins[2]])
+            # Decode the next chunk on a thread while this one is partitioned. The read ahead stops before the file closes
+            with closing(prefetch(reader.chunk_iterator(chunk_size))) as chunks:
+                while True:
+                    with metrics.stage('las_decode') as record:
+                        points = next(chunks, None)
+                        record['points'] = 0 if points is None else len(points)
+                    if points is None:
+                        break
+                    with metrics.stage('tree_partition', points=len(points)) as record:
+                        kept = np.flatnonzero(_raw_extent_mask(points.X, points.Y, extent, las_transform_dict))
+                        if len(kept) == 0:
+                            continue
+                        x = points.X[kept] * las_transform_dict['scalex'] + las_transform_dict['offsetx'] - origin[0]
+                        y = points.Y[kept] * las_transform_dict['scaley'] + las_transform_dict['offsety'] - origin[1]
+                        chunk_pc = PointCloud(x, y, np.zeros(len(kept)), np.zeros(len(kept)), origin)
+                        box_ids, pc_ind = GridIndex(chunk_pc).query_many(coords)
+                        if clip_z:
+                            z = points.Z[kept[pc_ind]] * las_transform_dict['scalez'] + las_transform_dict['offsetz']
+                            in_z = (z >= z_bounds[box_ids, 0]) & (z <= z_bounds[box_ids, 1])
+                            box_ids = box_ids[in_z]
+                            pc_ind = pc_ind[in_z]
+                        # Keep the source point order within each box
+                        order = np.lexsort((pc_ind, box_ids))
+                        buffer.add(box_ids[order].astype(np.int32), points.array[kept[pc_ind[order]]])
+                        record['pairs'] = len(order)
+            point_format = header.point_format
+            tree_header = _tree_header(header)
+        counts = buffer.finish()
+
+        def _write(box_id):
+            tree_path = os.path.join(save_folder, f'{box_id}.laz' if laz else f'{box_id}.las')
+            tree_points = lp.PackedPointRecord(np.ascontiguousarray(buffer.get(box_id)), point_format)
+            with lp.open(tree_path, mode='w', header=copy.deepcopy(tree_header), do_compress=laz) as writer:
+                writer.write_points(tree_points)
+            return box_id, tree_path
+
+        with metrics.stage('tree_write', trees=len(counts), points=sum(counts.values())):
+            # Biggest trees first, so the pool is not left waiting on one large file at the end
+            box_order = sorted(counts, key=counts.get, reverse=True)
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                for box_id, tree_path in pool.map(_write, box_order):
+                    tree_paths[box_id] = tree_path
+    finally:
+        buffer.close()
+    return tree_paths
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 14:12:09 2026
+
+@author: Liam
+"""
+
+import os
+import numpy as np
+from itertools import islice
+from rgbtolasinator import metrics
+from rgbtolasinator.converter.boxes import BoxArray
+from rgbtolasinator.converter.utils import read_pascalvoc, write_pascalvoc
+
+# The columns of every columnar box file. zmin and zmax are the extra fields of converted boxes (NaN if unknown),
+# and conf is a float (NaN if it is not a number)
+FLOAT_COLUMNS = ['xmin', 'ymin', 'xmax', 'ymax', 'zmin', 'zmax', 'conf']
+COLUMNS = FLOAT_COLUMNS + ['label']
+
+# The writer and reader of each box file format, by extension. Add more with register_box_format()
+BOX_FORMATS = {}
+
+
+def register_box_format(extension: str, writer, reader):
+    """Adds (or replaces) a box file format, so write_boxes() and read_boxes() handle files with its extension
+
+    Args:
+        extension (str): the file extension, e.g. '.parquet'
+        writer (function): writer(boxes, path, crs, batch_size), writes boxes (see write_boxes()) and returns the path
+        reader (function): reader(path), returns crs (str or None) and columns (dict of np arrays, see COLUMNS)
+    """
+    BOX_FORMATS[extension.lower()] = (writer, reader)
+
+
+def _get_format(path):
+    """Gets the writer and reader of a file, by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in BOX_FORMATS:
+        raise ValueError(f'Unknown box format "{extension}" of {path}. Known formats are {sorted(BOX_FORMATS)}')
+    return BOX_FORMATS[extension]
+
+
+def write_boxes(boxes, path: str, crs=None, batch_size=65536):
+    """Writes boxes to a file, in the format given by its extension (.xml, .parquet, .gpkg or .npz, see BOX_FORMATS).
+    Columnar formats are written batch_size boxes at a time
+
+    Args:
+        boxes (list or BoxArray): the boxes, each [xmin, ymin, xmax, ymax, label, conf, zmin, zmax]. A list can also
+        be a generator (e.g. of converted batches)
+        path (str): where to save the boxes
+        crs (str): the coordinate reference system of the boxes as WKT (see get_tif_crs()). Not kept in .xml
+        batch_size (int): the number of boxes to write at a time
+
+    Returns:
+        path (str): path the boxes were saved
+    """
+    writer, _ = _get_format(path)
+    return writer(boxes, path, crs, batch_size)
+
+
+def read_box_columns(path: str):
+    """Reads a box file (see write_boxes()) as columns, e.g. for analysis
+
+    Args:
+        path (str): path to the box file
+
+    Returns:
+        crs (str): the coordinate reference system of the boxes as WKT, or None if unknown
+        columns (dict): np array of each of COLUMNS
+    """
+    _, reader = _get_format(path)
+    with metrics.stage('read_boxes') as record:
+        crs, columns = reader(path)
+        record['boxes'] = len(columns['xmin'])
+    return crs, columns
+
+
+def read_boxes(path: str):
+    """Reads a box file (see write_boxes()) as a list of boxes, the same as read_pascalvoc() gives
+
+    Args:
+        path (str): path to the box file
+
+    Returns:
+        crs (str): the coordinate reference system of the boxes as WKT, or None if unknown
+        boxes (list): A list of lists with format [xmin, ymin, xmax, ymax, label, conf, zmin, zmax]
+    """
+    if os.path.splitext(path)[1].lower() == '.xml':
+        # Keep the fields as read_pascalvoc() gives them
+        _, boxes = read_pascalvoc(path)
+        return None, boxes
+    crs, columns = read_box_columns(path)
+    boxes = [list(box) for box in zip(*[columns[name].tolist() for name in
+                                        ['xmin', 'ymin', 'xmax', 'ymax', 'label', 'conf', 'zmin', 'zmax']])]
+    return crs, boxes
+
+
+def _as_floats(values):
+    """Converts values (e.g. xml text) to floats, with NaN for those that are not numbers"""
+    floats = np.empty(len(values), dtype=np.float64)
+    for i, value in enumerate(values):
+        try:
+            floats[i] = float(value)
+        except (TypeError, ValueError):
+            floats[i] = np.nan
+    return floats
+
+
+def _iter_column_batches(boxes, batch_size):
+    """Splits boxes into batches, each a dict of np array columns (see COLUMNS)"""
+    if isinstance(boxes, BoxArray):
+        for start in range(0, len(boxes), batch_size):
+            batch = boxes[start:start + batch_size]
+            yield {'xmin': batch.xmin, 'ymin': batch.ymin, 'xmax': batch.xmax, 'ymax': batch.ymax,
+                   'zmin': _as_floats(batch.extra1), 'zmax': _as_floats(batch.extra2), 'conf': _as_floats(batch.conf),
+                   'label': np.array([str(label) for label in batch.label], dtype=str)}
+        return
+    boxes = iter(boxes)
+    while True:
+        batch = list(islice(boxes, batch_size))
+        if len(batch) == 0:
+            return
+        fields = list(zip(*batch))
+        columns = {name: np.array(fields[i], dtype=np.float64) for i, name in enumerate(['xmin', 'ymin', 'xmax', 'ymax'])}
+        columns['label'] = np.array([str(label) for label in fields[4]], dtype=str)
+        columns['conf'] = _as_floats(fields[5])
+        columns['zmin'] = _as_floats(fields[6]) if len(fields) > 6 else np.full(len(batch), np.nan)
+        columns['zmax'] = _as_floats(fields[7]) if len(fields) > 7 else np.full(len(batch), np.nan)
+        yield columns
+
+
+def _empty_columns():
+    """Gets columns holding no boxes"""
+    columns = {name: np.zeros(0, dtype=np.float64) for name in FLOAT_COLUMNS}
+    columns['label'] = np.zeros(0, dtype=str)
+    return columns
+
+
+# %% PascalVOC
+def _write_xml(boxes, path, crs, batch_size):
+    if isinstance(boxes, BoxArray):
+        boxes = boxes.to_list()
+    return write_pascalvoc(boxes, path)
+
+
+def _read_xml(path):
+    _, boxes = read_pascalvoc(path)
+    if len(boxes) == 0:
+        return None, _empty_columns()
+    return None, next(_iter_column_batches(boxes, len(boxes)))
+
+
+# %% Parquet
+def _write_parquet(boxes, path, crs, batch_size):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(name, pa.float64()) for name in FLOAT_COLUMNS] + [('label', pa.string())],
+                       metadata={'crs': crs or ''})
+    with metrics.stage('write_boxes', format='parquet') as record, pq.ParquetWriter(path, schema) as writer:
+        n_boxes = 0
+        # Each batch is one row group
+        for columns in _iter_column_batches(boxes, batch_size):
+            writer.write_table(pa.table({name: columns[name] for name in COLUMNS}, schema=schema))
+            n_boxes += len(columns['xmin'])
+        record['boxes'] = n_boxes
+    return path
+
+
+def _read_parquet(path):
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=COLUMNS)
+    crs = (table.schema.metadata or {}).get(b'crs', b'').decode() or None
+    columns = {name: table.column(name).to_numpy() for name in FLOAT_COLUMNS}
+    columns['label'] = table.column('label').to_numpy(zero_copy_only=False).astype(str)
+    return crs, columns
+
+
+# %% GeoPackage
+def _write_gpkg(boxes, path, crs, batch_size):
+    from osgeo import ogr, osr
+    driver = ogr.GetDriverByName('GPKG')
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    data_source = driver.CreateDataSource(path)
+    srs = None
+    if crs:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(crs)
+    layer = data_source.CreateLayer('boxes', srs, ogr.wkbPolygon)
+    for name in FLOAT_COLUMNS:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
+    layer.CreateField(ogr.FieldDefn('label', ogr.OFTString))
+    layer_defn = layer.GetLayerDefn()
+    with metrics.stage('write_boxes', format='gpkg') as record:
+        n_boxes = 0
+        for columns in _iter_column_batches(boxes, batch_size):
+            # One transaction per batch, as committing each feature is slow
+            layer.StartTransaction()
+            for i in range(len(columns['xmin'])):
+                feature = ogr.Feature(layer_defn)
+                for name in FLOAT_COLUMNS:
+                    # NaN is left unset, and so saved as NULL
+                    if not np.isnan(columns[name][i]):
+                        feature.SetField(name, float(columns[name][i]))
+                feature.SetField('label', str(columns['label'][i]))
+                xmin, ymin, xmax, ymax = (float(columns[name][i]) for name in ['xmin', 'ymin', 'xmax', 'ymax'])
+                feature.SetGeometry(ogr.CreateGeometryFromWkt(
+                    f'POLYGON (({xmin} {ymin}, {xmax} {ymin}, {xmax} {ymax}, {xmin} {ymax}, {xmin} {ymin}))'))
+                layer.CreateFeature(feature)
+            layer.CommitTransaction()
+            n_boxes += len(columns['xmin'])
+        record['boxes'] = n_boxes
+    data_source = None
+    return path
+
+
+def _read_gpkg(path):
+    from osgeo import ogr
+    data_source = ogr.Open(path)
+    layer = data_source.GetLayer(0)
+    srs = layer.GetSpatialRef()
+    crs = srs.ExportToWkt() if srs is not None else None
+    values = {name: [] for name in COLUMNS}
+    for feature in layer:
+        for name in FLOAT_COLUMNS:
+            value = feature.GetField(name)
+            values[name].append(np.nan if value is None else value)
+        values['label'].append(feature.GetField('label') or '')
+    data_source = None
+    columns = {name: np.array(values[name], dtype=np.float64) for name in FLOAT_COLUMNS}
+    columns['label'] = np.array(values['label'], dtype=str)
+    return crs, columns
+
+
+# %% NPZ
+def _write_npz(boxes, path, crs, batch_size):
+    with metrics.stage('write_boxes', format='npz') as record:
+        batches = list(_iter_column_batches(boxes, batch_size))
+        columns = {name: np.concatenate([batch[name] for batch in batches]) for name in COLUMNS} if batches else _empty_columns()
+        # Labels are saved as a fixed width string array, so reading needs no pickle
+        np.savez_compressed(path, crs=np.array(crs or ''), **columns)
+        record['boxes'] = len(columns['xmin'])
+    return path
+
+
+def _read_npz(path):
+    with np.load(path) as saved:
+        crs = str(saved['crs']) or None
+        columns = {name: saved[name] for name in COLUMNS}
+    return crs, columns
+
+
+register_box_format('.xml', _write_xml, _read_xml)
+register_box_format('.parquet', _write_parquet, _read_parquet)
+register_box_format('.gpkg', _write_gpkg, _read_gpkg)
+register_box_format('.npz', _write_npz, _read_npz)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 09:48:31 2026
+
+@author: Liam
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from rgbtolasinator.converter.cache import get_las_identity
+from rgbtolasinator.converter.convert import _box_coords
+
+
+def get_las_set_identity(las_paths):
+    """Gets a key that identifies the contents of a set of las files (see get_las_identity())
+
+    Args:
+        las_paths (str or list): the las file(s)
+
+    Returns:
+        identity (str): hex digest identifying the files
+    """
+    if isinstance(las_paths, str):
+        las_paths = [las_paths]
+    identity = hashlib.sha1()
+    for las_path in sorted(os.path.abspath(las_path) for las_path in las_paths):
+        identity.update(get_las_identity(las_path).encode())
+    return identity.hexdigest()
+
+
+class BoxResultCache:
+    """An on-disk cache of the bounds found for each box of an annotation set, so converting the set again after a
+    few boxes were edited only recomputes those boxes. Each box is keyed by the las files, the conversion settings, its
+    geometry and its label, so added, moved, resized or relabelled boxes are found as missing.
+    Each set (e.g. an xml) is stored as one .npz holding only the boxes of its last run, so deleted boxes are dropped
+    when it is stored again. Sets whose las files have changed are never hit, as the keys include the las identity.
+    They are dropped by evict(), or once they are among the least recently used.
+
+    Args:
+        cache_dir (str): folder to keep the cache in. Made if it does not exist
+        max_sets (int): the most annotation sets to keep. The least recently used are evicted
+    """
+
+    def __init__(self, cache_dir, max_sets=1000):
+        self.cache_dir = cache_dir
+        self.max_sets = max_sets
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _set_path(self, set_name):
+        return os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(set_name).encode()).hexdigest() + '.npz')
+
+    @staticmethod
+    def box_keys(geo_boxes, las_identity, bottom_percentile=1, top_percentile=99, use_class=False, ground_cell_size=None):
+        """Gets the key of each box. A box's key changes if anything its bounds depend on changes
+
+        Args:
+            geo_boxes (list or BoxArray): boxes in geospatial coordinates (see px_to_geo())
+            las_identity (str): identity of the las files (see get_las_set_identity())
+            bottom_percentile, top_percentile, use_class: the conversion settings (see infer_z_bounds())
+            ground_cell_size (float): the cell size of the ground grid, if one is used
+
+        Returns:
+            keys (np array): a 20 byte key (S20) per box
+        """
+        coords = _box_coords(geo_boxes)
+        labels = geo_boxes.label.tolist() if hasattr(geo_boxes, 'label') else [box[4] for box in geo_boxes]
+        settings = f'{las_identity}|{float(bottom_percentile)!r}|{float(top_percentile)!r}|{bool(use_class)}|{ground_cell_size!r}|'.encode()
+        keys = np.empty(len(coords), dtype='S20')
+        for i, (xmin, ymin, xmax, ymax) in enumerate(coords.tolist()):
+            keys[i] = hashlib.sha1(settings + f'{xmin!r}|{ymin!r}|{xmax!r}|{ymax!r}|{labels[i]}'.encode()).digest()
+        return keys
+
+    def lookup(self, set_name, keys):
+        """Gets the cached bounds of the boxes of an annotation set
+
+        Args:
+            set_name (str): the annotation set, e.g. the path of its xml
+            keys (np array): the key of each box, from box_keys()
+
+        Returns:
+            zmin (np array): the cached bottom of each box, NaN where missing
+            zmax (np array): the cached top of each box, NaN where missing
+            missing (np array): indices of the boxes that are not cached, and so need converting
+        """
+        zmin = np.full(len(keys), np.nan)
+        zmax = np.full(len(keys), np.nan)
+        found = np.zeros(len(keys), dtype=bool)
+        set_path = self._set_path(set_name)
+        if os.path.exists(set_path) and len(keys) > 0:
+            try:
+                with np.load(set_path) as saved:
+                    cached_keys, cached_zmin, cached_zmax = saved['keys'], saved['zmin'], saved['zmax']
+            except (OSError, ValueError, KeyError):
+                cached_keys = np.zeros(0, dtype='S20')
+            if len(cached_keys) > 0:
+                # Cached keys are saved sorted
+                pos = np.clip(np.searchsorted(cached_keys, keys), 0, len(cached_keys) - 1)
+                found = cached_keys[pos] == keys
+                zmin[found] = cached_zmin[pos[found]]
+                zmax[found] = cached_zmax[pos[found]]
+            os.utime(set_path)
+        return zmin, zmax, np.flatnonzero(~found)
+
+    def store(self, set_name, keys, zmin, zmax, las_paths):
+        """Saves the bounds of every box of an annotation set, replacing those of its last run
+
+        Args:
+            set_name (str): the annotation set, e.g. the path of its xml
+            keys (np array): the key of each box, from box_keys()
+            zmin (np array): the bottom of each box
+            zmax (np array): the top of each box
+            las_paths (str or list): the las file(s) the bounds were found from, so the set is evicted if they change
+        """
+        if isinstance(las_paths, str):
+            las_paths = [las_paths]
+        keys, unique = np.unique(np.asarray(keys, dtype='S20'), return_index=True)
+        set_path = self._set_path(set_name)
+        # Write to a temporary file, then move it into place, so a partly written set is never read
+        tmp_path = set_path[:-4] + f'.tmp{os.getpid()}.npz'
+        np.savez(tmp_path, keys=keys, zmin=np.asarray(zmin, dtype=np.float64)[unique],
+                 zmax=np.asarray(zmax, dtype=np.float64)[unique],
+                 las_stats=np.array(json.dumps(_las_stats(las_paths))))
+        os.replace(tmp_path, set_path)
+        # Only trim to max_sets here, which needs no set to be opened. Stale sets are found by evict()
+        self._trim(self._list_sets())
+
+    def _list_sets(self):
+        """Gets the path of every stored set"""
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                if name.endswith('.npz') and '.tmp' not in name]
+
+    def _trim(self, set_paths):
+        """Deletes the least recently used sets until there are no more than max_sets"""
+        sets = []
+        for set_path in set_paths:
+            try:
+                sets.append((os.path.getmtime(set_path), set_path))
+            except OSError:
+                # Removed by another run
+                pass
+        for _, set_path in sorted(sets)[:max(len(sets) - self.max_sets, 0)]:
+            os.remove(set_path)
+
+    def evict(self):
+        """Deletes the sets whose las files have changed or been deleted, then the least recently used sets
+        until there are no more than max_sets. A las file counts as changed when its size or modification time does,
+        so only a stat of each is needed, not a read of its header
+        """
+        kept = []
+        for set_path in self._list_sets():
+            try:
+                with np.load(set_path) as saved:
+                    las_stats = json.loads(str(saved['las_stats']))
+                stale = _las_stats([path for path, _, _ in las_stats]) != las_stats
+            except (OSError, ValueError, KeyError):
+                # Unreadable, from an older version, or a las file is gone
+                stale = True
+            if stale:
+                os.remove(set_path)
+            else:
+                kept.append(set_path)
+        self._trim(kept)
+
+
+def _las_stats(las_paths):
+    """Gets the path, size and modification time of each las file, to tell cheaply whether any has changed"""
+    stats = []
+    for las_path in sorted(os.path.abspath(las_path) for las_path in las_paths):
+        stat = os.stat(las_path)
+        stats.append([las_path, stat.st_size, stat.st_mtime_ns])
+    return stats
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:05:33 2026
+
+@author: Liam
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from rgbtolasinator.converter.convert import infer_z_bounds_batch, _box_coords
+from rgbtolasinator.converter.pointcloud import PointCloud
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator import metrics
+
+# The pointcloud and index of a worker process, attached from shared memory by _init_worker()
+_worker = {}
+
+
+def _share_array(array, blocks):
+    """Copies an array into a new shared memory block. Returns what a worker needs to attach to it"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _attach_array(spec):
+    """Attaches to an array in shared memory, without copying it"""
+    name, shape, dtype = spec
+    # Pool workers share the parent's resource tracker, so the block is still unlinked once, by the parent
+    block = shared_memory.SharedMemory(name=name)
+    _worker.setdefault('blocks', []).append(block)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _init_worker(specs, origin, grid_params, kwargs):
+    """Attaches a worker process to the shared pointcloud and index"""
+    x, y, z, classification, order, cell_starts = [_attach_array(spec) for spec in specs]
+    pointcloud = PointCloud(x, y, z, classification, origin)
+    _worker['pointcloud'] = pointcloud
+    _worker['index'] = GridIndex.from_arrays(pointcloud, order, cell_starts, **grid_params)
+    _worker['kwargs'] = kwargs
+
+
+def _run_partition(task):
+    """Infers the z bounds of one partition of the boxes, in a worker process"""
+    positions, coords = task
+    zmin, zmax = infer_z_bounds_batch(coords, _worker['pointcloud'], index=_worker['index'], **_worker['kwargs'])
+    return positions, zmin, zmax
+
+
+def _morton_order(coords):
+    """Orders boxes along a Z-order curve through their centres, so neighbouring boxes end up in the same partition"""
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.int64)
+    centre_x = (coords[:, 0] + coords[:, 2]) / 2
+    centre_y = (coords[:, 1] + coords[:, 3]) / 2
+    codes = np.zeros(len(coords), dtype=np.uint64)
+    for axis, centre in enumerate([centre_x, centre_y]):
+        span = max(np.ptp(centre), 1e-9)
+        cells = ((centre - centre.min()) / span * 65535).astype(np.uint64)
+        # Spread the 16 bits of the cell out to every other bit
+        cells = (cells | (cells << np.uint64(8))) & np.uint64(0x00FF00FF)
+        cells = (cells | (cells << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+        cells = (cells | (cells << np.uint64(2))) & np.uint64(0x33333333)
+        cells = (cells | (cells << np.uint64(1))) & np.uint64(0x55555555)
+        codes |= cells << np.uint64(axis)
+    return np.argsort(codes, kind='stable')
+
+
+@metrics.timed('z_inference_parallel')
+def infer_z_bounds_parallel(boxes, pointcloud, bottom_percentile=1, top_percentile=99, use_class=False, index=None,
+                            workers=None, partitions_per_worker=4, ground_grid=None):
+    """Infers the zmin and zmax bounds of many tree boxes across a pool of processes. See infer_z_bounds_batch().
+    The pointcloud and its index are copied once into shared memory, and attached to (not copied) by each worker.
+    Boxes are split into spatially compact partitions, and the results are returned in the original box order.
+    !! boxes and pointcloud must be in the same coordinate system !!
+
+    Args:
+        boxes (list or np array): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+        pointcloud (PointCloud or np array): the pointcloud to subset from. Arrays are converted to a PointCloud
+        bottom_percentile (int): the percentile to define the bottom of the tree as
+        top_percentile (int): the percentile to define the top of the tree as
+        use_class (bool): whether to use the class, see infer_z_bounds()
+        index (GridIndex): optional spatial index built on pointcloud. If None, one is built
+        workers (int): the number of processes. If None, the number of CPUs
+        partitions_per_worker (int): how many partitions to split the boxes into per worker, to balance the load
+        ground_grid (GroundGrid): optional ground grid, see infer_z_bounds_batch(). Copied to each worker
+
+    Returns:
+        zmin (np array): the bottom of each box
+        zmax (np array): the top of each box
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if not isinstance(pointcloud, PointCloud):
+        pointcloud = PointCloud.from_array(pointcloud)
+        index = None
+    if index is None or index.pointcloud is not pointcloud:
+        index = GridIndex(pointcloud)
+    coords = _box_coords(boxes)
+
+    # Split the boxes into spatially compact partitions
+    order = _morton_order(coords)
+    tasks = [(positions, coords[positions]) for positions in np.array_split(order, max(workers * partitions_per_worker, 1))
+             if len(positions) > 0]
+
+    zmin = np.full(len(coords), np.nan)
+    zmax = np.full(len(coords), np.nan)
+    blocks = []
+    try:
+        # Copy the pointcloud and index into shared memory once
+        specs = [_share_array(array, blocks) for array in [pointcloud.x, pointcloud.y, pointcloud.z, pointcloud.classification,
+                                                            index.order, index.cell_starts]]
+        grid_params = {'x0': index.x0, 'y0': index.y0, 'cell_size': index.cell_size, 'nx': index.nx, 'ny': index.ny}
+        kwargs = {'bottom_percentile': bottom_percentile, 'top_percentile': top_percentile, 'use_class': use_class, 'ground_grid': ground_grid}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, pointcloud.origin, grid_params, kwargs)) as pool:
+            # Put each partition's results back in the original box order
+            for positions, part_zmin, part_zmax in pool.map(_run_partition, tasks):
+                zmin[positions] = part_zmin
+                zmax[positions] = part_zmax
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return zmin, zmax
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 24 10:21:57 2026
+
+@author: Liam
+"""
+
+import threading
+from collections import deque
+
+# The default most bytes each queue between two stages can hold (see set_memory_budget())
+_memory_budget = 256 * 1024 ** 2
+
+
+def set_memory_budget(max_bytes):
+    """Sets the most memory each queue between two pipeline stages can hold by default, e.g. the las chunks decoded
+    ahead of projection. A stage waits while its queue is full, so a fast reader cannot run far ahead of a slow consumer
+
+    Args:
+        max_bytes (int): the budget of each queue, in bytes. A queue always takes at least one item, however large
+    """
+    global _memory_budget
+    _memory_budget = int(max_bytes)
+
+
+def get_memory_budget():
+    """Gets the default memory budget of each queue between pipeline stages (see set_memory_budget())
+
+    Returns:
+        max_bytes (int): the budget, in bytes
+    """
+    return _memory_budget
+
+
+def item_bytes(item):
+    """Estimates the memory an item passed between stages holds, from its numpy arrays. Lists are not looked into,
+    as walking e.g. a list of boxes would cost more than the estimate saves
+
+    Args:
+        item: e.g. a np array, a laspy point record, or a tuple/dict of them
+
+    Returns:
+        nbytes (int): the bytes of the arrays found. 0 if none are
+    """
+    if isinstance(item, tuple):
+        return sum(item_bytes(value) for value in item)
+    if isinstance(item, dict):
+        return sum(item_bytes(value) for value in item.values())
+    if hasattr(item, 'nbytes'):
+        return int(item.nbytes)
+    # e.g. laspy point records, which keep their points in .array
+    if hasattr(item, 'array') and hasattr(item.array, 'nbytes'):
+        return int(item.array.nbytes)
+    return 0
+
+
+class BoundedQueue:
+    """A queue between two stages of a pipeline, bounded by both the number of items and the bytes they hold.
+    put() waits while the queue is full. Either end can close it: the producer once it is done (or has failed), so the
+    consumer stops, and the consumer if it stops early, so the producer stops too
+
+    Args:
+        max_items (int): the most items the queue holds
+        max_bytes (int): the most bytes the queued items hold (see item_bytes()). If None, get_memory_budget()
+    """
+
+    _END = object()
+
+    def __init__(self, max_items=2, max_bytes=None):
+        self.max_items = max(int(max_items), 1)
+        self.max_bytes = get_memory_budget() if max_bytes is None else max_bytes
+        self._items = deque()
+        self._bytes = 0
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        """Adds an item, waiting while the queue is full
+
+        Args:
+            item: the item
+
+        Returns:
+            accepted (bool): False if the queue was closed, and the producer should stop
+        """
+        nbytes = item_bytes(item)
+        with self._condition:
+            # Always take one item, so an item larger than the budget cannot stall the pipeline
+            while not self._closed and len(self._items) > 0 and (
+                    len(self._items) >= self.max_items or self._bytes + nbytes > self.max_bytes):
+                self._condition.wait()
+            if self._closed:
+                return False
+            self._items.append((item, nbytes))
+            self._bytes += nbytes
+            self._condition.notify_all()
+            return True
+
+    def get(self):
+        """Takes the next item, waiting until there is one
+
+        Returns:
+            item: the item, or BoundedQueue._END once the queue is closed and empty
+
+        Raises:
+            the exception the producer failed with, once the items before it have been taken
+        """
+        with self._condition:
+            while len(self._items) == 0 and not self._closed:
+                self._condition.wait()
+            if len(self._items) == 0:
+                if self._error is not None:
+                    raise self._error
+                return self._END
+            item, nbytes = self._items.popleft()
+            self._bytes -= nbytes
+            self._condition.notify_all()
+            return item
+
+    def close(self, error=None):
+        """Closes the queue. Items already queued can still be taken, but no more can be added
+
+        Args:
+            error (Exception): if passed, raised by get() once the queue is empty
+        """
+        with self._condition:
+            self._closed = True
+            self._error = error
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Closes the queue and drops what it holds, e.g. when the consumer stops early"""
+        with self._condition:
+            self._closed = True
+            self._items.clear()
+            self._bytes = 0
+            self._condition.notify_all()
+
+
+def prefetch(iterable, max_items=2, max_bytes=None):
+    """Iterates over iterable on a background thread, up to max_items (and max_bytes) ahead of the caller. Use it when
+    producing each item releases the GIL (e.g. reading and decompressing with laspy, GDAL reads, XML parsing), so the
+    next item is produced while the caller works on this one. Items come in the same order, and an exception raised by
+    iterable is raised to the caller when it reaches it
+
+    Args:
+        iterable: the items, e.g. the chunks of iter_las_chunks()
+        max_items (int): the most items produced ahead of the caller
+        max_bytes (int): the most bytes held by the items produced ahead. If None, get_memory_budget()
+
+    Yields:
+        the items of iterable
+    """
+    queue = BoundedQueue(max_items, max_bytes)
+    iterator = iter(iterable)
+
+    def _produce():
+        try:
+            for item in iterator:
+                if not queue.put(item):
+                    break
+        except BaseException as error:
+            queue.close(error)
+        else:
+            queue.close()
+        finally:
+            # Let a generator clean up (e.g. close its file) on this thread, which it was running on
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    producer = threading.Thread(target=_produce, name='rgbtolasinator-prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is BoundedQueue._END:
+                return
+            yield item
+    finally:
+        queue.cancel()
+        producer.join()
+
+
+def pipeline(source, *stages, max_items=2, max_bytes=None):
+    """Runs source and each stage on its own thread, linked by bounded queues (see prefetch()), so reading the next
+    item, and each stage of the items before it, all overlap. Items come out in order
+
+    Example:
+        for pointcloud in pipeline(iter_las_chunks(las_path), project):
+            ...
+
+    Args:
+        source: the items to process, e.g. las chunks
+        stages (function): each takes an item from the stage before it and returns the item for the next
+        max_items (int): the most items each queue holds
+        max_bytes (int): the most bytes each queue holds. If None, get_memory_budget()
+
+    Returns:
+        items (generator): the items of the last stage
+    """
+    items = prefetch(source, max_items, max_bytes)
+    for stage in stages:
+        items = prefetch(_apply(stage, items), max_items, max_bytes)
+    return items
+
+
+def _apply(stage, items):
+    """Applies a stage to each item. Closes items when done, so the stages before it stop as soon as this one does"""
+    try:
+        for item in items:
+            yield stage(item)
+    finally:
+        items.close()
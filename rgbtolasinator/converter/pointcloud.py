@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 11:02:17 2026
+
+@author: Liam
+"""
+
+import numpy as np
+
+
+class PointCloud:
+    """A compact, columnar pointcloud. Stores x, y, z as float32 relative to a local origin, and the class as uint8,
+    so a point takes 13 bytes instead of the 32 of a [X, Y, Z, Class] float64 array.
+    Indexing it (with a mask or indices) returns a new PointCloud holding only those points.
+    float32 keeps ~1 mm precision for points within ~8 km of the origin, finer than typical las scales.
+
+    Args:
+        x (np array): x coordinates, relative to origin
+        y (np array): y coordinates, relative to origin
+        z (np array): z coordinates, relative to origin
+        classification (np array): ASPRS class of each point
+        origin (tuple): (x, y, z) geospatial coordinates of the local origin
+    """
+
+    def __init__(self, x, y, z, classification, origin=(0.0, 0.0, 0.0)):
+        self.x = np.asarray(x, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.float32)
+        self.z = np.asarray(z, dtype=np.float32)
+        self.classification = np.asarray(classification, dtype=np.uint8)
+        self.origin = np.asarray(origin, dtype=np.float64)
+
+    @classmethod
+    def from_array(cls, pointcloud, origin=None):
+        """Makes a PointCloud from a [X, Y, Z, Class] array in geospatial coordinates (see project_las_geospatial())
+
+        Args:
+            pointcloud (np array): points as [X, Y, Z, Class]
+            origin (tuple): (x, y, z) local origin. If None, the (floored) minimum of the points is used
+
+        Returns:
+            PointCloud
+        """
+        if origin is None:
+            origin = _default_origin(pointcloud[:, 0], pointcloud[:, 1], pointcloud[:, 2])
+        origin = np.asarray(origin, dtype=np.float64)
+        if pointcloud.shape[1] > 3:
+            classification = pointcloud[:, 3]
+        else:
+            classification = np.zeros(len(pointcloud), dtype=np.uint8)
+        return cls(pointcloud[:, 0] - origin[0], pointcloud[:, 1] - origin[1], pointcloud[:, 2] - origin[2],
+                   classification, origin)
+
+    @classmethod
+    def from_las_data(cls, las_data, las_transform_dict, origin=None):
+        """Makes a PointCloud straight from las coordinates, without a float64 [X, Y, Z, Class] copy of the cloud
+
+        Args:
+            las_data (np array): points as [X, Y, Z, Class] in las coordinates (see load_las())
+            las_transform_dict (dict): transformation parameters of points for LAS coords to geospatial coords
+            origin (tuple): (x, y, z) local origin. If None, the (floored) minimum of the points is used
+
+        Returns:
+            PointCloud
+        """
+        # Project one column at a time, as project_las_geospatial() does
+        x = las_data[:, 0] * las_transform_dict['scalex'] + las_transform_dict['offsetx']
+        y = las_data[:, 1] * las_transform_dict['scaley'] + las_transform_dict['offsety']
+        z = las_data[:, 2] * las_transform_dict['scalez'] + las_transform_dict['offsetz']
+        if origin is None:
+            origin = _default_origin(x, y, z)
+        origin = np.asarray(origin, dtype=np.float64)
+        return cls(x - origin[0], y - origin[1], z - origin[2], las_data[:, 3], origin)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, ind):
+        return PointCloud(self.x[ind], self.y[ind], self.z[ind], self.classification[ind], self.origin)
+
+    @property
+    def nbytes(self):
+        """The memory used by the points, in bytes"""
+        return self.x.nbytes + self.y.nbytes + self.z.nbytes + self.classification.nbytes
+
+    def crop(self, extent):
+        """Gets the points within a geospatial extent (edges included)
+
+        Args:
+            extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates
+
+        Returns:
+            pointcloud (PointCloud): the points within extent
+        """
+        xmin, ymin = extent[0] - self.origin[0], extent[1] - self.origin[1]
+        xmax, ymax = extent[2] - self.origin[0], extent[3] - self.origin[1]
+        return self[(self.x >= xmin) & (self.x <= xmax) & (self.y >= ymin) & (self.y <= ymax)]
+
+    def to_array(self):
+        """Gets the points as a [X, Y, Z, Class] float64 array in geospatial coordinates, as project_las_geospatial() returns
+
+        Returns:
+            pointcloud (np array): points as [X, Y, Z, Class]
+        """
+        pointcloud = np.empty((len(self), 4), dtype=np.float64)
+        pointcloud[:, 0] = self.x
+        pointcloud[:, 0] += self.origin[0]
+        pointcloud[:, 1] = self.y
+        pointcloud[:, 1] += self.origin[1]
+        pointcloud[:, 2] = self.z
+        pointcloud[:, 2] += self.origin[2]
+        pointcloud[:, 3] = self.classification
+        return pointcloud
+
+
+def _default_origin(x, y, z):
+    """Picks a local origin for a set of points, the floored minimum of each axis"""
+    if len(x) == 0:
+        return np.zeros(3)
+    return np.floor([x.min(), y.min(), z.min()])
+
+
+def get_columns(pointcloud):
+    """Gets the columns of a pointcloud, whether it is a PointCloud or a [X, Y, Z, Class] array.
+    The geospatial coordinates of a point are its x, y, z plus origin
+
+    Args:
+        pointcloud (PointCloud or np array): the pointcloud
+
+    Returns:
+        x, y, z (np array): coordinates, relative to origin
+        classification (np array): ASPRS class of each point, None if the array has no class column
+        origin (np array): (x, y, z) local origin. Zeros for arrays, which are already in geospatial coordinates
+    """
+    if isinstance(pointcloud, PointCloud):
+        return pointcloud.x, pointcloud.y, pointcloud.z, pointcloud.classification, pointcloud.origin
+    classification = pointcloud[:, 3] if pointcloud.shape[1] > 3 else None
+    return pointcloud[:, 0], pointcloud[:, 1], pointcloud[:, 2], classification, np.zeros(3)
+
+
+def get_geo_z(pointcloud):
+    """Gets the z of every point in geospatial coordinates, as float64
+
+    Args:
+        pointcloud (PointCloud or np array): the pointcloud
+
+    Returns:
+        z (np array): geospatial z of each point
+    """
+    _, _, z, _, origin = get_columns(pointcloud)
+    return z.astype(np.float64) + origin[2]
+
+
+def concatenate_pointclouds(pointclouds, origin=None):
+    """Joins PointClouds into one. Clouds with a different origin are shifted to the shared one
+
+    Args:
+        pointclouds (list): the PointClouds to join
+        origin (tuple): (x, y, z) local origin of the result. If None, the origin of the first cloud is used
+
+    Returns:
+        pointcloud (PointCloud): all the points
+    """
+    if origin is None:
+        origin = pointclouds[0].origin if len(pointclouds) > 0 else np.zeros(3)
+    origin = np.asarray(origin, dtype=np.float64)
+    columns = {'x': [], 'y': [], 'z': [], 'classification': []}
+    for pointcloud in pointclouds:
+        shift = pointcloud.origin - origin
+        for axis, name in enumerate(['x', 'y', 'z']):
+            column = getattr(pointcloud, name)
+            if shift[axis] != 0:
+                column = (column.astype(np.float64) + shift[axis]).astype(np.float32)
+            columns[name].append(column)
+        columns['classification'].append(pointcloud.classification)
+    if len(pointclouds) == 0:
+        return PointCloud(np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0), origin)
+    return PointCloud(np.concatenate(columns['x']), np.concatenate(columns['y']), np.concatenate(columns['z']),
+                      np.concatenate(columns['classification']), origin)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 10:14:26 2026
+
+@author: Liam
+"""
+
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rgbtolasinator.converter.cache import get_las_identity
+from rgbtolasinator.converter.catalog import LasCatalog, find_tiles
+from rgbtolasinator.converter.convert import infer_z_bounds_batch
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.formats import write_boxes
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, load_pointcloud, get_tif_crs
+
+
+class PointCloudStore:
+    """Keeps recently used pointclouds, and their spatial indexes, in memory for many conversions.
+    Each las file (or folder of tiles) is loaded whole, once, and shared by every request that uses it. A folder loads
+    every one of its tiles, however few the boxes touch, so serve folders whose points fit in max_bytes. For larger
+    catalogs use convert_annots.py, which loads only the tiles under the annotations.
+    When the resident clouds use more than max_bytes, the least recently used are dropped.
+    Safe to use from many threads; concurrent requests for the same las wait for one load
+
+    Args:
+        max_bytes (int): the most memory the resident clouds and indexes can use, in bytes. The cloud in use is always kept
+        chunk_size (int): the number of las points to read at a time
+        cache (PointCloudCache): optional on-disk cache of decoded las files, to load from
+    """
+
+    def __init__(self, max_bytes=8 * 1024 ** 3, chunk_size=1_000_000, cache=None):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._identities = {}
+        self._lock = threading.Lock()
+
+    def _key(self, las_path):
+        """Identifies the contents of a las file or folder, so edited files are loaded again. The identity of each path
+        is kept, and only made again (from the tile headers) when the path, size or modification time of a file changes,
+        so a request costs a stat of each file rather than a read of each header"""
+        las_path = os.path.abspath(las_path)
+        tile_paths = [las_path] if os.path.isfile(las_path) else find_tiles(las_path)
+        signature = [(path, stat.st_size, stat.st_mtime_ns) for path, stat in ((path, os.stat(path)) for path in tile_paths)]
+        with self._lock:
+            known = self._identities.get(las_path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        if os.path.isfile(las_path):
+            key = get_las_identity(las_path)
+        else:
+            key = '|'.join([las_path] + [get_las_identity(path) for path in tile_paths])
+        with self._lock:
+            self._identities[las_path] = (signature, key)
+        return key
+
+    def _load(self, las_path):
+        if os.path.isfile(las_path):
+            pointcloud = load_pointcloud(las_path, chunk_size=self.chunk_size, cache=self.cache)
+        else:
+            pointcloud = LasCatalog(las_path).load(chunk_size=self.chunk_size, cache=self.cache)
+        index = GridIndex(pointcloud)
+        nbytes = pointcloud.nbytes + index.order.nbytes + index.cell_starts.nbytes
+        return pointcloud, index, nbytes
+
+    def get(self, las_path):
+        """Gets the pointcloud and index of a las file (or folder of tiles), loading them if they are not resident
+
+        Args:
+            las_path (str): path to the las file, or a folder of tiles
+
+        Returns:
+            pointcloud (PointCloud): the whole cloud, in geospatial coordinates
+            index (GridIndex): the index built on pointcloud
+        """
+        key = self._key(las_path)
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    pointcloud, index, _ = self._entries[key]
+                    return pointcloud, index
+                loading = self._loading.get(key)
+                if loading is None:
+                    # This thread loads it, others wait
+                    loading = self._loading[key] = threading.Event()
+                    break
+            loading.wait()
+        try:
+            entry = self._load(las_path)
+            with self._lock:
+                self._entries[key] = entry
+                self._evict()
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+        return entry[0], entry[1]
+
+    def _evict(self):
+        """Drops the least recently used clouds until the store is within max_bytes. Call while holding the lock"""
+        total = sum(nbytes for _, _, nbytes in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            total -= nbytes
+
+    def status(self):
+        """Describes the resident clouds
+
+        Returns:
+            status (dict): 'max_bytes', the total 'nbytes', and the 'points' and 'nbytes' of each resident cloud
+        """
+        with self._lock:
+            clouds = [{'key': key, 'points': len(pointcloud), 'nbytes': nbytes}
+                      for key, (pointcloud, _, nbytes) in self._entries.items()]
+        return {'max_bytes': self.max_bytes, 'nbytes': sum(cloud['nbytes'] for cloud in clouds), 'clouds': clouds}
+
+
+def convert_request(request, store):
+    """Runs one conversion request against the resident clouds
+
+    Args:
+        request (dict): 'las' and 'tif' paths, and either an 'xml' path or 'boxes' (pixel boxes, as read_pascalvoc()
+        gives). May set 'bottom_per', 'top_per' and 'use_class' (as convert_annots.py), and an 'output' path to write
+        (.xml, .parquet, .gpkg or .npz, see write_boxes())
+        store (PointCloudStore): the resident clouds
+
+    Returns:
+        response (dict): the converted 'boxes', the 'output' path (if written) and the 'seconds' taken
+    """
+    start = time.perf_counter()
+    for key in ['las', 'tif']:
+        if key not in request:
+            raise ValueError(f'Request is missing "{key}"')
+    if 'boxes' in request:
+        px_boxes = request['boxes']
+    elif 'xml' in request:
+        _, px_boxes = read_pascalvoc(request['xml'])
+    else:
+        raise ValueError('Request needs "xml" or "boxes"')
+    geo_boxes = px_to_geo(px_boxes, request['tif'])
+    boxes_3d = []
+    if len(geo_boxes) > 0:
+        pointcloud, index = store.get(request['las'])
+        zmin, zmax = infer_z_bounds_batch(geo_boxes, pointcloud, bottom_percentile=float(request.get('bottom_per', 1)),
+                                          top_percentile=float(request.get('top_per', 99)),
+                                          use_class=bool(request.get('use_class', False)), index=index)
+        boxes_3d = [box[:6] + [box_zmin, box_zmax] for box, box_zmin, box_zmax in zip(geo_boxes, zmin.tolist(), zmax.tolist())]
+    response = {}
+    if request.get('output'):
+        response['output'] = write_boxes(boxes_3d, request['output'], crs=get_tif_crs(request['tif']))
+    # NaN (boxes without points) is not valid json
+    response['boxes'] = [[None if isinstance(value, float) and value != value else value for value in box] for box in boxes_3d]
+    response['seconds'] = time.perf_counter() - start
+    return response
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """Answers POST /convert (a json request, see convert_request()) and GET /status"""
+
+    store = None
+
+    def _send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._send_json(200, self.store.status())
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/convert':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send_json(400, {'error': f'Invalid json: {e}'})
+            return
+        try:
+            self._send_json(200, convert_request(request, self.store))
+        except (ValueError, FileNotFoundError) as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception:
+            self._send_json(500, {'error': traceback.format_exc()})
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # What BaseHTTPRequestHandler expects of an HTTPServer
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(store, host='127.0.0.1', port=8765, socket_path=None):
+    """Makes a conversion server, over TCP or a unix socket. Each request is answered in its own thread.
+    Run it with server.serve_forever()
+
+    Args:
+        store (PointCloudStore): the resident clouds, shared by every request
+        host (str): the address to listen on
+        port (int): the port to listen on
+        socket_path (str): if passed, listen on this unix socket instead of host and port
+
+    Returns:
+        server (socketserver.BaseServer): the server
+    """
+    handler = type('BoundConversionHandler', (ConversionHandler,), {'store': store})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:21:40 2026
+
+@author: Liam
+"""
+
+import numpy as np
+import warnings
+from rgbtolasinator.converter.convert import _box_coords
+from rgbtolasinator.converter.pointcloud import PointCloud, get_columns, get_geo_z
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.utils import iter_las_chunks, get_las_transform, get_las_bounds
+from rgbtolasinator.converter.pipeline import prefetch
+from rgbtolasinator import metrics
+
+
+class ZSketch:
+    """A mergeable sketch of the z values within each of many boxes, for approximate percentiles.
+    Each box keeps a count of its points per z bin of width resolution, so points can be added a chunk at a time
+    and sketches of different chunks or tiles can be merged, without ever holding the points of a box.
+    Percentiles are within resolution (in z units) of np.percentile of the same points.
+
+    Args:
+        n_boxes (int): the number of boxes
+        resolution (float): the z bin width, and so the largest error of a percentile
+    """
+
+    def __init__(self, n_boxes, resolution=0.01):
+        self.n_boxes = n_boxes
+        self.resolution = resolution
+        # Compacted (box, bin, count) rows, sorted by box then bin
+        self.box_ids = np.zeros(0, dtype=np.int64)
+        self.bins = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        # Rows added since the last compaction
+        self._pending = []
+        self._n_pending = 0
+
+    def add(self, box_ids, z):
+        """Adds points to the sketch
+
+        Args:
+            box_ids (np array): the box each point is within (0 to n_boxes - 1)
+            z (np array): the geospatial z of each point
+        """
+        bins = np.floor(np.asarray(z, dtype=np.float64) / self.resolution).astype(np.int64)
+        rows = _compact(np.asarray(box_ids, dtype=np.int64), bins, np.ones(len(bins), dtype=np.int64))
+        self._add_rows(*rows)
+
+    def merge(self, other):
+        """Adds the points of another sketch (of the same boxes, with the same resolution) to this one
+
+        Args:
+            other (ZSketch): the sketch to merge in
+        """
+        if other.n_boxes != self.n_boxes or other.resolution != self.resolution:
+            raise ValueError('Can only merge sketches of the same boxes with the same resolution')
+        other._flush()
+        self._add_rows(other.box_ids, other.bins, other.counts)
+
+    def _add_rows(self, box_ids, bins, counts):
+        self._pending.append((box_ids, bins, counts))
+        self._n_pending += len(box_ids)
+        # Compact once the pending rows outgrow the compacted ones, so each row is re-sorted a bounded number of times
+        if self._n_pending > max(len(self.box_ids), 1_000_000):
+            self._flush()
+
+    def _flush(self):
+        """Compacts the pending rows into the sorted rows"""
+        if len(self._pending) == 0:
+            return
+        parts = [(self.box_ids, self.bins, self.counts)] + self._pending
+        self.box_ids, self.bins, self.counts = _compact(*[np.concatenate(column) for column in zip(*parts)])
+        self._pending = []
+        self._n_pending = 0
+
+    def box_counts(self):
+        """Gets the number of points added to each box
+
+        Returns:
+            counts (np array): the number of points in each box
+        """
+        self._flush()
+        return np.bincount(self.box_ids, weights=self.counts, minlength=self.n_boxes).astype(np.int64)
+
+    def percentiles(self, percentiles):
+        """Estimates percentiles of the z values of each box, interpolated as np.percentile does
+
+        Args:
+            percentiles (list): the percentiles to estimate
+
+        Returns:
+            results (np array): results[i, b] is percentiles[i] of box b. NaN for empty boxes
+            counts (np array): the number of points in each box
+        """
+        box_counts = self.box_counts()
+        results = np.full((len(percentiles), self.n_boxes), np.nan)
+        has_points = box_counts > 0
+        if not np.any(has_points):
+            return results, box_counts
+        # Cumulative count of points up to the end of each row, across all boxes
+        row_ends = np.cumsum(self.counts)
+        box_starts = np.cumsum(box_counts) - box_counts
+        n_points = box_counts[has_points]
+        for ii, percentile in enumerate(percentiles):
+            # Position of the percentile within each box, as np.percentile computes it
+            virtual_index = (n_points - 1) * np.true_divide(percentile, 100)
+            previous_index = np.floor(virtual_index)
+            gamma = virtual_index - previous_index
+            previous_index = np.minimum(previous_index.astype(np.int64), n_points - 1)
+            next_index = np.minimum(previous_index + 1, n_points - 1)
+            a = self._value_at(row_ends, box_starts[has_points] + previous_index)
+            b = self._value_at(row_ends, box_starts[has_points] + next_index)
+            diff_b_a = b - a
+            results[ii, has_points] = np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma)
+        return results, box_counts
+
+    def _value_at(self, row_ends, positions):
+        """Estimates the value at each position of the sorted points, spreading the points of a bin evenly across it"""
+        rows = np.searchsorted(row_ends, positions, side='right')
+        rank_in_bin = positions - (row_ends[rows] - self.counts[rows])
+        return (self.bins[rows] + (rank_in_bin + 0.5) / self.counts[rows]) * self.resolution
+
+
+def _compact(box_ids, bins, counts):
+    """Sums the counts of rows with the same box and bin. Returns the rows sorted by box then bin"""
+    if len(box_ids) == 0:
+        return box_ids, bins, counts
+    order = np.lexsort((bins, box_ids))
+    box_ids = box_ids[order]
+    bins = bins[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (box_ids[1:] != box_ids[:-1]) | (bins[1:] != bins[:-1])
+    starts = np.flatnonzero(first)
+    return box_ids[starts], bins[starts], np.add.reduceat(counts[order], starts)
+
+
+def sketch_pointcloud(boxes, pointcloud, resolution=0.01, use_class=False, sketches=None, index=None):
+    """Adds the points of a pointcloud (or of one chunk of it) to sketches of the boxes
+
+    Args:
+        boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+        pointcloud (PointCloud or np array): the points to add
+        resolution (float): the z bin width of new sketches
+        use_class (bool): if True, sketch ground (ASPRS 2) and low/medium/high vegetation (ASPRS 3,4,5) points separately
+        sketches (dict): sketches to add to, from an earlier call. If None, new sketches are made
+        index (GridIndex): optional spatial index built on pointcloud. If None, one is built
+
+    Returns:
+        sketches (dict): {'all': ZSketch}, or {'ground': ZSketch, 'veg': ZSketch} if use_class
+    """
+    coords = _box_coords(boxes)
+    if sketches is None:
+        names = ['ground', 'veg'] if use_class else ['all']
+        sketches = {name: ZSketch(len(coords), resolution) for name in names}
+    if len(pointcloud) == 0:
+        return sketches
+    if index is None:
+        index = GridIndex(pointcloud)
+    box_ids, pc_ind = index.query_many(coords)
+    in_boxes = pointcloud[pc_ind]
+    z = get_geo_z(in_boxes)
+    if use_class:
+        _, _, _, point_class, _ = get_columns(in_boxes)
+        ground = point_class == 2
+        veg = (point_class >= 3) & (point_class <= 5)
+        sketches['ground'].add(box_ids[ground], z[ground])
+        sketches['veg'].add(box_ids[veg], z[veg])
+    else:
+        sketches['all'].add(box_ids, z)
+    return sketches
+
+
+@metrics.timed('z_inference_stream')
+def sketch_z_bounds(boxes, las_paths, bottom_percentile=1, top_percentile=99, use_class=False, resolution=0.01,
+                    chunk_size=1_000_000):
+    """Estimates the zmin and zmax bounds of many tree boxes while streaming the las files, without loading the points.
+    Each chunk is added to per box sketches (see ZSketch) and dropped, so memory is set by chunk_size and the sketches.
+    The bounds are within resolution of those of infer_z_bounds_batch()
+    !! boxes and las must be in the same coordinate system !!
+
+    Args:
+        boxes (list, np array or BoxArray): the tree bounding boxes, each [xmin, ymin, xmax, ymax, ...]
+        las_paths (str or list): path to the las file, or paths to several las tiles
+        bottom_percentile (int): the percentile to define the bottom of the tree as
+        top_percentile (int): the percentile to define the top of the tree as
+        use_class (bool): whether to use the class, see infer_z_bounds()
+        resolution (float): the largest error of a bound, in z units
+        chunk_size (int): the number of las points to read at a time
+
+    Returns:
+        zmin (np array): the bottom of each box. NaN for boxes with no points
+        zmax (np array): the top of each box
+    """
+    if isinstance(las_paths, str):
+        las_paths = [las_paths]
+    coords = _box_coords(boxes)
+    if len(coords) == 0:
+        return np.zeros(0), np.zeros(0)
+    extent = (coords[:, 0].min(), coords[:, 1].min(), coords[:, 2].max(), coords[:, 3].max())
+    sketches = None
+    for las_path in las_paths:
+        las_transform_dict = get_las_transform(las_path)
+        mins, _ = get_las_bounds(las_path)
+        # The lower corner of the extent, as load_pointcloud() uses, but kept within the file so float32 keeps its precision
+        origin = np.floor([max(extent[0], mins[0]), max(extent[1], mins[1]), mins[2]])
+        # Decode the next chunk on a thread while this one is sketched
+        for las_data in prefetch(iter_las_chunks(las_path, extent, chunk_size)):
+            chunk = PointCloud.from_las_data(las_data, las_transform_dict, origin)
+            sketches = sketch_pointcloud(coords, chunk, resolution, use_class, sketches)
+    if sketches is None:
+        sketches = sketch_pointcloud(coords, PointCloud.from_array(np.zeros((0, 4))), resolution, use_class)
+
+    # Same fallbacks as infer_z_bounds_batch()
+    if use_class:
+        bottoms, ground_counts = sketches['ground'].percentiles([bottom_percentile])
+        tops, veg_counts = sketches['veg'].percentiles([top_percentile])
+        zmin = np.where(ground_counts > 0, bottoms[0], 0)
+        zmax = np.where(veg_counts > 0, tops[0], zmin)
+        if np.any(ground_counts == 0):
+            print(f'WARNING: No classified ground points found in {np.sum(ground_counts == 0)} boxes! Is the pointcloud classified?')
+        if np.any(veg_counts == 0):
+            print(f'WARNING: No classified vegetation points found in {np.sum(veg_counts == 0)} boxes! Is the pointcloud classified?')
+    else:
+        bounds, counts = sketches['all'].percentiles([bottom_percentile, top_percentile])
+        zmin, zmax = bounds
+        if np.any(counts == 0):
+            warnings.warn(f'WARNING: No points found within {np.sum(counts == 0)} tree bounding boxes! Are boxes and the pointcloud in the same coordinate system?')
+    return zmin, zmax
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:12:41 2026
+
+@author: Liam
+"""
+
+import numpy as np
+from rgbtolasinator import metrics
+from rgbtolasinator.converter.pointcloud import get_columns
+
+
+def _expand_ranges(starts, ends):
+    """Expands a set of [start, end) ranges into one array of all the integers they cover
+
+    Args:
+        starts (np array): start of each range
+        ends (np array): end of each range (exclusive)
+
+    Returns:
+        expanded (np array): concatenation of np.arange(start, end) for every range, in order
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Offset of each range within the output
+    range_offsets = np.cumsum(lengths) - lengths
+    # Shift a running counter so that each range starts at its own start value
+    expanded = np.arange(total, dtype=np.int64)
+    expanded += np.repeat(starts - range_offsets, lengths)
+    return expanded
+
+
+class GridIndex:
+    """A uniform XY grid over a pointcloud. Built once, then used to fetch the points within a box
+    without comparing against every point in the cloud.
+    Points are sorted by grid cell, so every row of cells a box covers is one contiguous run of points.
+    !! Boxes passed to the query functions must be in the same coordinate system as the pointcloud !!
+
+    Args:
+        pointcloud (PointCloud or np array): the points, see PointCloud or project_las_geospatial()
+        cell_size (float): width of a grid cell. If None, picked so that cells hold ~points_per_cell points on average
+        points_per_cell (int): the target average number of points per cell when cell_size is None
+    """
+
+    def __init__(self, pointcloud, cell_size=None, points_per_cell=64):
+        self.pointcloud = pointcloud
+        # The grid is built in the cloud's local coordinates. Boxes are shifted by the origin when queried
+        x, y, _, _, origin = get_columns(pointcloud)
+        self._x = x
+        self._y = y
+        self.origin = origin
+        n_points = len(x)
+
+        # Get the extent of the cloud
+        if n_points == 0:
+            self.x0, self.y0, width, height = 0.0, 0.0, 0.0, 0.0
+        else:
+            self.x0 = float(x.min())
+            self.y0 = float(y.min())
+            width = float(x.max()) - self.x0
+            height = float(y.max()) - self.y0
+
+        # Choose a cell size from the point density if one was not given
+        if cell_size is None:
+            area = width * height
+            if area > 0 and n_points > 0:
+                cell_size = np.sqrt(area * points_per_cell / n_points)
+            else:
+                cell_size = max(width, height, 1.0)
+        self.cell_size = float(cell_size)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        # Sort the points by cell, and record where each cell starts in the sorted order
+        with metrics.stage('grid_index', points=n_points):
+            cell_ids = self._cell_ids(x, y)
+            order = np.argsort(cell_ids, kind='stable')
+            index_dtype = np.int32 if n_points < np.iinfo(np.int32).max else np.int64
+            self.order = order.astype(index_dtype, copy=False)
+            counts = np.bincount(cell_ids, minlength=self.nx * self.ny)
+            self.cell_starts = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+            np.cumsum(counts, out=self.cell_starts[1:])
+
+    @classmethod
+    def from_arrays(cls, pointcloud, order, cell_starts, x0, y0, cell_size, nx, ny):
+        """Remakes a GridIndex from the arrays of an existing one (e.g. in shared memory), without sorting the points again
+
+        Args:
+            pointcloud (PointCloud or np array): the pointcloud the index was built on
+            order, cell_starts (np array): the order and cell_starts arrays of the index
+            x0, y0, cell_size, nx, ny: the grid parameters of the index
+
+        Returns:
+            GridIndex
+        """
+        index = cls.__new__(cls)
+        index.pointcloud = pointcloud
+        index._x, index._y, _, _, index.origin = get_columns(pointcloud)
+        index.order = order
+        index.cell_starts = cell_starts
+        index.x0, index.y0, index.cell_size, index.nx, index.ny = x0, y0, cell_size, nx, ny
+        return index
+
+    def _cell_ids(self, x, y):
+        """Gets the (row major) grid cell of each point"""
+        cx = np.clip(((x - self.x0) // self.cell_size).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip(((y - self.y0) // self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return cy * self.nx + cx
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        """Gets the indices of all points in the grid cells the box touches (a superset of the points in the box)"""
+        if len(self.order) == 0 or not (xmin < xmax and ymin < ymax):
+            return np.zeros(0, dtype=np.int64)
+        # Get the range of cells covered by the box
+        cx0 = int(np.clip((xmin - self.x0) // self.cell_size, 0, self.nx - 1))
+        cx1 = int(np.clip((xmax - self.x0) // self.cell_size, 0, self.nx - 1))
+        cy0 = int(np.clip((ymin - self.y0) // self.cell_size, 0, self.ny - 1))
+        cy1 = int(np.clip((ymax - self.y0) // self.cell_size, 0, self.ny - 1))
+        # Each row of cells is one contiguous run of sorted points
+        rows = np.arange(cy0, cy1 + 1, dtype=np.int64) * self.nx
+        starts = self.cell_starts[rows + cx0]
+        ends = self.cell_starts[rows + cx1 + 1]
+        return self.order[_expand_ranges(starts, ends)]
+
+    def query(self, tree_box: list):
+        """Gets the indices of the points that are within the tree box. Matches the bounds test in get_tree_from_las()
+
+        Args:
+            tree_box (list): the tree bounding box, [xmin, ymin, xmax, ymax, ...]
+
+        Returns:
+            pc_ind (np array): indices (into the pointcloud) of the points within tree_box, in ascending order
+        """
+        xmin = tree_box[0] - self.origin[0]
+        ymin = tree_box[1] - self.origin[1]
+        xmax = tree_box[2] - self.origin[0]
+        ymax = tree_box[3] - self.origin[1]
+        candidates = self._candidates(xmin, ymin, xmax, ymax)
+        # Keep only the candidates strictly inside the box
+        cand_x = self._x[candidates]
+        cand_y = self._y[candidates]
+        inside = (cand_x > xmin) & (cand_x < xmax) & (cand_y > ymin) & (cand_y < ymax)
+        # Sort so the subset keeps the same point order as a boolean mask would
+        pc_ind = np.sort(candidates[inside])
+        return pc_ind
+
+    def subset(self, tree_box: list):
+        """Gets the points that are within the tree box
+
+        Args:
+            tree_box (list): the tree bounding box, [xmin, ymin, xmax, ymax, ...]
+
+        Returns:
+            tree_pc: subset of the pointcloud containing only points within tree_box bounds
+        """
+        return self.pointcloud[self.query(tree_box)]
+
+    def query_many(self, boxes):
+        """Finds the points within many boxes at once. A point within several (overlapping) boxes is returned once per box
+
+        Args:
+            boxes (np array): box bounds as rows of [xmin, ymin, xmax, ymax], in geospatial coordinates
+
+        Returns:
+            box_ids (np array): for each point found, the row of the box it is within
+            pc_ind (np array): for each point found, its index into the pointcloud
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4) - self.origin[[0, 1, 0, 1]]
+        xmin, ymin, xmax, ymax = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        valid = (xmin < xmax) & (ymin < ymax) & (len(self.order) > 0)
+
+        # Get the range of cells covered by each box. Invalid boxes cover no rows
+        def _cell(v, v0, n_cells):
+            return np.clip((np.where(valid, v, v0) - v0) // self.cell_size, 0, n_cells - 1).astype(np.int64)
+        cx0 = _cell(xmin, self.x0, self.nx)
+        cx1 = _cell(xmax, self.x0, self.nx)
+        cy0 = _cell(ymin, self.y0, self.ny)
+        cy1 = np.where(valid, _cell(ymax, self.y0, self.ny), cy0 - 1)
+
+        # Expand each box into its rows of cells, and each row into its run of sorted points
+        row_box = np.repeat(np.arange(len(boxes)), cy1 - cy0 + 1)
+        rows = _expand_ranges(cy0, cy1 + 1) * self.nx
+        starts = self.cell_starts[rows + cx0[row_box]]
+        ends = self.cell_starts[rows + cx1[row_box] + 1]
+        box_ids = np.repeat(row_box, ends - starts)
+        candidates = self.order[_expand_ranges(starts, ends)]
+
+        # Keep only the candidates strictly inside their box
+        cand_x = self._x[candidates]
+        cand_y = self._y[candidates]
+        inside = ((cand_x > xmin[box_ids]) & (cand_x < xmax[box_ids])
+                  & (cand_y > ymin[box_ids]) & (cand_y < ymax[box_ids]))
+        return box_ids[inside], candidates[inside]
@@ -5,11 +5,17 @@ Created on Thur Apr 13 12:33:48 2023
 @author: Liam
 """
 import numpy as np
-import laspy as lp
+import os
+import struct
 import warnings
-from osgeo import gdal
-from pascal_voc_writer import Writer
+from contextlib import closing
+from functools import lru_cache
 from csv import writer
+# laspy and GDAL are imported by the functions that use them, so importing the package stays fast
+from rgbtolasinator import metrics
+from rgbtolasinator.converter.boxes import BoxArray, px_to_geo_array, geo_to_px_array
+from rgbtolasinator.converter.pointcloud import PointCloud, concatenate_pointclouds, get_columns
+from rgbtolasinator.converter.pipeline import prefetch
 
 
 # %% Annotation utils
@@ -24,37 +30,87 @@ def read_pascalvoc(xml_file: str):
         list_with_all_boxes (list): A list of lists with format [xmin, ymin, xmax, ymax, label, prediction_confidence, extra1, extra2]
 
     """
-    # This was modified from: https://stackoverflow.com/questions/53317592/reading-pascal-voc-annotations-in-python
-    import xml.etree.ElementTree as ET
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    # Initialize list
     list_with_all_boxes = []
-    # For each box listed in the .xml file
-    filename = root.find('filename').text
-    for boxes in root.iter('object'):
-        # Initialize bounds, class
-        ymin, xmin, ymax, xmax, label = None, None, None, None, None
-        # Read the information from the .xml
-        ymin = float(boxes.find("bndbox/ymin").text)
-        xmin = float(boxes.find("bndbox/xmin").text)
-        ymax = float(boxes.find("bndbox/ymax").text)
-        xmax = float(boxes.find("bndbox/xmax").text)
-        label = boxes.find("name").text
-        conf = boxes.find('pose').text
-        xtra1 = boxes.find("truncated").text
-        xtra2 = boxes.find("difficult").text
-        # Put the information into a list, append that list to master list to be output
-        list_with_single_boxes = [xmin, ymin, xmax, ymax, label, conf, xtra1, xtra2]
-        list_with_all_boxes.append(list_with_single_boxes)
+    filename = None
+    with metrics.stage('read_pascalvoc') as record:
+        for filename, batch in _iterparse_pascalvoc(xml_file, batch_size=10000):
+            list_with_all_boxes.extend(batch)
+        record['boxes'] = len(list_with_all_boxes)
     # Return the filename, and the list of all box bounds/classes
     return filename, list_with_all_boxes
 
 
-def write_pascalvoc(boxes: list, xml_path: str):
+def iter_pascalvoc(xml_file: str, batch_size=10000):
+    """Reads the boxes of an xml file in batches, without holding the whole document in memory.
+    Memory stays flat no matter how many objects the file has
+
+    Args:
+        xml_file (str): str, path to annotation file to be read
+        batch_size (int): the number of boxes per batch
+
+    Yields:
+        boxes (list): A list of up to batch_size lists with format [xmin, ymin, xmax, ymax, label, prediction_confidence, extra1, extra2]
+    """
+    for _, batch in _iterparse_pascalvoc(xml_file, batch_size):
+        if len(batch) > 0:
+            yield batch
+
+
+def _iterparse_pascalvoc(xml_file, batch_size):
+    """Parses an xml file incrementally, yielding (filename, boxes) batches. Each object is read once, then cleared"""
+    import xml.etree.ElementTree as ET
+    root = None
+    filename = None
+    depth = 0
+    batch = []
+    for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and elem.tag == 'filename' and filename is None:
+            filename = elem.text
+        elif elem.tag == 'object':
+            batch.append(_parse_object(elem))
+            elem.clear()
+            if len(batch) >= batch_size:
+                yield filename, batch
+                batch = []
+        # Drop finished top level elements, so the tree never grows
+        if depth == 1:
+            root.clear()
+    yield filename, batch
+
+
+def _parse_object(obj):
+    """Reads a box from an <object> element, as [xmin, ymin, xmax, ymax, label, conf, extra1, extra2]"""
+    # Take the first of each child, as Element.find() would
+    fields = {}
+    for child in obj:
+        fields.setdefault(child.tag, child)
+    bndbox = {}
+    for child in fields['bndbox']:
+        bndbox.setdefault(child.tag, child.text)
+    # Read the information from the .xml
+    ymin = float(bndbox['ymin'])
+    xmin = float(bndbox['xmin'])
+    ymax = float(bndbox['ymax'])
+    xmax = float(bndbox['xmax'])
+    label = fields['name'].text
+    conf = fields['pose'].text
+    xtra1 = fields['truncated'].text
+    xtra2 = fields['difficult'].text
+    return [xmin, ymin, xmax, ymax, label, conf, xtra1, xtra2]
+
+
+def write_pascalvoc(boxes, xml_path: str):
     """
     This function writes the boxes to an xml in PASCALVOC format.
     'boxes' is a list of lists. A box in boxes is [xmin, ymin, xmax, ymax, label, conf, extra1, extra2]
+    Boxes are written as they are iterated, so boxes can also be a generator (e.g. of converted batches).
+    The output is the same as pascal_voc_writer's
 
     Args:
         boxes (list): Boxes to write to the xml file.
@@ -63,46 +119,102 @@ def write_pascalvoc(boxes: list, xml_path: str):
     Returns:
         xml_path (str): Path the xml was saved
     """
-    # Init writer
-    writer = Writer(xml_path[:-4], 0, 0)
-
-    # Iterate through the boxes
-    for box in boxes:
-        xmin = box[0]
-        ymin = box[1]
-        xmax = box[2]
-        ymax = box[3]
-        label = box[4]
-        conf = box[5]
-        extra1 = box[6]
-        extra2 = box[7]
-        # Add box to the output
-        writer.addObject(label, xmin, ymin, xmax, ymax, conf, extra1, extra2)
-
-    # Save the file
-    writer.save(xml_path)
+    abspath = os.path.abspath(xml_path[:-4])
+    with metrics.stage('write_pascalvoc') as record, open(xml_path, 'w') as f:
+        f.write(_PASCALVOC_HEADER.format(folder=os.path.basename(os.path.dirname(abspath)),
+                                         filename=os.path.basename(abspath), path=abspath))
+        # Iterate through the boxes
+        n_boxes = 0
+        for box in boxes:
+            xmin, ymin, xmax, ymax, label, conf, extra1, extra2 = box[:8]
+            # str() each value, as the jinja template did, so e.g. numpy float32 is written as 1.1, not 1.100000023841858
+            f.write(_PASCALVOC_OBJECT.format(*map(str, (label, conf, extra1, extra2, xmin, ymin, xmax, ymax))))
+            n_boxes += 1
+        f.write('\n</annotation>\n')
+        record['boxes'] = n_boxes
     return xml_path
 
 
+_PASCALVOC_HEADER = """<annotation>
+    <folder>{folder}</folder>
+    <filename>{filename}</filename>
+    <path>{path}</path>
+    <source>
+        <database>Unknown</database>
+    </source>
+    <size>
+        <width>0</width>
+        <height>0</height>
+        <depth>3</depth>
+    </size>
+    <segmented>0</segmented>
+"""
+
+_PASCALVOC_OBJECT = """    <object>
+        <name>{}</name>
+        <pose>{}</pose>
+        <truncated>{}</truncated>
+        <difficult>{}</difficult>
+        <bndbox>
+            <xmin>{}</xmin>
+            <ymin>{}</ymin>
+            <xmax>{}</xmax>
+            <ymax>{}</ymax>
+        </bndbox>
+    </object>"""
+
+
 # %% Ortho Utils
 def get_tif_transform(tif_file: str):
     """Gets the required tranformation parameters to convert from geospatial coordinates to pixel coords
     Note: From geo to pix: x_pix = (x_geo - x0) / px_w
     from pix to geo: xgeo = x_pix * px_w + x0
+    The transform is read once per raster, and cached until the file changes
     Arguments:
         tif_file (str): path to tif file
 
     Returns:
         x0, px_w, py_w, y0, px_h, py_h: transformation parameters
     """
+    tif_path = os.path.abspath(tif_file)
+    return _read_tif_transform(tif_path, os.stat(tif_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=256)
+def _read_tif_transform(tif_path, mtime_ns):
+    """Reads the geotransform of a raster. Cached by path and modification time"""
+    # GDAL is slow to import, so only imported when a raster is read
+    from osgeo import gdal
     # Read the ortho, get transform params
-    ortho = gdal.Open(tif_file)
+    ortho = gdal.Open(tif_path)
     x0, px_w, py_w, y0, px_h, py_h = ortho.GetGeoTransform()
     return x0, px_w, py_w, y0, px_h, py_h
 
 
+def get_tif_crs(tif_file: str):
+    """Gets the coordinate reference system of a raster, e.g. to keep with boxes converted from its annotations.
+    The CRS is read once per raster, and cached until the file changes
+
+    Arguments:
+        tif_file (str): path to tif file
+
+    Returns:
+        crs (str): the CRS as WKT, or None if the raster has none
+    """
+    tif_path = os.path.abspath(tif_file)
+    return _read_tif_crs(tif_path, os.stat(tif_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=256)
+def _read_tif_crs(tif_path, mtime_ns):
+    """Reads the projection of a raster. Cached by path and modification time"""
+    from osgeo import gdal
+    ortho = gdal.Open(tif_path)
+    return ortho.GetProjection() or None
+
+
 def px_to_geo(boxes: list, tif_file: str, print_csv=False):
-    """Converts boxes from pixel coordinates to geospatial coordinate points
+    """Converts boxes from pixel coordinates to geospatial coordinate points. A list wrapper around px_to_geo_array()
 
     Args:
         boxes (list): returned from read_pascalvoc
@@ -113,45 +225,63 @@ def px_to_geo(boxes: list, tif_file: str, print_csv=False):
         geo_boxes (list): [xmin_geo, ymin_geo, xmax_geo, ymax_geo, label, conf, box_x_geo, box_y_geo]
         Writes a csv file (if print_csv = True) at the tif file location of the tree detection in geospatial coordinates
     """
-    # Init csv
-    if print_csv:
-        csv = open(tif_file.replace('.tif', '_geo.csv'), 'w', newline='')
+    with metrics.stage('box_transform', boxes=len(boxes)):
+        px_boxes = BoxArray.from_list(boxes)
+        geo_boxes = px_to_geo_array(px_boxes, get_tif_transform(tif_file))
+        if print_csv:
+            write_geo_csv(px_boxes, geo_boxes, tif_file)
+        return geo_boxes.to_list()
+
+
+def write_geo_csv(px_boxes: BoxArray, geo_boxes: BoxArray, tif_file: str):
+    """Writes a csv of the tree detections in geospatial coordinates, at the tif file location
+
+    Args:
+        px_boxes (BoxArray): boxes in pixel coordinates
+        geo_boxes (BoxArray): the same boxes in geospatial coordinates, from px_to_geo_array()
+        tif_file (str): path to the associated raster
+
+    Returns:
+        csv_path (str): path the csv was saved
+    """
+    csv_path = tif_file.replace('.tif', '_geo.csv')
+    with open(csv_path, 'w', newline='') as csv:
         csv_writer = writer(csv, delimiter=',')
         fieldnames = ['image_path', 'x', 'y', 'xmin', 'ymin', 'xmax', 'ymax', 'label']
         csv_writer.writerow(fieldnames)
-    # Get the tif transformation
-    x0, px_w, py_w, y0, px_h, py_h = get_tif_transform(tif_file)
-    geo_boxes = []
-    # Iterate through the boxes
-    for box in boxes:
-        xmin = box[0]
-        ymin = box[1]
-        xmax = box[2]
-        ymax = box[3]
-        label = box[4]
-        conf = box[5]
-        # Get the stem location
-        box_x = (xmax - xmin) / 2 + xmin
-        box_y = (ymax - ymin) / 2 + ymin
-        # Convert stem location to geospatial coordaintes
-        box_x_geo = box_x * px_w + x0
-        box_y_geo = box_y * py_h + y0
-        if print_csv:
-            csv_writer.writerow([tif_file, box_x_geo, box_y_geo, xmin, ymin, xmax, ymax, label])
+        csv_writer.writerows(zip([tif_file] * len(px_boxes), geo_boxes.extra1.tolist(), geo_boxes.extra2.tolist(),
+                                 px_boxes.xmin.tolist(), px_boxes.ymin.tolist(), px_boxes.xmax.tolist(),
+                                 px_boxes.ymax.tolist(), px_boxes.label.tolist()))
+    return csv_path
 
-        # Changing boxes to geo coordinates
-        # Note y flips because the axes flip
-        xmin_geo = xmin * px_w + x0
-        xmax_geo = xmax * px_w + x0
-        ymax_geo = ymin * py_h + y0
-        ymin_geo = ymax * py_h + y0
-        geo_boxes.append([xmin_geo, ymin_geo, xmax_geo, ymax_geo, label, conf, box_x_geo, box_y_geo])
-    return geo_boxes
+
+def write_sweep_csv(results: dict, geo_boxes: list, csv_path: str):
+    """Writes the bounds of a parameter sweep (see sweep_z_bounds()) as a tidy csv, one row per box per parameter set
+
+    Args:
+        results (dict): {(bottom_percentile, top_percentile, use_class): (zmin, zmax)}, from sweep_z_bounds()
+        geo_boxes (list or BoxArray): the boxes the sweep was run on
+        csv_path (str): where to save the csv
+
+    Returns:
+        csv_path (str): path the csv was saved
+    """
+    labels = geo_boxes.label.tolist() if isinstance(geo_boxes, BoxArray) else [box[4] for box in geo_boxes]
+    box_ids = list(range(len(labels)))
+    with open(csv_path, 'w', newline='') as csv:
+        csv_writer = writer(csv, delimiter=',')
+        fieldnames = ['box_id', 'label', 'bottom_per', 'top_per', 'use_class', 'zmin', 'zmax']
+        csv_writer.writerow(fieldnames)
+        for (bottom_percentile, top_percentile, use_class), (zmin, zmax) in results.items():
+            n_boxes = len(box_ids)
+            csv_writer.writerows(zip(box_ids, labels, [bottom_percentile] * n_boxes, [top_percentile] * n_boxes,
+                                     [use_class] * n_boxes, zmin.tolist(), zmax.tolist()))
+    return csv_path
 
 
 def geo_to_px(geo_boxes: list, tif_file: str):
     """
-    Converts boxes from geospatial coordinates to pixel coordinates
+    Converts boxes from geospatial coordinates to pixel coordinates. A list wrapper around geo_to_px_array()
 
     Args:
 
@@ -162,31 +292,54 @@ def geo_to_px(geo_boxes: list, tif_file: str):
         px_boxes (list): boxes in pixel coordaintes
 
     """
-    # Get the tif transformation
-    ortho = gdal.Open(tif_file)
-    x0, px_w, py_w, y0, px_h, py_h = ortho.GetGeoTransform()
-    px_boxes = []
-    for box in geo_boxes:
-        xmin_geo = box[0]
-        ymin_geo = box[1]
-        xmax_geo = box[2]
-        ymax_geo = box[3]
-        label = box[4]
-        conf = box[5]
-        xtra1 = box[6]
-        xtra2 = box[7]
-
-        # Changing boxes to geo coordinates
-        # Note y flips because the axes flip
-        xmin = (xmin_geo - x0) / px_w
-        xmax = (xmax_geo - x0) / px_w
-        ymin = (ymax_geo - y0) / py_h
-        ymax = (ymin_geo - y0) / py_h
-        px_boxes.append([xmin, ymin, xmax, ymax, label, conf, xtra1, xtra2])
-    return px_boxes
+    with metrics.stage('box_transform', boxes=len(geo_boxes)):
+        px_boxes = geo_to_px_array(BoxArray.from_list(geo_boxes), get_tif_transform(tif_file))
+        return px_boxes.to_list()
 
 
 # %% LAS utils
+# The number of threads LAZ files are decompressed with (see set_decode_threads()). None is one per core
+_decode_threads = None
+
+
+def set_decode_threads(threads=None):
+    """Sets how many threads LAZ files are decompressed with. More than one (or None) uses laspy's parallel lazrs
+    backend where it is installed, and falls back to a single threaded backend (lazrs or laszip) where it is not.
+    The parallel backend makes its thread pool on first use, so set this before any LAZ file is read
+
+    Args:
+        threads (int): the number of threads. If None, one per core
+    """
+    global _decode_threads
+    _decode_threads = threads
+    if threads is not None:
+        # lazrs decompresses (e.g. COPC nodes) on a rayon thread pool, sized from this when it is made
+        os.environ['RAYON_NUM_THREADS'] = str(max(int(threads), 1))
+
+
+def _laz_backends():
+    """Gets the installed LAZ backends, in the order to try them (see set_decode_threads())"""
+    import laspy as lp
+    backends = [lp.LazBackend.Lazrs, lp.LazBackend.Laszip]
+    if _decode_threads is None or _decode_threads > 1:
+        backends.insert(0, lp.LazBackend.LazrsParallel)
+    return tuple(backend for backend in backends if backend.is_available())
+
+
+def _las_read_kwargs(xyz_class_only=True):
+    """Gets the arguments to read a las file with in laspy 2 (lp.open() or lp.read()). LAZ files are decompressed
+    with the backends of set_decode_threads(), and, if xyz_class_only, only X, Y, Z and classification are decompressed,
+    as they are all the conversion uses. The other dimensions are then left as zeros
+    """
+    import laspy as lp
+    kwargs = {'laz_backend': _laz_backends() or None}
+    # Selective decompression was added in laspy 2.4
+    if xyz_class_only and hasattr(lp, 'DecompressionSelection'):
+        kwargs['decompression_selection'] = (lp.DecompressionSelection.XY_RETURNS_CHANNEL | lp.DecompressionSelection.Z
+                                             | lp.DecompressionSelection.CLASSIFICATION)
+    return kwargs
+
+
 def load_las(las_path):
     """Loads the las file at las_path. For class definitions, find "ASPRS LAS SPECIFICATION 1.4"
 
@@ -197,12 +350,15 @@ def load_las(las_path):
         las_data (np array): points as [X, Y, Z, Class]
         las_transform_dict (dict): transformation parameters of points for LAS coords to geospatial coords
     """
-    if lp.__version__.startswith('1.'):
-        inFile = lp.file.File(las_path, mode='r')
-        las_data = np.vstack([inFile.X, inFile.Y, inFile.Z, inFile.Classification]).transpose()
-    elif lp.__version__.startswith('2.'):
-        inFile = lp.read(las_path)
-        las_data = np.vstack([inFile.X, inFile.Y, inFile.Z, inFile.classification]).transpose()
+    import laspy as lp
+    with metrics.stage('las_decode') as record:
+        if lp.__version__.startswith('1.'):
+            inFile = lp.file.File(las_path, mode='r')
+            las_data = np.vstack([inFile.X, inFile.Y, inFile.Z, inFile.Classification]).transpose()
+        elif lp.__version__.startswith('2.'):
+            inFile = lp.read(las_path, **_las_read_kwargs())
+            las_data = np.vstack([inFile.X, inFile.Y, inFile.Z, inFile.classification]).transpose()
+        record['points'] = len(las_data)
     scalex = inFile.header.scale[0]
     offsetx = inFile.header.offset[0]
     scaley = inFile.header.scale[1]
@@ -218,6 +374,292 @@ def load_las(las_path):
     return las_data, las_transform_dict
 
 
+def get_boxes_extent(geo_boxes: list, buffer=0):
+    """Gets the geospatial extent covered by a set of boxes
+
+    Args:
+        geo_boxes (list or BoxArray): boxes in geospatial coordinates, [xmin_geo, ymin_geo, xmax_geo, ymax_geo, ...] (see px_to_geo())
+        buffer (float): distance to grow the extent by on each side
+
+    Returns:
+        extent (tuple): (xmin, ymin, xmax, ymax) of all the boxes
+    """
+    if isinstance(geo_boxes, BoxArray):
+        xmin, ymin, xmax, ymax = geo_boxes.extent()
+        return xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer
+    if len(geo_boxes) == 0:
+        raise ValueError('Cannot get the extent of an empty set of boxes')
+    xmin = min(float(box[0]) for box in geo_boxes) - buffer
+    ymin = min(float(box[1]) for box in geo_boxes) - buffer
+    xmax = max(float(box[2]) for box in geo_boxes) + buffer
+    ymax = max(float(box[3]) for box in geo_boxes) + buffer
+    return xmin, ymin, xmax, ymax
+
+
+def get_las_transform(las_path):
+    """Reads only the header of the las file at las_path, and gets its transformation parameters
+
+    Args:
+        las_path (str): path to the las file
+
+    Returns:
+        las_transform_dict (dict): transformation parameters of points for LAS coords to geospatial coords
+    """
+    import laspy as lp
+    if lp.__version__.startswith('1.'):
+        inFile = lp.file.File(las_path, mode='r')
+        header = inFile.header
+        inFile.close()
+    else:
+        with lp.open(las_path) as reader:
+            header = reader.header
+    las_transform_dict = {'scalex': header.scale[0], 'offsetx': header.offset[0], 'scaley': header.scale[1],
+                          'offsety': header.offset[1], 'scalez': header.scale[2], 'offsetz': header.offset[2]}
+    return las_transform_dict
+
+
+def get_las_bounds(las_path):
+    """Reads only the header of the las file at las_path, and gets the bounds of its points
+
+    Args:
+        las_path (str): path to the las file
+
+    Returns:
+        mins (np array): (xmin, ymin, zmin) of the points, in geospatial coordinates
+        maxs (np array): (xmax, ymax, zmax) of the points, in geospatial coordinates
+    """
+    import laspy as lp
+    if lp.__version__.startswith('1.'):
+        inFile = lp.file.File(las_path, mode='r')
+        mins, maxs = np.array(inFile.header.min), np.array(inFile.header.max)
+        inFile.close()
+    else:
+        with lp.open(las_path) as reader:
+            mins, maxs = np.array(reader.header.mins), np.array(reader.header.maxs)
+    return mins, maxs
+
+
+def get_las_point_count(las_path):
+    """Reads only the header of the las file at las_path, and gets the number of points in it
+
+    Args:
+        las_path (str): path to the las file
+
+    Returns:
+        n_points (int): the number of points in the file
+    """
+    import laspy as lp
+    if lp.__version__.startswith('1.'):
+        inFile = lp.file.File(las_path, mode='r')
+        n_points = int(inFile.header.point_records_count)
+        inFile.close()
+    else:
+        with lp.open(las_path) as reader:
+            n_points = int(reader.header.point_count)
+    return n_points
+
+
+def is_copc(las_path):
+    """Checks whether a las file is a COPC (cloud optimized point cloud) file, from its header and first VLR only
+
+    Args:
+        las_path (str): path to the las/laz file
+
+    Returns:
+        is_copc (bool): True if the file is COPC
+    """
+    with open(las_path, 'rb') as f:
+        header = f.read(96)
+        if len(header) < 96 or header[:4] != b'LASF':
+            return False
+        f.seek(struct.unpack('<H', header[94:96])[0])
+        vlr = f.read(20)
+    # The first VLR of a COPC file is its info VLR, user id 'copc' and record id 1
+    return len(vlr) == 20 and vlr[2:18].rstrip(b'\0') == b'copc' and struct.unpack('<H', vlr[18:20])[0] == 1
+
+
+def iter_copc_chunks(las_path, extent=None, chunk_size=1_000_000, max_level=None):
+    """Reads only the octree nodes of the COPC file at las_path that overlap extent, so a small extent of a large
+    file decodes only a small part of it. Points are then cropped to extent exactly, as iter_las_chunks() does
+
+    Args:
+        las_path (str): path to the COPC file
+        extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates (see get_boxes_extent()). If None, keeps all points
+        chunk_size (int): the most points to yield at a time
+        max_level (int): if passed, only read the octree down to this level (0 is the root). Each level has about
+        4x the points of the one above, so low levels give an evenly thinned cloud, e.g. for plotting
+
+    Yields:
+        las_data (np array): the kept points as [X, Y, Z, Class], in las coordinates (see load_las())
+    """
+    import laspy as lp
+    # CopcReader always decompresses with lazrs, so it only takes the dimension selection
+    kwargs = {key: value for key, value in _las_read_kwargs().items() if key != 'laz_backend'}
+    with lp.CopcReader.open(las_path, **kwargs) as reader:
+        header = reader.header
+        las_transform_dict = {'scalex': header.scale[0], 'offsetx': header.offset[0], 'scaley': header.scale[1],
+                              'offsety': header.offset[1], 'scalez': header.scale[2], 'offsetz': header.offset[2]}
+        bounds = None
+        if extent is not None:
+            # Pad by a las unit, as the reader rounds its bounds. The points are cropped exactly below
+            bounds = lp.Bounds(mins=np.array([extent[0] - header.scale[0], extent[1] - header.scale[1]]),
+                               maxs=np.array([extent[2] + header.scale[0], extent[3] + header.scale[1]]))
+        level = None if max_level is None else range(0, max_level + 1)
+        points = reader.query(bounds=bounds, level=level)
+    X, Y, Z, Class = np.asarray(points.X), np.asarray(points.Y), np.asarray(points.Z), np.asarray(points.classification)
+    if extent is not None:
+        in_extent = _raw_extent_mask(X, Y, extent, las_transform_dict)
+        X, Y, Z, Class = X[in_extent], Y[in_extent], Z[in_extent], Class[in_extent]
+    for start in range(0, len(X), chunk_size):
+        end = start + chunk_size
+        yield np.vstack([X[start:end], Y[start:end], Z[start:end], Class[start:end]]).transpose()
+
+
+def iter_las_chunks(las_path, extent=None, chunk_size=1_000_000, max_level=None):
+    """Reads the las file at las_path in chunks, keeping only the points within extent.
+    COPC files are read with iter_copc_chunks(), so only the parts of them within extent are decoded
+
+    Args:
+        las_path (str): path to the las file
+        extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates (see get_boxes_extent()). If None, keeps all points
+        chunk_size (int): the number of points to read at a time
+        max_level (int): if passed, and the file is COPC, the deepest octree level to read (see iter_copc_chunks()).
+        Other files are read in full
+
+    Yields:
+        las_data (np array): the kept points of each chunk as [X, Y, Z, Class], in las coordinates (see load_las())
+    """
+    import laspy as lp
+    copc = is_copc(las_path)
+    if max_level is not None and not copc:
+        warnings.warn(f'WARNING: {las_path} is not a COPC file, so max_level is ignored and every point is read')
+    # CopcReader was added in laspy 2.2
+    if copc and hasattr(lp, 'CopcReader'):
+        yield from iter_copc_chunks(las_path, extent, chunk_size, max_level)
+        return
+    # laspy 1.x has no chunked reader; load the whole file and crop it
+    if lp.__version__.startswith('1.'):
+        las_data, las_transform_dict = load_las(las_path)
+        if extent is not None:
+            las_data = las_data[_raw_extent_mask(las_data[:, 0], las_data[:, 1], extent, las_transform_dict)]
+        yield las_data
+        return
+
+    with lp.open(las_path, **_las_read_kwargs()) as reader:
+        header = reader.header
+        las_transform_dict = {'scalex': header.scale[0], 'offsetx': header.offset[0], 'scaley': header.scale[1],
+                              'offsety': header.offset[1], 'scalez': header.scale[2], 'offsetz': header.offset[2]}
+        # Skip the file entirely if it does not overlap the extent
+        if extent is not None and (header.maxs[0] < extent[0] or header.mins[0] > extent[2]
+                                   or header.maxs[1] < extent[1] or header.mins[1] > extent[3]):
+            warnings.warn(f'WARNING: {las_path} does not overlap the extent {extent}')
+            return
+        for points in reader.chunk_iterator(chunk_size):
+            if extent is not None:
+                in_extent = _raw_extent_mask(points.X, points.Y, extent, las_transform_dict)
+                yield np.vstack([points.X[in_extent], points.Y[in_extent], points.Z[in_extent],
+                                 points.classification[in_extent]]).transpose()
+            else:
+                yield np.vstack([points.X, points.Y, points.Z, points.classification]).transpose()
+
+
+def load_las_extent(las_path, extent=None, chunk_size=1_000_000, max_level=None):
+    """Loads only the points of the las file at las_path that are within extent. Reads the file in chunks,
+    so peak memory is set by chunk_size and the number of points kept, not by the size of the file
+
+    Args:
+        las_path (str): path to the las file
+        extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates (see get_boxes_extent()). If None, keeps all points
+        chunk_size (int): the number of points to read at a time
+        max_level (int): if passed, and the file is COPC, the deepest octree level to read (see iter_copc_chunks()).
+        Ignored for other files, which are read (or loaded from cache) in full
+
+    Returns:
+        las_data (np array): points as [X, Y, Z, Class], same as load_las()
+        las_transform_dict (dict): transformation parameters of points for LAS coords to geospatial coords
+    """
+    las_transform_dict = get_las_transform(las_path)
+    kept = list(iter_las_chunks(las_path, extent, chunk_size, max_level))
+    if len(kept) == 0:
+        return np.zeros((0, 4), dtype=np.int32), las_transform_dict
+    las_data = np.concatenate(kept)
+    return las_data, las_transform_dict
+
+
+def load_pointcloud(las_path, extent=None, chunk_size=1_000_000, cache=None, max_level=None):
+    """Loads the points of the las file at las_path that are within extent, straight into a compact PointCloud.
+    Each chunk is projected to geospatial coordinates as it is read, so the whole cloud is never held as a
+    [X, Y, Z, Class] array. The local origin is the lower corner of the extent (or of the file, if extent is None)
+
+    Args:
+        las_path (str): path to the las file
+        extent (tuple): (xmin, ymin, xmax, ymax) in geospatial coordinates (see get_boxes_extent()). If None, keeps all points
+        chunk_size (int): the number of points to read at a time
+        cache (PointCloudCache): optional cache of decoded files. The whole file is cached, and cropped to extent after.
+        On a miss, each chunk is written into the cache as it is decoded, so the fill never holds the whole file.
+        Not used for COPC files read with an extent or max_level, as they only decode what is needed
+        max_level (int): if passed, and the file is COPC, the deepest octree level to read (see iter_copc_chunks()).
+        Ignored for other files, which are read (or loaded from cache) in full
+
+    Returns:
+        pointcloud (PointCloud): the points, in geospatial coordinates
+    """
+    if cache is not None and (max_level is not None or extent is not None) and is_copc(las_path):
+        cache = None
+    if cache is not None:
+        if max_level is not None:
+            warnings.warn(f'WARNING: {las_path} is not a COPC file, so max_level is ignored and every point is read')
+        with metrics.stage('cache_load') as record:
+            pointcloud = cache.load(las_path)
+            record['hit'] = pointcloud is not None
+        if pointcloud is None:
+            origin = np.floor(get_las_bounds(las_path)[0])
+            pointcloud = cache.store_chunks(las_path, _iter_pointcloud_chunks(las_path, None, chunk_size, None, origin),
+                                            get_las_point_count(las_path), origin)
+        if extent is not None:
+            pointcloud = pointcloud.crop(extent)
+        return pointcloud
+
+    mins, _ = get_las_bounds(las_path)
+    if extent is not None:
+        origin = np.floor([extent[0], extent[1], mins[2]])
+    else:
+        origin = np.floor(mins)
+    chunks = list(_iter_pointcloud_chunks(las_path, extent, chunk_size, max_level, origin))
+    return concatenate_pointclouds(chunks, origin)
+
+
+def _iter_pointcloud_chunks(las_path, extent, chunk_size, max_level, origin):
+    """Reads the points of a las file within extent a chunk at a time (see iter_las_chunks()), and yields each chunk
+    projected into a PointCloud with the given origin
+    """
+    las_transform_dict = get_las_transform(las_path)
+    # Decode the next chunk on a thread while this one is projected
+    reader = prefetch(iter_las_chunks(las_path, extent, chunk_size, max_level))
+    with closing(reader):
+        while True:
+            # Time reading and projecting separately. With the read ahead, las_decode is the time spent waiting on it
+            with metrics.stage('las_decode') as record:
+                las_data = next(reader, None)
+                record['points'] = 0 if las_data is None else len(las_data)
+            if las_data is None:
+                break
+            with metrics.stage('projection', points=len(las_data)):
+                pointcloud = PointCloud.from_las_data(las_data, las_transform_dict, origin)
+            yield pointcloud
+
+
+def _raw_extent_mask(X, Y, extent, las_transform_dict):
+    """Gets which raw (integer, unscaled) las coordinates are within a geospatial extent. Rounds the extent outwards,
+    so a point right on the edge is kept
+    """
+    xmin = np.floor((extent[0] - las_transform_dict['offsetx']) / las_transform_dict['scalex'])
+    xmax = np.ceil((extent[2] - las_transform_dict['offsetx']) / las_transform_dict['scalex'])
+    ymin = np.floor((extent[1] - las_transform_dict['offsety']) / las_transform_dict['scaley'])
+    ymax = np.ceil((extent[3] - las_transform_dict['offsety']) / las_transform_dict['scaley'])
+    return (X >= xmin) & (X <= xmax) & (Y >= ymin) & (Y <= ymax)
+
+
 def project_las_geospatial(las_data, las_transform_dict):
     """Converts las points from las coordinates to geospatial coordinates
 
@@ -238,16 +680,17 @@ def project_las_geospatial(las_data, las_transform_dict):
     return transformed_las_data
 
 
-def get_tree_from_las(tree_box: list, pointcloud):
+def get_tree_from_las(tree_box: list, pointcloud, index=None):
     """Inputs the pointcloud and the bounding box. Returns a subset of the pointcloud containing only points that are within the tree box.
         !!tree_box and pointcloud must be in the same coordinate system !!
 
     Arguments:
         tree_box (list): the tree bounding box, [xmin, ymin, xmax, ymax, ...]
-        pointcloud: the pointcloud to subset from
+        pointcloud (PointCloud or np array): the pointcloud to subset from
+        index (GridIndex): optional spatial index built on pointcloud, used to find the points in the box without scanning the whole cloud
 
     Returns:
-        tree_pc: subset of pointcloud containing only points within tree_box bounds.
+        tree_pc: subset of pointcloud (of the same type) containing only points within tree_box bounds.
     """
 
     # Get vertices from tree box
@@ -257,14 +700,18 @@ def get_tree_from_las(tree_box: list, pointcloud):
     ymax = tree_box[3]
 
     # Calculate indices based on bounds
-    bound_x = np.logical_and(pointcloud[:, 0] > xmin, pointcloud[:, 0] < xmax)
-    bound_y = np.logical_and(pointcloud[:, 1] > ymin, pointcloud[:, 1] < ymax)
-    pc_ind = np.logical_and(bound_x, bound_y)
-
-    # Raise a warning incase no points are found
-    if len(pc_ind) == 0:
-        warnings.warn('WARNING: No points found within tree bounding box! Are boxes and the pointcloud in the same coordinate system?')
+    if index is not None:
+        pc_ind = index.query(tree_box)
+    else:
+        x, y, _, _, origin = get_columns(pointcloud)
+        bound_x = np.logical_and(x > xmin - origin[0], x < xmax - origin[0])
+        bound_y = np.logical_and(y > ymin - origin[1], y < ymax - origin[1])
+        pc_ind = np.logical_and(bound_x, bound_y)
 
     # Return subset
     tree_pc = pointcloud[pc_ind]
+
+    # Raise a warning incase no points are found
+    if len(tree_pc) == 0:
+        warnings.warn('WARNING: No points found within tree bounding box! Are boxes and the pointcloud in the same coordinate system?')
     return tree_pc
@@ -5,5 +5,17 @@ Created on Mon Apr 17 17:16:15 2023
 @author: Liam
 """
 
-import rgbtolasinator.figures.pc_figures
-import rgbtolasinator.figures.tif_figures
\ No newline at end of file
+import importlib
+
+# Modules are imported on first use, so plotting side views does not import PIL and GDAL for the tif figures
+_SUBMODULES = ['pc_figures', 'tif_figures']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
@@ -8,10 +8,16 @@ Created on Wed Apr 12 11:20:58 2023
 import numpy as np
 import os
 from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
 import warnings
 from rgbtolasinator.converter.utils import get_tree_from_las
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.pointcloud import get_columns
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from rgbtolasinator import metrics
 
 
 def _tree_cmap():
@@ -32,44 +38,94 @@ def _tree_cmap():
     return treecmap
 
 
-def plot_tree_projection(boxes: list, pointcloud, save_folder):
+@metrics.timed('plot_tree_projection')
+def plot_tree_projection(boxes: list, pointcloud, save_folder, index=None, workers=1, max_points=None):
     """
     Plots a 2d projection of the trees. POINTCLOUD and BOXES BOTH IN GEO COORDINATES (See  project_las_geospatial() and px_to_geo())
+    Each process draws every tree on one reused figure, so memory stays constant however many trees are plotted
 
     Args:
         boxes (list): List of tree bounding boxes.
-        pointcloud (np array): The pointcloud the trees are in
+        pointcloud (PointCloud or np array): The pointcloud the trees are in
         save_folder (str): path to the folder to save the plots to
+        index (GridIndex): spatial index built on pointcloud. If None, one is built
+        workers (int): the number of processes to plot with
+        max_points (int): if passed, trees with more points are thinned to this many (evenly spaced) points before plotting
 
     Returns:
         Plots :)
     """
-    cmap = _tree_cmap()
-    ii = 0
+    if index is None:
+        index = GridIndex(pointcloud)
     pbar = tqdm(total=len(boxes))
+    tasks = _iter_tree_tasks(boxes, pointcloud, index, save_folder, max_points)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Keep a bounded number of trees in flight, so queued points do not pile up
+            pending = set()
+            for task in tasks:
+                pending.add(pool.submit(_render_tree, task))
+                if len(pending) >= workers * 4:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        pbar.update(1)
+            for future in pending:
+                future.result()
+                pbar.update(1)
+    else:
+        for task in tasks:
+            _render_tree(task)
+            pbar.update(1)
+    pbar.close()
+
+
+def _iter_tree_tasks(boxes, pointcloud, index, save_folder, max_points):
+    """Gets the points of each tree, and what is needed to plot it"""
+    ii = 0
     for tree in boxes:
-        tree_pc = get_tree_from_las(tree, pointcloud)
+        tree_pc = get_tree_from_las(tree, pointcloud, index=index)
         if len(tree_pc) == 0:
             warnings.warn('No points within the tree box; Tree #' + str(ii))
             continue
-        # Plot the 2d projection
-        fig, axs = plt.subplots(1, 1)
-        # Plot the height bars
-        height_min = float(tree[6])
-        height_max = float(tree[7])
-        axs.axhline(y=height_max, color='r', linestyle='-', linewidth=3)
-        axs.axhline(y=height_min, color='r', linestyle='-', linewidth=3)
-        # Plot tree pc
-        axs.scatter(tree_pc[:, 0], tree_pc[:, 2], s=0.25, c=tree_pc[:, 2], cmap=cmap)
-        axs.set_xticks([])
-        axs.set_xlabel('Projection of Tree in x-z Plane')
-        axs.set_ylabel('Height (m)')
-        axs.axis('scaled')
-        fig.tight_layout()
-        # fig.show()
+        tree_x, _, tree_z, _, origin = get_columns(tree_pc)
+        # Thin dense trees
+        if max_points is not None and len(tree_x) > max_points:
+            keep = np.linspace(0, len(tree_x) - 1, max_points).astype(np.int64)
+            tree_x = tree_x[keep]
+            tree_z = tree_z[keep]
         filename = str(ii) + '.png'
         d = os.path.join(save_folder, filename)
-        fig.savefig(d, dpi=150)
+        yield d, float(tree[6]), float(tree[7]), tree_x + origin[0], tree_z + origin[2]
         ii += 1
-        pbar.update(1)
-    pbar.close()
+
+
+# The figure each process draws on, made once by _render_tree()
+_renderer = {}
+
+
+def _render_tree(task):
+    """Plots the 2d projection of one tree, reusing the figure of this process"""
+    d, height_min, height_max, tree_x, tree_z = task
+    if 'fig' not in _renderer:
+        _renderer['fig'] = Figure()
+        FigureCanvasAgg(_renderer['fig'])
+        _renderer['cmap'] = _tree_cmap()
+    fig = _renderer['fig']
+    # Reset the figure, including the margins set by the last tight_layout
+    fig.clf()
+    fig.subplots_adjust(**{key: plt.rcParams['figure.subplot.' + key] for key in ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']})
+    # Plot the 2d projection
+    axs = fig.add_subplot(1, 1, 1)
+    # Plot the height bars
+    axs.axhline(y=height_max, color='r', linestyle='-', linewidth=3)
+    axs.axhline(y=height_min, color='r', linestyle='-', linewidth=3)
+    # Plot tree pc
+    axs.scatter(tree_x, tree_z, s=0.25, c=tree_z, cmap=_renderer['cmap'])
+    axs.set_xticks([])
+    axs.set_xlabel('Projection of Tree in x-z Plane')
+    axs.set_ylabel('Height (m)')
+    axs.axis('scaled')
+    fig.tight_layout()
+    fig.savefig(d, dpi=150)
+    return d
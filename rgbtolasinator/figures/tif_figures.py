@@ -9,10 +9,15 @@ from PIL import Image, ImageDraw, ImageFont
 from osgeo import gdal
 import numpy as np
 import os
-from rgbtolasinator.converter.utils import geo_to_px
+from rgbtolasinator.converter.utils import geo_to_px, get_tif_transform
+from rgbtolasinator.converter.boxes import BoxArray, geo_to_px_array
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import matplotlib
+from rgbtolasinator import metrics
 
 
+@metrics.timed('plot_height_tif')
 def plot_height_tif(geo_boxes: list, tif_file: str, save_folder: str, linewidth=4):
     """ Draws xml boxes on the image specified. Writes the tree number on each box, to correlate with the output from plot_tree_projection().
     Colors the boxes based on the estimated tree height
@@ -38,7 +43,7 @@ def plot_height_tif(geo_boxes: list, tif_file: str, save_folder: str, linewidth=
     px_boxes = geo_to_px(geo_boxes, tif_file)
 
     # Init cmap
-    cmap = matplotlib.cm.get_cmap('viridis')
+    cmap = matplotlib.colormaps['viridis']
     max_height = 0
     for box in px_boxes:
         height = float(box[7])
@@ -54,7 +59,8 @@ def plot_height_tif(geo_boxes: list, tif_file: str, save_folder: str, linewidth=
         ymin = box[1]
         xmax = box[2]
         ymax = box[3]
-        relative_height = float(box[7]) / max_height
+        # All boxes get the lowest color if none has a height above 0
+        relative_height = float(box[7]) / max_height if max_height > 0 else 0
         color = cmap(relative_height)[0:3]
         color = [int(x*255) for x in color]
         color = '#{:02x}{:02x}{:02x}'.format(color[0], color[1], color[2])
@@ -80,3 +86,125 @@ def plot_height_tif(geo_boxes: list, tif_file: str, save_folder: str, linewidth=
     outdata = None
     ds = None
     return out_path
+
+
+@metrics.timed('plot_height_tif_tiled')
+def plot_height_tif_tiled(geo_boxes: list, tif_file: str, save_folder: str, linewidth=4, block_size=2048, compress='DEFLATE',
+                          cog=False, workers=1):
+    """ Same as plot_height_tif(), but reads, draws and writes the image one block at a time through GDAL, so the
+    whole ortho is never held in memory. Only the boxes that overlap a block are drawn on it.
+    Writes a tiled, compressed GeoTIFF (or a Cloud Optimized GeoTIFF if cog=True)
+
+    Arguments:
+        geo_boxes (list): CONVERTED xml boxes
+        tif_file (str): the path to the image that was annotated
+        save_folder (str): path to save the annotated tif
+        linewidth (int): the box line thickness
+        block_size (int): the width and height of a block, in pixels. Rounded up to a multiple of 16
+        compress (str): the GeoTIFF compression, e.g. 'DEFLATE', 'LZW' or 'NONE'
+        cog (bool): whether to write a Cloud Optimized GeoTIFF
+        workers (int): the number of threads to draw blocks with
+
+    Returns:
+        The path where the annotated image is saved
+        Prints a geospatially projected tif in the save_folder, filename now ending in '_drawn_boxes.tif'
+    """
+    block_size = int(np.ceil(block_size / 16) * 16)
+    ds = gdal.Open(tif_file)
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+
+    # Convert boxes back to pixel coords for drawing
+    px_boxes = geo_to_px_array(BoxArray.from_list(geo_boxes), get_tif_transform(tif_file))
+
+    # Get the color of each box from its height
+    cmap = matplotlib.colormaps['viridis']
+    heights = px_boxes.extra2.astype(float)
+    # Boxes with a NaN height (e.g. no points) do not set the scale, as in plot_height_tif()
+    max_height = max(np.nanmax(heights), 0) if np.any(~np.isnan(heights)) else 0
+    colors = []
+    for height in heights:
+        color = cmap(height / max_height if max_height > 0 else 0)[0:3]
+        color = [int(x*255) for x in color]
+        colors.append('#{:02x}{:02x}{:02x}'.format(color[0], color[1], color[2]))
+    font = ImageFont.truetype("fonts/arial.ttf", size=90)
+
+    # Get the area each box draws on, including its outline and tree number
+    text_extent = np.array([font.getbbox(str(tree_num))[2:] for tree_num in range(len(px_boxes))]).reshape(-1, 2)
+    draw_xmin = np.minimum(px_boxes.xmin, px_boxes.xmax) - linewidth
+    draw_ymin = np.minimum(px_boxes.ymin, px_boxes.ymax) - linewidth
+    draw_xmax = np.maximum(px_boxes.xmax + text_extent[:, 0], px_boxes.xmin) + linewidth
+    draw_ymax = np.maximum(px_boxes.ymax + text_extent[:, 1], px_boxes.ymin) + linewidth
+
+    # Make the tiled output
+    out_path = os.path.join(save_folder, tif_file.replace('.tif', '_drawn_boxes.tif'))
+    write_path = out_path + '.tmp.tif' if cog else out_path
+    driver = gdal.GetDriverByName('GTiff')
+    options = ['TILED=YES', f'BLOCKXSIZE={block_size}', f'BLOCKYSIZE={block_size}', f'COMPRESS={compress}', 'BIGTIFF=IF_SAFER']
+    outdata = driver.Create(write_path, cols, rows, 3, gdal.GDT_Byte, options=options)
+    outdata.SetGeoTransform(ds.GetGeoTransform())
+    outdata.SetProjection(ds.GetProjection())
+
+    def _draw_block(window):
+        x_off, y_off, arr = window
+        block_rows, block_cols = arr.shape[:2]
+        # Draw only the boxes that overlap the block
+        overlapping = np.flatnonzero((draw_xmax >= x_off) & (draw_xmin <= x_off + block_cols)
+                                     & (draw_ymax >= y_off) & (draw_ymin <= y_off + block_rows))
+        if len(overlapping) == 0:
+            return x_off, y_off, arr
+        # PIL rounds coordinates towards zero, so draw on a canvas that starts left of and above every box
+        # (or at the image corner). The boxes keep the same whole pixel offsets as when drawn on the full image
+        canvas_x = int(min(x_off, max(np.floor(min(px_boxes.xmin[overlapping].min(), px_boxes.xmax[overlapping].min())), 0)))
+        canvas_y = int(min(y_off, max(np.floor(min(px_boxes.ymin[overlapping].min(), px_boxes.ymax[overlapping].min())), 0)))
+        canvas = np.zeros((block_rows + y_off - canvas_y, block_cols + x_off - canvas_x, 3), dtype=np.uint8)
+        canvas[y_off - canvas_y:, x_off - canvas_x:] = arr
+        im = Image.fromarray(canvas)
+        draw = ImageDraw.Draw(im)
+        for tree_num in overlapping:
+            xmin = px_boxes.xmin[tree_num] - canvas_x
+            ymin = px_boxes.ymin[tree_num] - canvas_y
+            xmax = px_boxes.xmax[tree_num] - canvas_x
+            ymax = px_boxes.ymax[tree_num] - canvas_y
+            draw.rectangle([xmin, ymin, xmax, ymax], fill=None, outline=colors[tree_num], width=linewidth)
+            draw.text([xmax, ymax], str(tree_num), font=font)
+        return x_off, y_off, np.array(im)[y_off - canvas_y:, x_off - canvas_x:]
+
+    def _read_blocks():
+        for y_off in range(0, rows, block_size):
+            for x_off in range(0, cols, block_size):
+                yield x_off, y_off, _read_rgb_window(ds, x_off, y_off, min(block_size, cols - x_off), min(block_size, rows - y_off))
+
+    # Read and write in this thread (GDAL datasets are not thread safe), draw in the pool
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque()
+        for window in _read_blocks():
+            pending.append(pool.submit(_draw_block, window))
+            if len(pending) >= max(workers, 1) * 2:
+                _write_rgb_window(outdata, *pending.popleft().result())
+        while pending:
+            _write_rgb_window(outdata, *pending.popleft().result())
+    outdata.FlushCache()
+    outdata = None
+    ds = None
+
+    # Rewrite as a Cloud Optimized GeoTIFF
+    if cog:
+        gdal.Translate(out_path, write_path, format='COG', creationOptions=[f'COMPRESS={compress}'])
+        os.remove(write_path)
+    return out_path
+
+
+def _read_rgb_window(ds, x_off, y_off, block_cols, block_rows):
+    """Reads a window of a raster as an RGB uint8 array (rows, cols, 3), as Image.convert('RGB') would give"""
+    n_bands = ds.RasterCount
+    bands = [1, 2, 3] if n_bands >= 3 else [1, 1, 1]
+    arr = np.empty((block_rows, block_cols, 3), dtype=np.uint8)
+    for channel, band in enumerate(bands):
+        arr[:, :, channel] = ds.GetRasterBand(band).ReadAsArray(x_off, y_off, block_cols, block_rows, buf_type=gdal.GDT_Byte)
+    return arr
+
+
+def _write_rgb_window(outdata, x_off, y_off, arr):
+    """Writes an RGB array (rows, cols, 3) to a window of the output raster"""
+    for channel in range(3):
+        outdata.GetRasterBand(channel + 1).WriteArray(arr[:, :, channel], x_off, y_off)
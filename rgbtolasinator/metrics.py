@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:12:33 2026
+
+@author: Liam
+"""
+
+import functools
+import json
+import sys
+import threading
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then not recorded
+    resource = None
+
+# Callbacks given every finished stage. Empty while metrics are off, so stages cost next to nothing
+_hooks = []
+
+# The default bins of observe(), e.g. for the number of points per box
+HISTOGRAM_BINS = [0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, np.inf]
+
+
+def enabled():
+    """Checks whether any hook is listening, so callers can skip work that only feeds the metrics
+
+    Returns:
+        enabled (bool): True if stages are being recorded
+    """
+    return len(_hooks) > 0
+
+
+def add_hook(callback):
+    """Adds a callback that is given a dict for every finished stage (see stage()) and histogram (see observe())
+
+    Args:
+        callback (function): called with one dict. Stages have 'name', 'wall_seconds', 'cpu_seconds',
+        'process_peak_rss_mb' (the peak of the whole process so far, not of the stage, see stage()) and any fields set
+        on the stage. Histograms have 'name', 'histogram', 'bins' and 'counts'. Hooks are per process, so stages run in
+        ProcessPoolExecutor workers (e.g. parallel and batch runs with workers > 1) never reach them
+    """
+    _hooks.append(callback)
+
+
+def remove_hook(callback):
+    """Removes a callback added with add_hook()
+
+    Args:
+        callback (function): the callback to remove
+    """
+    if callback in _hooks:
+        _hooks.remove(callback)
+
+
+def _peak_rss_mb():
+    """Gets the peak resident memory of the process so far, in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class _IgnoredRecord(dict):
+    """The record of a stage while metrics are off. Fields set on it are dropped"""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class _NullStage:
+    """A stage that records nothing, used while metrics are off"""
+
+    _record = _IgnoredRecord()
+
+    def __enter__(self):
+        return self._record
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Times a stage, then gives its record to every hook"""
+
+    def __init__(self, name, fields):
+        self.record = {'name': name}
+        self.record.update(fields)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record['wall_seconds'] = time.perf_counter() - self._wall
+        self.record['cpu_seconds'] = time.process_time() - self._cpu
+        self.record['process_peak_rss_mb'] = _peak_rss_mb()
+        self.record['failed'] = exc_info[0] is not None
+        # Keep the record json serializable, e.g. when counts are numpy ints
+        for key, value in self.record.items():
+            if isinstance(value, np.generic):
+                self.record[key] = value.item()
+        for callback in list(_hooks):
+            callback(self.record)
+        return False
+
+
+def stage(name, **fields):
+    """Records the wall time, CPU time and peak RSS of a block of code, e.g. "with stage('las_decode') as record:".
+    Counts can be added to the record inside the block (e.g. record['points'] = n). Does nothing while metrics are off.
+    The peak RSS is the high-water mark of the whole process when the stage ends, so a stage that runs after a larger
+    one reports that stage's peak. Stages run in other processes (e.g. ProcessPoolExecutor workers) are not recorded
+
+    Args:
+        name (str): the name of the stage
+        fields: extra fields to record, e.g. points=n
+
+    Returns:
+        a context manager, whose value is the stage's record (dict)
+    """
+    if not _hooks:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def timed(name):
+    """Decorates a function so each call is recorded as a stage (see stage())
+
+    Args:
+        name (str): the name of the stage
+
+    Returns:
+        the decorator
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fn(*args, **kwargs)
+            with _Stage(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, values, bins=None):
+    """Records a histogram of values, e.g. the number of points in each box. Does nothing while metrics are off
+
+    Args:
+        name (str): the name of the histogram
+        values (np array): the values
+        bins (list): the bin edges. If None, HISTOGRAM_BINS
+    """
+    if not _hooks:
+        return
+    bins = HISTOGRAM_BINS if bins is None else bins
+    counts, _ = np.histogram(np.asarray(values), bins=bins)
+    # An open ended last bin is saved as None, as json has no infinity
+    event = {'name': name, 'histogram': True, 'bins': [float(edge) if np.isfinite(edge) else None for edge in bins],
+             'counts': counts.tolist()}
+    for callback in list(_hooks):
+        callback(event)
+
+
+class Metrics:
+    """Collects the stages and histograms of a run, e.g. to save as json. Start it with enable()"""
+
+    def __init__(self):
+        self.stages = []
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def __call__(self, event):
+        with self._lock:
+            if event.get('histogram'):
+                # Histograms with the same name and bins add up across batches
+                histogram = self.histograms.setdefault(event['name'], {'bins': event['bins'], 'counts': [0] * len(event['counts'])})
+                if histogram['bins'] == event['bins']:
+                    histogram['counts'] = [total + count for total, count in zip(histogram['counts'], event['counts'])]
+            else:
+                self.stages.append(dict(event))
+
+    def summary(self):
+        """Totals the stages by name
+
+        Returns:
+            summary (dict): for each stage name, the number of 'calls', and the summed 'wall_seconds', 'cpu_seconds'
+            and numeric fields (e.g. 'points'), and the highest 'process_peak_rss_mb'
+        """
+        summary = {}
+        with self._lock:
+            stages = list(self.stages)
+        for record in stages:
+            total = summary.setdefault(record['name'], {'calls': 0})
+            total['calls'] += 1
+            for key, value in record.items():
+                if key in ('name', 'failed') or not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                if key == 'process_peak_rss_mb':
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = total.get(key, 0) + value
+        return summary
+
+    def to_dict(self):
+        """Gets everything collected, as a json serializable dict
+
+        Returns:
+            metrics (dict): 'wall_seconds' since enable(), 'peak_rss_mb', the 'summary', every 'stages' record and the 'histograms'
+        """
+        with self._lock:
+            stages = [dict(record) for record in self.stages]
+            histograms = {name: dict(histogram) for name, histogram in self.histograms.items()}
+        return {'wall_seconds': time.perf_counter() - self._start, 'peak_rss_mb': _peak_rss_mb(),
+                'summary': self.summary(), 'stages': stages, 'histograms': histograms}
+
+    def save(self, json_path):
+        """Saves everything collected as json
+
+        Args:
+            json_path (str): where to save the metrics
+
+        Returns:
+            json_path (str): path the metrics were saved
+        """
+        with open(json_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return json_path
+
+
+def enable():
+    """Starts collecting metrics
+
+    Returns:
+        metrics (Metrics): the collector. Stop it with disable(metrics)
+    """
+    metrics = Metrics()
+    add_hook(metrics)
+    return metrics
+
+
+def disable(metrics):
+    """Stops a collector started with enable()
+
+    Args:
+        metrics (Metrics): the collector
+    """
+    remove_hook(metrics)
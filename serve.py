@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 11:02:51 2026
+
+@author: Liam
+"""
+# Import General
+import argparse
+
+# Import from package
+from rgbtolasinator.converter.server import PointCloudStore, make_server
+from rgbtolasinator.converter.cache import PointCloudCache
+from rgbtolasinator.converter.utils import set_decode_threads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='int, the port to listen on')
+    parser.add_argument('--socket', type=str, default=None, help='if passed, listen on this unix socket instead of --host and --port')
+    parser.add_argument('--memory', type=float, default=8, help='float, the most memory the resident pointclouds can use, in GB')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--cache-dir', type=str, default=None, help='if passed, folder to cache decoded las files in, so restarts skip decoding')
+    parser.add_argument('--decode-threads', type=int, default=None, help='int, the number of threads to decompress LAZ files with. Defaults to one per core, 1 decodes on a single thread')
+    parser.add_argument('--cache-size', type=float, default=20, help='float, the largest the las cache can grow to, in GB')
+
+    args = parser.parse_args()
+    set_decode_threads(args.decode_threads)
+
+    las_cache = PointCloudCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    store = PointCloudStore(max_bytes=int(args.memory * 1024 ** 3), chunk_size=args.chunk_size, cache=las_cache)
+    server = make_server(store, args.host, args.port, args.socket)
+    print(f'Serving on {args.socket or f"http://{args.host}:{args.port}"}, POST /convert or GET /status\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopping...\n')
+    finally:
+        server.server_close()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:40:12 2026
+
+@author: Liam
+"""
+# Import General
+import argparse
+import os
+
+# Import from package
+from rgbtolasinator.converter.convert import sweep_z_bounds
+from rgbtolasinator.converter.utils import read_pascalvoc, px_to_geo, load_pointcloud, get_boxes_extent, write_sweep_csv
+from rgbtolasinator.converter.spatial_index import GridIndex
+from rgbtolasinator.converter.cache import PointCloudCache
+from rgbtolasinator.converter.catalog import LasCatalog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--las-file', type=str, help='path to the las file, or a folder/glob of las tiles')
+    parser.add_argument('--xml-file', type=str, help='path to PascalVOC image annotations')
+    parser.add_argument('--tif-file', type=str, help='path to the geospatially projected tif file the annotations are associated with')
+    parser.add_argument('--save-path', type=str, default='sweep.csv', help='where to save the table of bounds (ends in .csv)')
+    parser.add_argument('--bottom-per', type=float, nargs='+', default=[1], help='floats, the percentiles to try as the bottom of the tree')
+    parser.add_argument('--top-per', type=float, nargs='+', default=[99], help='floats, the percentiles to try as the top of the tree')
+    parser.add_argument('--use-class', type=str, default='no', choices=['no', 'yes', 'both'], help='whether to use class to define bounds (see convert_annots.py), or to try both')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='int, the number of las points to read at a time. Lower uses less memory')
+    parser.add_argument('--cache-dir', type=str, default=None, help='if passed, folder to cache decoded las files in, so later runs on the same file skip decoding')
+    parser.add_argument('--cache-size', type=float, default=20, help='float, the largest the las cache can grow to, in GB')
+
+    args = parser.parse_args()
+
+    print('Loading Annotations...\n')
+    # Load annots
+    name, px_boxes = read_pascalvoc(args.xml_file)
+    geo_boxes = px_to_geo(px_boxes, args.tif_file)
+    print('Annotations Loaded!\n')
+
+    print('Loading LiDAR...\n')
+    # Load PC once, keeping only the points under the annotations
+    las_cache = PointCloudCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    if os.path.isfile(args.las_file):
+        las_data = load_pointcloud(args.las_file, get_boxes_extent(geo_boxes), chunk_size=args.chunk_size, cache=las_cache)
+    else:
+        # A folder of tiles, only load the tiles under the annotations
+        las_data = LasCatalog(args.las_file).load(get_boxes_extent(geo_boxes), chunk_size=args.chunk_size, cache=las_cache)
+    las_index = GridIndex(las_data)
+    print('LiDAR Loaded!\n')
+
+    print('Sweeping...\n')
+    class_modes = {'no': [False], 'yes': [True], 'both': [False, True]}[args.use_class]
+    results = sweep_z_bounds(geo_boxes, las_data, args.bottom_per, args.top_per, class_modes, index=las_index)
+    print(f'Swept {len(results)} parameter sets!\n')
+
+    print('Writing file...\n')
+    write_sweep_csv(results, geo_boxes, args.save_path)
+    print(f'File saved to {args.save_path}!\n')
+    print('Complete!\n')